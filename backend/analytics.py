@@ -0,0 +1,57 @@
+"""Staffing coverage: assignment counts per store, day and shift type.
+
+Counts come from the employee_shifts index of each schedule (one entry per
+employee per shift), so the days themselves are never loaded.
+"""
+import calendar
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+COVERAGE_SHIFT_TYPES = ["day", "night", "custom"]
+
+
+def period_dates(months: List[Tuple[int, int]]) -> List[str]:
+    return [
+        f"{year:04d}-{month:02d}-{day:02d}"
+        for year, month in months
+        for day in range(1, calendar.monthrange(year, month)[1] + 1)
+    ]
+
+
+def coverage_counts(store_ids: List[str], dates: List[str],
+                    schedules: Iterable[dict]) -> np.ndarray:
+    """store × date × shift type matrix of assigned employees"""
+    store_index = {store_id: i for i, store_id in enumerate(store_ids)}
+    date_index = {date: i for i, date in enumerate(dates)}
+    type_index = {shift_type: i for i, shift_type in enumerate(COVERAGE_SHIFT_TYPES)}
+
+    stores, days, types = [], [], []
+    for schedule in schedules:
+        s = store_index.get(schedule["store_id"])
+        if s is None:
+            continue
+        for entry in schedule.get("employee_shifts", []):
+            d = date_index.get(entry.get("date"))
+            if d is not None:
+                stores.append(s)
+                days.append(d)
+                types.append(type_index[entry["type"]])
+
+    counts = np.zeros((len(store_ids), len(dates), len(COVERAGE_SHIFT_TYPES)), dtype=np.int64)
+    np.add.at(counts, (np.array(stores, dtype=np.int64), np.array(days, dtype=np.int64),
+                       np.array(types, dtype=np.int64)), 1)
+    return counts
+
+
+def coverage_report(stores: List[dict], months: List[Tuple[int, int]], schedules: Iterable[dict]) -> Dict:
+    dates = period_dates(months)
+    counts = coverage_counts([store["id"] for store in stores], dates, schedules)
+    return {
+        "months": [{"year": year, "month": month} for year, month in months],
+        "dates": dates,
+        "stores": stores,
+        "shift_types": COVERAGE_SHIFT_TYPES,
+        "counts": {shift_type: counts[:, :, i].tolist() for i, shift_type in enumerate(COVERAGE_SHIFT_TYPES)},
+        "total": counts.sum(axis=2).tolist(),
+    }
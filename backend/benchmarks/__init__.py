@@ -0,0 +1,5 @@
+"""Performance benchmarks for the backend.
+
+Run from the ``backend`` directory, e.g. ``python -m benchmarks.concurrency``.
+Benchmarks talk to the MongoDB at ``MONGO_URL`` and use their own database.
+"""
@@ -0,0 +1,77 @@
+"""Minimal in-process ASGI client used by the benchmarks.
+
+Requests go straight into the app without sockets, so the numbers reflect
+the handlers and the event loop rather than the network stack.
+"""
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+async def call_asgi(app, method: str, path: str, body: Optional[dict] = None,
+                    headers: Optional[Dict[str, str]] = None) -> Tuple[int, bytes]:
+    """Send one HTTP request to an ASGI app and return (status, body)."""
+    path, _, query = path.partition("?")
+    payload = json.dumps(body).encode() if body is not None else b""
+    raw_headers = [(b"content-type", b"application/json")]
+    for key, value in (headers or {}).items():
+        raw_headers.append((key.lower().encode(), value.encode()))
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "headers": raw_headers,
+        "client": ("127.0.0.1", 0),
+        "server": ("testserver", 80),
+    }
+    sent = False
+    response = {"status": 0, "body": []}
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return response["status"], b"".join(response["body"])
+
+
+async def timed_call(app, method: str, path: str, **kwargs) -> Tuple[int, float]:
+    """Like call_asgi but return (status, latency in seconds)."""
+    started = time.perf_counter()
+    status, _ = await call_asgi(app, method, path, **kwargs)
+    return status, time.perf_counter() - started
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: List[float], elapsed: float) -> dict:
+    """Throughput and latency percentiles (milliseconds) for one run."""
+    return {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies, default=0) * 1000, 2),
+    }
@@ -0,0 +1,101 @@
+"""Event-loop blocking benchmark: synchronous pymongo vs Motor.
+
+Both apps expose the same ``async def`` route doing the lookups that
+``get_current_user`` and ``get_schedule`` perform. The "before" app calls the
+blocking ``MongoClient`` (as server.py did), the "after" app awaits Motor.
+Each app is driven by N concurrent clients and p50/p95/p99 latencies are
+printed as JSON.
+
+    python -m benchmarks.concurrency --clients 200 --requests 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+
+from fastapi import FastAPI
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+
+from benchmarks.asgi import timed_call, summarize
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+BENCH_DB = os.environ.get("BENCH_DB_NAME", "bench_concurrency")
+
+
+def seed(users: int) -> list:
+    db = MongoClient(MONGO_URL)[BENCH_DB]
+    db.users.drop()
+    db.schedules.drop()
+    ids = [str(uuid.uuid4()) for _ in range(users)]
+    db.users.insert_many([{"id": user_id, "email": f"{user_id}@bench", "role": "employee"} for user_id in ids])
+    db.schedules.insert_one({
+        "id": str(uuid.uuid4()), "store_id": "bench", "year": 2024, "month": 1,
+        "days": [{"date": f"2024-01-{day:02d}", "day_shift": None, "night_shift": None, "custom_shifts": []}
+                 for day in range(1, 32)],
+    })
+    return ids
+
+
+def blocking_app() -> FastAPI:
+    app = FastAPI()
+    db = MongoClient(MONGO_URL)[BENCH_DB]
+
+    @app.get("/api/lookup/{user_id}")
+    async def lookup(user_id: str):
+        user = db.users.find_one({"id": user_id}, {"_id": 0})
+        schedule = db.schedules.find_one({"store_id": "bench", "year": 2024, "month": 1}, {"_id": 0})
+        return {"user": user["id"], "days": len(schedule["days"])}
+
+    return app
+
+
+def motor_app() -> FastAPI:
+    app = FastAPI()
+    db = AsyncIOMotorClient(MONGO_URL)[BENCH_DB]
+
+    @app.get("/api/lookup/{user_id}")
+    async def lookup(user_id: str):
+        user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        schedule = await db.schedules.find_one({"store_id": "bench", "year": 2024, "month": 1}, {"_id": 0})
+        return {"user": user["id"], "days": len(schedule["days"])}
+
+    return app
+
+
+async def drive(app: FastAPI, user_ids: list, clients: int, requests: int) -> dict:
+    latencies = []
+
+    async def client(worker: int):
+        for i in range(requests):
+            user_id = user_ids[(worker * requests + i) % len(user_ids)]
+            status, latency = await timed_call(app, "GET", f"/api/lookup/{user_id}")
+            if status != 200:
+                raise RuntimeError(f"Unexpected status {status}")
+            latencies.append(latency)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(worker) for worker in range(clients)))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+async def main(clients: int, requests: int, users: int):
+    user_ids = seed(users)
+    results = {"clients": clients, "requests_per_client": requests}
+    for name, factory in [("pymongo_blocking", blocking_app), ("motor", motor_app)]:
+        app = factory()
+        await drive(app, user_ids, min(clients, 10), 2)  # warm up connection pools
+        results[name] = await drive(app, user_ids, clients, requests)
+    MongoClient(MONGO_URL).drop_database(BENCH_DB)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=20, help="requests per client")
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.clients, args.requests, args.users))
@@ -0,0 +1,124 @@
+"""Synthetic documents shaped like the ones the API writes.
+
+``ScheduleBuilder`` makes month schedules as create_schedule saves them
+(employee_shifts index and version included), with assignment earnings as
+update_shift_earnings or the default-earnings job leave them: shifts past
+their editing deadline by ``as_of`` carry earnings set by the employee, the
+manager or the job, later ones none. The benchmarks use ``make_schedule``;
+datagen.py builds whole datasets from the same builder.
+"""
+import calendar
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import bcrypt
+
+from server import BCRYPT_ROUNDS, DEFAULT_EARNINGS, build_employee_shift_index, earnings_deadline
+
+EARNINGS_CHOICES = [1800.0, 2000.0, 2200.0, 2500.0, 3000.0]
+
+
+def make_id(rng: random.Random) -> str:
+    """A uuid4 drawn from rng, so the same seed gives the same ids"""
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    """bcrypt hash for seeded users, computed in this process"""
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+class ScheduleBuilder:
+    """Month schedules of a store: day and night shift every day, sometimes one custom shift.
+
+    Shifts dated after as_of have no earnings yet; with as_of None every shift
+    is past its deadline. Employees without an entry in names get a generic one.
+    """
+
+    def __init__(self, day_headcount: int = 2, night_headcount: int = 2, custom_ratio: float = 0.2,
+                 employee_set_ratio: float = 0.5, manager_set_ratio: float = 0.1, as_of: Optional[str] = None,
+                 manager_id: str = "bench", names: Optional[Dict[str, str]] = None):
+        self.headcount = {"day": day_headcount, "night": night_headcount}
+        self.custom_ratio = custom_ratio
+        self.employee_set_ratio = employee_set_ratio
+        self.manager_set_ratio = manager_set_ratio
+        self.as_of = as_of
+        self.manager_id = manager_id
+        self.names = names or {}
+
+    def schedule(self, store_id: str, year: int, month: int, employee_ids: List[str], rng: random.Random) -> dict:
+        per_day = min(len(employee_ids), self.headcount["day"] + self.headcount["night"] + 1)
+        days, edits = [], 0
+        for day in range(1, calendar.monthrange(year, month)[1] + 1):
+            date = f"{year:04d}-{month:02d}-{day:02d}"
+            # Shifts after as_of are still open; the deadline is parsed once per day
+            deadline = earnings_deadline(date) if self.as_of is None or date <= self.as_of else None
+            staff = rng.sample(employee_ids, per_day)
+            day_staff = staff[:self.headcount["day"]]
+            night_staff = staff[self.headcount["day"]:self.headcount["day"] + self.headcount["night"]]
+            custom_shifts = []
+            if staff[len(day_staff) + len(night_staff):] and rng.random() < self.custom_ratio:
+                custom_shifts.append(self.shift("custom", deadline, staff[-1:], rng, hours=8))
+            days.append({
+                "date": date,
+                "day_shift": self.shift("day", deadline, day_staff, rng) if day_staff else None,
+                "night_shift": self.shift("night", deadline, night_staff, rng) if night_staff else None,
+                "custom_shifts": custom_shifts,
+            })
+            edits += sum(assignment["earnings_set_by"] not in (None, "auto")
+                         for shift in [days[-1]["day_shift"], days[-1]["night_shift"]] + custom_shifts if shift
+                         for assignment in shift["assignments"])
+        return {
+            "id": make_id(rng),
+            "store_id": store_id,
+            "month": month,
+            "year": year,
+            "days": days,
+            "employee_shifts": build_employee_shift_index(days),
+            "created_by": self.manager_id,
+            "updated_at": datetime(year, month, 1) - timedelta(days=3),
+            # Saved once, then one version per earnings update
+            "version": 1 + edits,
+        }
+
+    def shift(self, shift_type: str, deadline: Optional[datetime], employee_ids: List[str], rng: random.Random,
+              hours: Optional[int] = None) -> dict:
+        return {
+            "type": shift_type,
+            "assignments": [self.assignment(employee_id, deadline, rng) for employee_id in employee_ids],
+            "hours": hours,
+            "notes": None,
+        }
+
+    def assignment(self, employee_id: str, deadline: Optional[datetime], rng: random.Random) -> dict:
+        assignment = {"employee_id": employee_id,
+                      "employee_name": self.names.get(employee_id) or f"Employee {employee_id[:8]}",
+                      "earnings": None, "earnings_set_at": None, "earnings_set_by": None, "can_edit_earnings": True}
+        if deadline is None:
+            return assignment
+        roll = rng.random()
+        if roll < self.employee_set_ratio:
+            # The employee entered it before the deadline (update_shift_earnings)
+            assignment.update(earnings=rng.choice(EARNINGS_CHOICES), earnings_set_by=employee_id,
+                              earnings_set_at=deadline - timedelta(minutes=rng.randrange(1, 12 * 60)))
+        elif roll < self.employee_set_ratio + self.manager_set_ratio:
+            assignment.update(earnings=rng.choice(EARNINGS_CHOICES), earnings_set_by=self.manager_id,
+                              earnings_set_at=deadline + timedelta(minutes=rng.randrange(1, 7 * 24 * 60)))
+        else:
+            # The default-earnings job filled it in after the deadline
+            assignment.update(earnings=DEFAULT_EARNINGS, earnings_set_by="auto", can_edit_earnings=False,
+                              earnings_set_at=deadline + timedelta(minutes=rng.randrange(1, 6)))
+        return assignment
+
+
+def make_schedule(store_id: str, year: int, month: int, employee_ids: List[str],
+                  rng: random.Random, per_shift: int = 2) -> dict:
+    return ScheduleBuilder(day_headcount=per_shift, night_headcount=per_shift).schedule(
+        store_id, year, month, employee_ids, rng)
+
+
+def make_months(start_year: int, months: int):
+    """(year, month) pairs for a run of consecutive months."""
+    return [(start_year + m // 12, m % 12 + 1) for m in range(months)]
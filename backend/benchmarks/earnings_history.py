@@ -0,0 +1,151 @@
+"""Earnings history: Python loops vs aggregation pipeline vs earnings_rollups lookup.
+
+Seeds a store-by-month dataset (default 50 stores x 36 months) and times each
+way of getting one employee's monthly totals, plus the bytes each one pulls
+from MongoDB.
+
+    python -m benchmarks.earnings_history --stores 50 --months 36
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from typing import List
+
+import bson
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from benchmarks.dataset import make_months, make_schedule
+from server import schedule_rollups
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+BENCH_DB = os.environ.get("BENCH_DB_NAME", "bench_earnings_history")
+
+
+async def python_history(collection, store_id: str, employee_id: str):
+    """The handler as it was: every schedule of the store over the wire, summed in Python."""
+    history, wire_bytes = [], 0
+    async for schedule in collection.find({"store_id": store_id}):
+        wire_bytes += len(bson.encode(schedule))
+        month_earnings = month_shifts = 0
+        for day in schedule.get("days", []):
+            shifts = [day.get("day_shift"), day.get("night_shift")] + day.get("custom_shifts", [])
+            for shift in shifts:
+                if not shift:
+                    continue
+                for assignment in shift.get("assignments", []):
+                    if assignment["employee_id"] == employee_id and assignment.get("earnings"):
+                        month_earnings += assignment["earnings"]
+                        month_shifts += 1
+        if month_shifts:
+            history.append({"year": schedule["year"], "month": schedule["month"],
+                            "total_earnings": month_earnings, "total_shifts": month_shifts})
+    history.sort(key=lambda x: (x["year"], x["month"]), reverse=True)
+    return history, wire_bytes
+
+
+def earnings_history_pipeline(store_id: str, employee_id: str) -> List[dict]:
+    """The aggregation get_earnings_history ran before earnings_rollups: only monthly totals leave MongoDB."""
+    return [
+        # Only schedules whose employee_shifts index lists the employee
+        {"$match": {
+            "store_id": store_id,
+            "$or": [
+                {"employee_shifts.employee_id": employee_id},
+                {"employee_shifts": {"$exists": False}}
+            ]
+        }},
+        {"$project": {"_id": 0, "year": 1, "month": 1, "days": 1}},
+        {"$unwind": "$days"},
+        {"$project": {"year": 1, "month": 1, "shifts": {"$concatArrays": [
+            {"$filter": {
+                "input": ["$days.day_shift", "$days.night_shift"],
+                "cond": {"$ne": ["$$this", None]}
+            }},
+            {"$ifNull": ["$days.custom_shifts", []]}
+        ]}}},
+        {"$unwind": "$shifts"},
+        {"$unwind": "$shifts.assignments"},
+        {"$match": {
+            "shifts.assignments.employee_id": employee_id,
+            "shifts.assignments.earnings": {"$nin": [None, 0]}
+        }},
+        {"$group": {
+            "_id": {"year": "$year", "month": "$month"},
+            "total_earnings": {"$sum": "$shifts.assignments.earnings"},
+            "total_shifts": {"$sum": 1}
+        }},
+        # Newest months first
+        {"$sort": {"_id.year": -1, "_id.month": -1}},
+        {"$project": {
+            "_id": 0,
+            "year": "$_id.year",
+            "month": "$_id.month",
+            "total_earnings": 1,
+            "total_shifts": 1,
+            "average_per_shift": {"$round": [{"$divide": ["$total_earnings", "$total_shifts"]}, 2]}
+        }},
+    ]
+
+
+async def pipeline_history(collection, store_id: str, employee_id: str):
+    history = await collection.aggregate(earnings_history_pipeline(store_id, employee_id)).to_list(None)
+    return history, sum(len(bson.encode(row)) for row in history)
+
+
+async def rollup_history(collection, store_id: str, employee_id: str):
+    rollups = collection.database.earnings_rollups
+    history = await rollups.find(
+        {"store_id": store_id, "employee_id": employee_id, "paid_shifts": {"$gt": 0}}, {"_id": 0}
+    ).sort([("year", -1), ("month", -1)]).to_list(None)
+    return history, sum(len(bson.encode(row)) for row in history)
+
+
+async def main(stores: int, months: int, employees: int, repeat: int):
+    client = AsyncIOMotorClient(MONGO_URL)
+    await client.drop_database(BENCH_DB)
+    collection = client[BENCH_DB].schedules
+    await collection.create_index([("store_id", 1), ("year", 1), ("month", 1)], unique=True)
+    await collection.create_index([("store_id", 1), ("employee_shifts.employee_id", 1)])
+    rollups = client[BENCH_DB].earnings_rollups
+    await rollups.create_index([("store_id", 1), ("employee_id", 1), ("year", 1), ("month", 1)], unique=True)
+
+    rng = random.Random(42)
+    staff = {f"store-{s}": [f"emp-{s}-{e}" for e in range(employees)] for s in range(stores)}
+    for store_id, employee_ids in staff.items():
+        schedules = [make_schedule(store_id, year, month, employee_ids, rng)
+                     for year, month in make_months(2022, months)]
+        await collection.insert_many(schedules)
+        await rollups.insert_many([rollup for schedule in schedules
+                                   for rollup in schedule_rollups(schedule).values()])
+
+    results = {"stores": stores, "months": months, "employees_per_store": employees}
+    for name, compute in [("python_loops", python_history), ("aggregation", pipeline_history),
+                          ("rollups", rollup_history)]:
+        timings, wire_bytes = [], 0
+        for i in range(repeat):
+            store_id = f"store-{i % stores}"
+            started = time.perf_counter()
+            _, wire_bytes = await compute(collection, store_id, staff[store_id][0])
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        results[name] = {
+            "median_ms": round(timings[len(timings) // 2] * 1000, 2),
+            "max_ms": round(timings[-1] * 1000, 2),
+            "bytes_from_db": wire_bytes,
+        }
+
+    await client.drop_database(BENCH_DB)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stores", type=int, default=50)
+    parser.add_argument("--months", type=int, default=36)
+    parser.add_argument("--employees", type=int, default=15, help="employees per store")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.stores, args.months, args.employees, args.repeat))
@@ -0,0 +1,184 @@
+"""Load test of the main API endpoints against a local MongoDB.
+
+Seeds a synthetic dataset (default 10 stores x 30 employees x 6 months) into
+its own database, BENCH_DB_NAME, never the app's DB_NAME. Then drives each
+endpoint in turn on the real app with N concurrent clients and prints
+throughput and p50/p95/p99 latency per endpoint as JSON. The output carries
+the git commit and the parameters, so runs saved with --output can be diffed
+between commits.
+
+    python -m benchmarks.endpoints --clients 32 --requests 20 --output before.json
+
+Endpoints: login, my_shifts, schedule_get, schedule_put (POST /api/schedules),
+earnings_update and earnings_history; --endpoints runs a subset.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import time
+import uuid
+from datetime import datetime
+
+# Always a separate database: the script drops it at start and exit, so it must never
+# be the app's DB_NAME from the environment
+BENCH_DB = os.environ.get("BENCH_DB_NAME", "bench_endpoints")
+os.environ["DB_NAME"] = BENCH_DB
+
+from benchmarks.asgi import call_asgi, summarize  # noqa: E402
+from benchmarks.dataset import make_months, make_schedule  # noqa: E402
+
+ENDPOINTS = ("login", "my_shifts", "schedule_get", "schedule_put", "earnings_update", "earnings_history")
+PASSWORD = "bench-password"
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+async def seed_database(server, stores: int, employees: int, months: int, rng: random.Random) -> dict:
+    """Stores, users and schedules in the bench database; returns what the requests need"""
+    await server.client.drop_database(BENCH_DB)
+    await server.ensure_indexes(server.db)
+    hashed = await server.hash_password(PASSWORD)  # also warms up the worker pool
+
+    manager_id = str(uuid.uuid4())
+    users = [{"id": manager_id, "email": "bench-manager@example.com", "name": "Bench Manager",
+              "password": hashed, "role": "manager", "store_ids": [], "created_at": datetime.now()}]
+    store_ids = [str(uuid.uuid4()) for _ in range(stores)]
+    staff = {store_id: [str(uuid.uuid4()) for _ in range(employees)] for store_id in store_ids}
+    for s, (store_id, employee_ids) in enumerate(staff.items()):
+        users += [{"id": employee_id, "email": f"bench-{s}-{e}@example.com", "name": f"Bench {s}-{e}",
+                   "password": hashed, "role": "employee", "store_ids": [store_id], "created_at": datetime.now()}
+                  for e, employee_id in enumerate(employee_ids)]
+    await server.users_collection.insert_many(users)
+    await server.stores_collection.insert_many([
+        {"id": store_id, "name": f"Bench store {s}", "address": "", "created_at": datetime.now(),
+         "is_active": True, "version": 1}
+        for s, store_id in enumerate(store_ids)
+    ])
+
+    schedules, shifts = [], []
+    for store_id, employee_ids in staff.items():
+        for year, month in make_months(2024, months):
+            schedule = make_schedule(store_id, year, month, employee_ids, rng)
+            schedule["version"] = 1
+            schedules.append(schedule)
+            shifts += [(store_id, year, month, entry["date"], entry["employee_id"])
+                       for entry in schedule["employee_shifts"] if entry["type"] == "day"]
+    await server.schedules_collection.insert_many(schedules)
+    await server.earnings_rollups_collection.insert_many([
+        rollup for schedule in schedules for rollup in server.schedule_rollups(schedule).values()
+    ])
+
+    return {
+        "manager_token": server.create_access_token({"sub": manager_id, "role": "manager"}),
+        "employees": [(user["email"], user["id"], user["store_ids"][0]) for user in users[1:]],
+        "employee_tokens": {user["id"]: server.create_access_token({"sub": user["id"], "role": "employee"})
+                            for user in users[1:]},
+        "schedules": [(s["store_id"], s["year"], s["month"]) for s in schedules],
+        # JSON round trip turns the seeded datetimes into strings the request models accept
+        "days": {(s["store_id"], s["year"], s["month"]): json.loads(json.dumps(s["days"], default=str))
+                 for s in schedules},
+        "shifts": shifts,
+    }
+
+
+def make_request(endpoint: str, data: dict, rng: random.Random):
+    """(method, path, body, token) of one request to the endpoint"""
+    manager = data["manager_token"]
+    if endpoint == "login":
+        email, _, _ = rng.choice(data["employees"])
+        return "POST", "/api/auth/login", {"email": email, "password": PASSWORD}, None
+    if endpoint == "my_shifts":
+        _, employee_id, store_id = rng.choice(data["employees"])
+        _, year, month = rng.choice(data["schedules"])
+        return "GET", f"/api/my-shifts/{store_id}/{year}/{month}", None, data["employee_tokens"][employee_id]
+    if endpoint == "schedule_get":
+        store_id, year, month = rng.choice(data["schedules"])
+        return "GET", f"/api/schedules/{store_id}/{year}/{month}", None, manager
+    if endpoint == "schedule_put":
+        store_id, year, month = rng.choice(data["schedules"])
+        body = {"store_id": store_id, "year": year, "month": month, "days": data["days"][(store_id, year, month)]}
+        return "POST", "/api/schedules", body, manager
+    if endpoint == "earnings_update":
+        store_id, year, month, date, employee_id = rng.choice(data["shifts"])
+        path = f"/api/shift-earnings/{store_id}/{year}/{month}/{date}/day?employee_id={employee_id}"
+        return "PUT", path, {"earnings": rng.choice([1800.0, 2000.0, 2500.0])}, manager
+    if endpoint == "earnings_history":
+        _, employee_id, store_id = rng.choice(data["employees"])
+        return "GET", f"/api/earnings-history/{store_id}", None, data["employee_tokens"][employee_id]
+    raise ValueError(f"Unknown endpoint {endpoint}")
+
+
+async def drive(app, endpoint: str, data: dict, clients: int, requests: int, seed: int) -> dict:
+    latencies, statuses = [], {}
+
+    async def client(worker: int):
+        rng = random.Random(seed * 1000 + worker)
+        for _ in range(requests):
+            method, path, body, token = make_request(endpoint, data, rng)
+            headers = {"Authorization": f"Bearer {token}"} if token else None
+            started = time.perf_counter()
+            status, _ = await call_asgi(app, method, path, body, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(worker) for worker in range(clients)))
+    return {**summarize(latencies, time.perf_counter() - started), "statuses": statuses}
+
+
+async def main(endpoints, clients: int, requests: int, stores: int, employees: int, months: int,
+               rounds: int, seed: int, output: str):
+    os.environ["BCRYPT_ROUNDS"] = str(rounds)
+    import server
+
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    data = await seed_database(server, stores, employees, months, rng)
+    seeded = time.perf_counter() - started
+
+    results = {
+        "commit": git_commit(),
+        "clients": clients,
+        "requests_per_client": requests,
+        "dataset": {"stores": stores, "employees_per_store": employees, "months": months,
+                    "schedules": len(data["schedules"]), "seed_seconds": round(seeded, 2)},
+        "bcrypt_rounds": rounds,
+        "endpoints": {},
+    }
+    for endpoint in endpoints:
+        await drive(server.app, endpoint, data, min(clients, 4), 2, seed)  # warm up caches and pools
+        results["endpoints"][endpoint] = await drive(server.app, endpoint, data, clients, requests, seed)
+
+    server.password_hasher.shutdown()
+    await server.client.drop_database(BENCH_DB)
+    report = json.dumps(results, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=20, help="requests per client and endpoint")
+    parser.add_argument("--stores", type=int, default=10)
+    parser.add_argument("--employees", type=int, default=30, help="employees per store")
+    parser.add_argument("--months", type=int, default=6)
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    asyncio.run(main(args.endpoints, args.clients, args.requests, args.stores, args.employees, args.months,
+                     args.rounds, args.seed, args.output))
@@ -0,0 +1,79 @@
+"""Login throughput with bcrypt in the process pool.
+
+Seeds users into a separate database (BENCH_DB_NAME, never the app's DB_NAME),
+then drives POST /api/auth/login on the real app with N concurrent clients and
+reports logins/sec overall and per worker core, along with latency percentiles
+and how many logins were shed with 503.
+
+    python -m benchmarks.login_throughput --clients 64 --logins 500 --workers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+# Always a separate database: the script drops it at start and exit, so it must never
+# be the app's DB_NAME from the environment
+BENCH_DB = os.environ.get("BENCH_DB_NAME", "bench_login")
+os.environ["DB_NAME"] = BENCH_DB
+
+from benchmarks.asgi import call_asgi, summarize  # noqa: E402
+
+
+async def main(clients: int, logins: int, users: int, rounds: int, workers: int, queue_limit: int):
+    os.environ["BCRYPT_ROUNDS"] = str(rounds)
+    if workers:
+        os.environ["PASSWORD_WORKERS"] = str(workers)
+    if queue_limit:
+        os.environ["PASSWORD_QUEUE_LIMIT"] = str(queue_limit)
+    import server
+
+    await server.client.drop_database(BENCH_DB)
+    password = "bench-password"
+    hashed = await server.hash_password(password)  # also warms up the worker pool
+    await server.users_collection.insert_many([{
+        "id": f"bench-{i}", "email": f"bench-{i}@example.com", "name": f"Bench {i}",
+        "password": hashed, "role": "employee", "store_ids": [],
+    } for i in range(users)])
+
+    latencies, statuses = [], {}
+    counter = iter(range(logins))
+
+    async def client():
+        for i in counter:
+            started = time.perf_counter()
+            status, _ = await call_asgi(server.app, "POST", "/api/auth/login",
+                                        {"email": f"bench-{i % users}@example.com", "password": password})
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+
+    successful = statuses.get(200, 0)
+    results = {
+        "clients": clients,
+        "bcrypt_rounds": rounds,
+        "workers": server.password_hasher.workers,
+        "statuses": statuses,
+        "logins_per_sec": round(successful / elapsed, 1),
+        "logins_per_sec_per_core": round(successful / elapsed / server.password_hasher.workers, 1),
+        "latency": summarize(latencies, elapsed),
+    }
+    server.password_hasher.shutdown()
+    await server.client.drop_database(BENCH_DB)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--logins", type=int, default=500)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor")
+    parser.add_argument("--workers", type=int, default=0, help="pool size (default: CPU count)")
+    parser.add_argument("--queue-limit", type=int, default=0, help="pending hash limit (default: 8 per worker)")
+    args = parser.parse_args()
+    asyncio.run(main(args.clients, args.logins, args.users, args.rounds, args.workers, args.queue_limit))
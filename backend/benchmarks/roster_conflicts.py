@@ -0,0 +1,60 @@
+"""Roster conflict detection over every schedule of one month.
+
+Builds a month for many stores (default 50 stores x 40 employees = 2,000
+employees, a tenth of them also working in a neighbouring store) and times
+flattening the assignments plus the vectorized checks, without MongoDB.
+
+    python -m benchmarks.roster_conflicts --stores 50 --employees 40
+"""
+import argparse
+import json
+import random
+import time
+
+from benchmarks.dataset import make_schedule
+from conflicts import RosterRules, find_conflicts
+from server import employee_assignments, shift_hours
+
+
+def main(stores: int, employees: int, per_shift: int, repeat: int):
+    rng = random.Random(42)
+    staff = {f"store-{s}": [f"emp-{s}-{e}" for e in range(employees)] for s in range(stores)}
+    # Floaters: part of every store's staff is shared with the next store
+    for s in range(stores):
+        staff[f"store-{s}"] += staff[f"store-{(s + 1) % stores}"][:employees // 10]
+    schedules = [make_schedule(store_id, 2024, 1, employee_ids, rng, per_shift=per_shift)
+                 for store_id, employee_ids in staff.items()]
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        assignments = [
+            (s["store_id"], assignment["employee_id"], date, shift_type, shift_hours(shift, shift_type))
+            for s in schedules
+            for date, shift_type, shift, _, assignment in employee_assignments(s)
+        ]
+        conflicts = find_conflicts(2024, 1, assignments, RosterRules())
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+
+    counts = {}
+    for conflict in conflicts:
+        counts[conflict["type"]] = counts.get(conflict["type"], 0) + 1
+    print(json.dumps({
+        "stores": stores,
+        "employees": stores * employees,
+        "assignments": len(assignments),
+        "conflicts": counts,
+        "median_ms": round(timings[len(timings) // 2] * 1000, 2),
+        "max_ms": round(timings[-1] * 1000, 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stores", type=int, default=50)
+    parser.add_argument("--employees", type=int, default=40, help="employees per store")
+    parser.add_argument("--per-shift", type=int, default=8, help="employees per day/night shift")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    main(args.stores, args.employees, args.per_shift, args.repeat)
@@ -0,0 +1,64 @@
+"""Automatic roster generation for synthetic stores.
+
+Generates one month for several stores at once (default 4 stores x 75
+employees = 300, a tenth of each store's staff also assigned to the next
+store), then checks the result with the conflict detector.
+
+    python -m benchmarks.roster_generation --stores 4 --employees 75
+"""
+import argparse
+import json
+import time
+
+from conflicts import RosterRules, find_conflicts
+from roster import generate_rosters
+
+
+def main(stores: int, employees: int, day_headcount: int, night_headcount: int, repeat: int):
+    staff = {f"store-{s}": [f"emp-{s}-{e}" for e in range(employees)] for s in range(stores)}
+    for s in range(stores):
+        staff[f"store-{s}"] += staff[f"store-{(s + 1) % stores}"][:employees // 10]
+    headcount = {"day": day_headcount, "night": night_headcount}
+    hours = {"day": 12, "night": 12}
+    rules = RosterRules()
+
+    timings = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        rosters, unfilled = generate_rosters(2024, 1, staff, headcount, hours, rules, seed=i)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+
+    assignments = [
+        (store_id, employee_id, date, shift_type, hours[shift_type])
+        for store_id, roster in rosters.items()
+        for date, shifts in roster.items()
+        for shift_type, employee_ids in shifts.items()
+        for employee_id in employee_ids
+    ]
+    worked = {}
+    for _, employee_id, _, _, shift_hours in assignments:
+        worked[employee_id] = worked.get(employee_id, 0) + shift_hours
+    totals = [worked.get(e, 0) for e in {e for ids in staff.values() for e in ids}]
+    print(json.dumps({
+        "stores": stores,
+        "employees": stores * employees,
+        "shifts_assigned": len(assignments),
+        "shifts_unfilled": sum(u["missing"] for u in unfilled),
+        "conflicts": len(find_conflicts(2024, 1, assignments, rules)),
+        "hours_min": min(totals),
+        "hours_max": max(totals),
+        "median_ms": round(timings[len(timings) // 2] * 1000, 2),
+        "max_ms": round(timings[-1] * 1000, 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stores", type=int, default=4)
+    parser.add_argument("--employees", type=int, default=75, help="employees per store")
+    parser.add_argument("--day-headcount", type=int, default=20)
+    parser.add_argument("--night-headcount", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    main(args.stores, args.employees, args.day_headcount, args.night_headcount, args.repeat)
@@ -0,0 +1,83 @@
+"""POST /api/schedules body ingestion: ScheduleCreate models vs dict payload.
+
+Builds the JSON body of a large month (default 31 days, 10 employees per day
+and night shift, 5 custom shifts of 4 a day) and times what happens to it
+before anything reaches MongoDB, the way FastAPI runs it: json.loads, then
+either ScheduleCreate validation plus day.dict() for every day (the previous
+path) or ScheduleCreatePayload validation straight into dicts plus the
+storage_days pass with the date checks.
+
+    python -m benchmarks.schedule_ingest --per-shift 10 --custom-shifts 5
+"""
+import argparse
+import json
+import random
+import time
+import warnings
+
+from pydantic import TypeAdapter
+
+from server import ScheduleCreate, ScheduleCreatePayload, storage_days
+
+
+def make_body(employees: int, per_shift: int, custom_shifts: int, rng: random.Random) -> bytes:
+    employee_ids = [f"emp-{e}" for e in range(employees)]
+
+    def assignments(count: int):
+        return [{"employee_id": e, "employee_name": f"Employee {e}",
+                 "earnings": rng.choice([None, 2000.0, 2500.0])} for e in rng.sample(employee_ids, count)]
+
+    days = [{
+        "date": f"2024-01-{day:02d}",
+        "day_shift": {"type": "day", "assignments": assignments(per_shift), "hours": 12, "notes": None},
+        "night_shift": {"type": "night", "assignments": assignments(per_shift), "hours": 12, "notes": None},
+        "custom_shifts": [{"type": "custom", "assignments": assignments(4), "hours": 8, "notes": None}
+                          for _ in range(custom_shifts)],
+    } for day in range(1, 32)]
+    return json.dumps({"store_id": "store-0", "year": 2024, "month": 1, "days": days}).encode()
+
+
+def model_path(body: bytes):
+    schedule_data = ScheduleCreate.model_validate(json.loads(body))
+    return [day.dict() for day in schedule_data.days]
+
+
+def payload_path(adapter: TypeAdapter, body: bytes):
+    return storage_days(adapter.validate_python(json.loads(body)))[0]
+
+
+def measure(ingest, body: bytes, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        ingest(body)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {"median_ms": round(timings[len(timings) // 2] * 1000, 3), "max_ms": round(timings[-1] * 1000, 3)}
+
+
+def main(employees: int, per_shift: int, custom_shifts: int, repeat: int):
+    warnings.simplefilter("ignore", DeprecationWarning)  # .dict() on pydantic 2
+    body = make_body(employees, per_shift, custom_shifts, random.Random(42))
+    adapter = TypeAdapter(ScheduleCreatePayload)
+    # Both paths must store the same days
+    assert json.dumps(model_path(body), default=str) == json.dumps(payload_path(adapter, body), default=str)
+
+    results = {
+        "body_bytes": len(body),
+        "assignments": 31 * (2 * per_shift + 4 * custom_shifts),
+        "models_and_dict": measure(model_path, body, repeat),
+        "payload_dicts": measure(lambda b: payload_path(adapter, b), body, repeat),
+    }
+    results["speedup"] = round(results["models_and_dict"]["median_ms"] / results["payload_dicts"]["median_ms"], 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--employees", type=int, default=60)
+    parser.add_argument("--per-shift", type=int, default=10, help="employees per day/night shift")
+    parser.add_argument("--custom-shifts", type=int, default=5, help="custom shifts of 4 per day")
+    parser.add_argument("--repeat", type=int, default=100)
+    args = parser.parse_args()
+    main(args.employees, args.per_shift, args.custom_shifts, args.repeat)
@@ -0,0 +1,86 @@
+"""Response serialization of one month schedule: jsonable_encoder + json vs orjson.
+
+Builds a 31-day schedule for 40 employees as get_schedule returns it and times
+turning {"schedule": ...} into bytes the way FastAPI does for a returned dict
+(jsonable_encoder, then json.dumps in JSONResponse) against FastJSONResponse,
+which renders it with orjson in one pass. The compact representation
+(compact.py) is measured as JSON and, with msgpack installed, as MessagePack.
+No MongoDB needed.
+
+    python -m benchmarks.serialization --employees 40 --repeat 200
+"""
+import argparse
+import json
+import random
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from benchmarks.dataset import make_schedule
+from compact import compact_schedule, encode_msgpack, msgpack_available
+from responses import FastJSONResponse, dumps, use_orjson
+
+
+def default_response(content) -> bytes:
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def fast_response(content) -> bytes:
+    return FastJSONResponse(content).body
+
+
+def compact_json(content) -> bytes:
+    return dumps({"schedule": compact_schedule(content["schedule"])})
+
+
+def compact_msgpack(content) -> bytes:
+    return encode_msgpack({"schedule": compact_schedule(content["schedule"])})
+
+
+def measure(render, content, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = render(content)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        "median_ms": round(timings[len(timings) // 2] * 1000, 3),
+        "max_ms": round(timings[-1] * 1000, 3),
+        "bytes": len(body),
+    }
+
+
+def main(employees: int, per_shift: int, repeat: int):
+    rng = random.Random(42)
+    schedule = make_schedule("store-0", 2024, 1, [f"emp-{e}" for e in range(employees)], rng, per_shift=per_shift)
+    schedule.pop("employee_shifts")  # not part of the response
+    content = {"schedule": schedule}
+
+    if not use_orjson(True):
+        raise SystemExit("orjson is not installed")
+    results = {
+        "days": len(schedule["days"]),
+        "employees": employees,
+        "assignments": sum(len(shift["assignments"]) for day in schedule["days"]
+                           for shift in [day["day_shift"], day["night_shift"]] + day["custom_shifts"]),
+        "jsonable_encoder_json": measure(default_response, content, repeat),
+        "orjson": measure(fast_response, content, repeat),
+        "compact_json": measure(compact_json, content, repeat),
+    }
+    if msgpack_available():
+        results["compact_msgpack"] = measure(compact_msgpack, content, repeat)
+    results["speedup"] = round(results["jsonable_encoder_json"]["median_ms"] / results["orjson"]["median_ms"], 1)
+    # Both paths must produce the same document
+    assert json.loads(default_response(content)) == json.loads(fast_response(content))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--employees", type=int, default=40)
+    parser.add_argument("--per-shift", type=int, default=8, help="employees per day/night shift")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    main(args.employees, args.per_shift, args.repeat)
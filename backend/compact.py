@@ -0,0 +1,163 @@
+"""Compact columnar representation of month schedules.
+
+The regular representation nests DaySchedule -> Shift -> ShiftAssignment and
+repeats the employee name and the earnings metadata in every assignment. The
+compact one keeps each distinct (employee_id, employee_name) once and turns
+shifts and assignments into parallel arrays::
+
+    {"format": "compact/1", "id": ..., "store_id": ..., "year": 2024, "month": 1,
+     "version": 3, "created_by": ..., "updated_at": 1706745600000,
+     "dates": ["2024-01-01", ...],
+     "employees": {"id": [...], "name": [...]},
+     "setters": ["auto", "<manager id>"],
+     "shifts": {"day": [0, 0, 1, ...], "slot": [0, 1, 0, ...], "hours": [...], "notes": [...],
+                "size": [2, 2, 3, ...]},
+     "assignments": {"employee": [...], "earnings": [...], "set_at": [...], "set_by": [...],
+                     "can_edit": [...]}}
+
+``shifts`` lists every present shift day by day: the day shift (slot 0), the
+night shift (slot 1), then custom shifts (slot 2) in order. ``day`` indexes
+``dates`` and ``size`` is the number of assignments, which follow in
+``assignments`` in the same order. ``employee`` indexes ``employees`` and
+``set_by`` indexes ``setters`` (null when not set). Timestamps are
+milliseconds since the epoch of the stored naive datetimes. ``expand_schedule``
+turns it back into the regular form.
+
+Clients ask for it with ``?format=compact`` or ``Accept: application/vnd.schedule.compact+json``,
+and for the same document in MessagePack with ``?format=msgpack`` or
+``Accept: application/vnd.schedule.compact+msgpack`` when msgpack is installed.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+FORMAT = "compact/1"
+COMPACT_JSON = "application/vnd.schedule.compact+json"
+COMPACT_MSGPACK = "application/vnd.schedule.compact+msgpack"
+# Accepted format query values -> representation, None being the regular JSON
+FORMATS = {"json": None, "compact": "compact", "msgpack": "msgpack"}
+MEDIA_TYPES = {"compact": COMPACT_JSON, "msgpack": COMPACT_MSGPACK}
+SLOTS = ("day", "night", "custom")
+EPOCH = datetime(1970, 1, 1)
+# Schedule fields copied as they are
+HEADER_FIELDS = ("id", "store_id", "year", "month", "version", "created_by")
+
+
+def negotiate(format: Optional[str], accept: Optional[str]) -> Optional[str]:
+    """"compact", "msgpack" or None for the regular representation; ValueError on an unknown format"""
+    if format:
+        if format not in FORMATS:
+            raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+        return FORMATS[format]
+    if accept:
+        media_types = [part.split(";")[0].strip() for part in accept.split(",")]
+        for representation, media_type in MEDIA_TYPES.items():
+            if media_type in media_types:
+                return representation
+    return None
+
+
+def msgpack_available() -> bool:
+    try:
+        import msgpack  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def encode_msgpack(content) -> bytes:
+    import msgpack
+
+    return msgpack.packb(content, use_bin_type=True)
+
+
+def to_millis(value):
+    if isinstance(value, datetime):
+        return (value - EPOCH) // timedelta(milliseconds=1)
+    return value
+
+
+def from_millis(value):
+    if isinstance(value, int):
+        return EPOCH + timedelta(milliseconds=value)
+    return value
+
+
+def compact_schedule(schedule: dict) -> dict:
+    """Columnar form of a schedule document (without _id and employee_shifts)"""
+    compact = {"format": FORMAT}
+    for field in HEADER_FIELDS:
+        if field in schedule:
+            compact[field] = schedule[field]
+    if "updated_at" in schedule:
+        compact["updated_at"] = to_millis(schedule["updated_at"])
+    if "days" not in schedule:
+        return compact
+
+    employees: Dict[Tuple[str, str], int] = {}
+    setters: Dict[str, int] = {}
+    shifts = {"day": [], "slot": [], "hours": [], "notes": [], "size": []}
+    assignments = {"employee": [], "earnings": [], "set_at": [], "set_by": [], "can_edit": []}
+    dates = []
+    for day_index, day in enumerate(schedule["days"]):
+        dates.append(day.get("date"))
+        slots = [(0, day.get("day_shift")), (1, day.get("night_shift"))]
+        slots += [(2, shift) for shift in day.get("custom_shifts") or []]
+        for slot, shift in slots:
+            if not shift:
+                continue
+            shift_assignments = shift.get("assignments", [])
+            shifts["day"].append(day_index)
+            shifts["slot"].append(slot)
+            shifts["hours"].append(shift.get("hours"))
+            shifts["notes"].append(shift.get("notes"))
+            shifts["size"].append(len(shift_assignments))
+            for assignment in shift_assignments:
+                key = (assignment["employee_id"], assignment.get("employee_name"))
+                assignments["employee"].append(employees.setdefault(key, len(employees)))
+                assignments["earnings"].append(assignment.get("earnings"))
+                assignments["set_at"].append(to_millis(assignment.get("earnings_set_at")))
+                set_by = assignment.get("earnings_set_by")
+                assignments["set_by"].append(None if set_by is None else setters.setdefault(set_by, len(setters)))
+                assignments["can_edit"].append(assignment.get("can_edit_earnings"))
+
+    compact["dates"] = dates
+    compact["employees"] = {"id": [key[0] for key in employees], "name": [key[1] for key in employees]}
+    compact["setters"] = list(setters)
+    compact["shifts"] = shifts
+    compact["assignments"] = assignments
+    return compact
+
+
+def expand_schedule(compact: dict) -> dict:
+    """The regular schedule document back from compact_schedule's output"""
+    schedule = {field: compact[field] for field in HEADER_FIELDS if field in compact}
+    if "updated_at" in compact:
+        schedule["updated_at"] = from_millis(compact["updated_at"])
+    if "dates" not in compact:
+        return schedule
+
+    days: List[dict] = [{"date": date, "day_shift": None, "night_shift": None, "custom_shifts": []}
+                        for date in compact["dates"]]
+    employees, setters = compact["employees"], compact["setters"]
+    shifts, columns = compact["shifts"], compact["assignments"]
+    position = 0
+    for day_index, slot, hours, notes, size in zip(shifts["day"], shifts["slot"], shifts["hours"],
+                                                    shifts["notes"], shifts["size"]):
+        shift = {"type": SLOTS[slot], "assignments": [], "hours": hours, "notes": notes}
+        for i in range(position, position + size):
+            employee, set_by = columns["employee"][i], columns["set_by"][i]
+            shift["assignments"].append({
+                "employee_id": employees["id"][employee],
+                "employee_name": employees["name"][employee],
+                "earnings": columns["earnings"][i],
+                "earnings_set_at": from_millis(columns["set_at"][i]),
+                "earnings_set_by": None if set_by is None else setters[set_by],
+                "can_edit_earnings": columns["can_edit"][i],
+            })
+        position += size
+        if slot == 2:
+            days[day_index]["custom_shifts"].append(shift)
+        else:
+            days[day_index][f"{SLOTS[slot]}_shift"] = shift
+    schedule["days"] = days
+    return schedule
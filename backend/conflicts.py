@@ -0,0 +1,148 @@
+"""Roster conflict detection over all schedules of a month.
+
+Assignments are laid out as NumPy arrays of employee × day × slot: day shift
+at 08:00, then custom shifts, then night shift at 20:00. A shift lasts its
+hours, passed in by the caller. The schedule stores no start time for custom
+shifts, so they count towards working days and hours but are never checked
+for overlaps or rest.
+
+Conflicts found:
+
+* ``double_booking``: two shifts that overlap or follow each other without a
+  break, e.g. a day shift in one store and a night shift in another that day
+* ``rest_time``: less than ``min_rest_hours`` between two shifts
+* ``consecutive_days``: more than ``max_consecutive_days`` working days in a row
+* ``weekly_hours``: more than ``max_weekly_hours`` in any 7-day window
+* ``monthly_hours``: more than ``max_monthly_hours`` in the month
+
+Shifts in the neighbouring months are not taken into account.
+"""
+import calendar
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+SLOT_ORDER = {"day": 0, "custom": 1, "night": 2}
+SLOT_NAMES = ["day", "custom", "night"]
+SLOT_START_HOURS = np.array([8.0, 8.0, 20.0])
+# Slots with a known start time; the custom one only adds hours
+TIMED_SLOTS = np.array([True, False, True])
+
+# (store_id, employee_id, date, shift_type, hours)
+Assignment = Tuple[str, str, str, str, float]
+
+
+class RosterRules:
+    def __init__(self, min_rest_hours: float = 12, max_consecutive_days: int = 6,
+                 max_weekly_hours: float = 60, max_monthly_hours: float = 200):
+        self.min_rest_hours = min_rest_hours
+        self.max_consecutive_days = max_consecutive_days
+        self.max_weekly_hours = max_weekly_hours
+        self.max_monthly_hours = max_monthly_hours
+
+
+def find_conflicts(year: int, month: int, assignments: Iterable[Assignment],
+                   rules: Optional[RosterRules] = None) -> List[dict]:
+    """Check every assignment of the month; assignments on other dates are ignored."""
+    rules = rules or RosterRules()
+    prefix = f"{year:04d}-{month:02d}-"
+    records = [a for a in assignments if a[2] and a[2].startswith(prefix) and a[3] in SLOT_ORDER]
+    if not records:
+        return []
+
+    days = calendar.monthrange(year, month)[1]
+    employees = sorted({r[1] for r in records})
+    employee_index = {employee_id: i for i, employee_id in enumerate(employees)}
+    count = len(records)
+    emp = np.fromiter((employee_index[r[1]] for r in records), dtype=np.int64, count=count)
+    day = np.fromiter((int(r[2][8:10]) - 1 for r in records), dtype=np.int64, count=count)
+    slot = np.fromiter((SLOT_ORDER[r[3]] for r in records), dtype=np.int64, count=count)
+    hours = np.fromiter((r[4] for r in records), dtype=np.float64, count=count)
+    valid = (day >= 0) & (day < days)
+    emp, day, slot, hours = emp[valid], day[valid], slot[valid], hours[valid]
+    records = [r for r, keep in zip(records, valid) if keep]
+
+    shape = (len(employees), days, len(SLOT_NAMES))
+    timed = TIMED_SLOTS[slot]
+    cell = (emp[timed], day[timed], slot[timed])
+    booked = np.zeros(shape, dtype=np.int32)
+    np.add.at(booked, cell, 1)
+    ends = np.full(shape, -np.inf)
+    np.maximum.at(ends, cell, day[timed] * 24 + SLOT_START_HOURS[slot[timed]] + hours[timed])
+
+    # Rest before each slot: its start minus the latest end of anything earlier
+    timeline = days * len(SLOT_NAMES)
+    starts = (np.arange(days)[:, None] * 24 + SLOT_START_HOURS[None, :]).reshape(timeline)
+    worked = (booked > 0).reshape(-1, timeline)
+    latest_end = np.maximum.accumulate(ends.reshape(-1, timeline), axis=1)
+    previous_end = np.concatenate([np.full((len(employees), 1), -np.inf), latest_end[:, :-1]], axis=1)
+    rest = starts[None, :] - previous_end
+    double_booked = worked & ((booked.reshape(-1, timeline) > 1) | (rest <= 0))
+    short_rest = worked & (rest > 0) & (rest < rules.min_rest_hours)
+
+    day_hours = np.zeros((len(employees), days))
+    np.add.at(day_hours, (emp, day), hours)
+    working_day = day_hours > 0
+
+    # Length of the working streak ending on each day
+    day_numbers = np.arange(days)
+    last_day_off = np.maximum.accumulate(np.where(working_day, -1, day_numbers), axis=1)
+    streak = day_numbers[None, :] - last_day_off
+    long_streak = streak == rules.max_consecutive_days + 1
+
+    window = min(7, days)
+    cumulative = np.concatenate([np.zeros((len(employees), 1)), np.cumsum(day_hours, axis=1)], axis=1)
+    weekly = cumulative[:, window:] - cumulative[:, :-window]
+    worst_week = weekly.argmax(axis=1)
+    over_week = weekly.max(axis=1) > rules.max_weekly_hours
+    monthly = day_hours.sum(axis=1)
+    over_month = monthly > rules.max_monthly_hours
+
+    # Stores per flagged employee and day, from the few records involved
+    flagged = (double_booked | short_rest).reshape(shape).any(axis=2) | long_streak
+    flagged[over_week, worst_week[over_week] + window - 1] = True
+    involved = flagged[emp, day] | over_month[emp]
+    stores_by_day: Dict[Tuple[int, int], set] = defaultdict(set)
+    stores_by_employee: Dict[int, set] = defaultdict(set)
+    for record, e, d in zip(np.array(records, dtype=object)[involved], emp[involved], day[involved]):
+        stores_by_day[(e, d)].add(record[0])
+        stores_by_employee[e].add(record[0])
+
+    def date_of(d: int) -> str:
+        return f"{prefix}{d + 1:02d}"
+
+    conflicts = []
+
+    def add(kind: str, e: int, date: Optional[str], stores: set, detail: str):
+        conflicts.append({
+            "type": kind,
+            "employee_id": employees[e],
+            "date": date,
+            "store_ids": sorted(stores),
+            "detail": detail,
+        })
+
+    for e, t in zip(*np.nonzero(double_booked)):
+        d, s = divmod(int(t), len(SLOT_NAMES))
+        add("double_booking", e, date_of(d), stores_by_day[(e, d)],
+            f"{SLOT_NAMES[s].capitalize()} shift overlaps or directly follows another shift")
+    for e, t in zip(*np.nonzero(short_rest)):
+        d, s = divmod(int(t), len(SLOT_NAMES))
+        add("rest_time", e, date_of(d), stores_by_day[(e, d)],
+            f"Only {rest[e, t]:g}h rest before the {SLOT_NAMES[s]} shift, "
+            f"at least {rules.min_rest_hours:g}h required")
+    for e, d in zip(*np.nonzero(long_streak)):
+        add("consecutive_days", e, date_of(d), stores_by_day[(e, d)],
+            f"More than {rules.max_consecutive_days} consecutive working days")
+    for e in np.nonzero(over_week)[0]:
+        d = int(worst_week[e]) + window - 1
+        add("weekly_hours", e, date_of(d), stores_by_day[(e, d)],
+            f"{weekly[e, worst_week[e]]:g}h in the 7 days up to this date, "
+            f"at most {rules.max_weekly_hours:g}h allowed")
+    for e in np.nonzero(over_month)[0]:
+        add("monthly_hours", e, None, stores_by_employee[e],
+            f"{monthly[e]:g}h in the month, at most {rules.max_monthly_hours:g}h allowed")
+
+    conflicts.sort(key=lambda c: (c["date"] or "", c["employee_id"], c["type"]))
+    return conflicts
@@ -0,0 +1,281 @@
+"""Synthetic production-scale dataset: stores, employees, schedules and earnings.
+
+Documents have the shapes the API writes: schedules as create_schedule saves
+them (employee_shifts index and version included), assignment earnings as
+update_shift_earnings or the default-earnings job leave them, and the matching
+earnings_rollups. Schedules come from benchmarks.dataset.ScheduleBuilder, the
+builder the benchmarks use. The same seed always gives the same data, ids
+included.
+
+    python datagen.py generate --stores 500 --employees 40 --months 36 --drop
+    python datagen.py generate --stores 50 --out dump/ --format jsonl
+    python datagen.py load dump/ --drop
+
+Loading goes to MONGO_URL / DB_NAME, like the server, in insert_many batches
+with several batches in flight; indexes are created after the data.
+"""
+import asyncio
+import calendar
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from enum import Enum
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import bson
+import typer
+from bson import json_util
+
+from benchmarks.dataset import ScheduleBuilder, hash_password, make_id
+from indexes import ensure_indexes
+from server import db, schedule_rollups
+
+COLLECTIONS = ("stores", "users", "schedules", "earnings_rollups")
+FIRST_NAMES = ["Анна", "Мария", "Елена", "Ольга", "Ирина", "Иван", "Алексей", "Дмитрий", "Сергей", "Павел"]
+LAST_NAMES = ["Иванов", "Смирнов", "Кузнецов", "Попов", "Соколов", "Лебедев", "Козлов", "Новиков"]
+
+cli = typer.Typer(help=__doc__.splitlines()[0], add_completion=False)
+
+
+class OutputFormat(str, Enum):
+    BSON = "bson"
+    JSONL = "jsonl"
+
+
+class DatasetGenerator:
+    """Yields the documents of each collection for one seed and set of parameters"""
+
+    def __init__(self, seed: int, stores: int, employees: int, start: str, months: int,
+                 day_headcount: int, night_headcount: int, custom_ratio: float,
+                 employee_set_ratio: float, manager_set_ratio: float, as_of: Optional[str], password: str):
+        self.seed = seed
+        start_year, start_month = (int(part) for part in start.split("-"))
+        self.months = [(start_year + (start_month - 1 + m) // 12, (start_month - 1 + m) % 12 + 1)
+                       for m in range(months)]
+        # Shifts up to this date are past their editing deadline and carry earnings
+        last_year, last_month = self.months[-1]
+        as_of = as_of or f"{last_year:04d}-{last_month:02d}-{calendar.monthrange(last_year, last_month)[1]:02d}"
+        self.created_at = datetime(start_year, start_month, 1) - timedelta(days=30)
+        # Every employee shares one hash; the manager keeps the default manager's password
+        self.password_hash = hash_password(password)
+        self.manager_password_hash = hash_password("manager123")
+
+        rng = random.Random(f"{seed}:people")
+        self.manager_id = make_id(rng)
+        self.store_ids = [make_id(rng) for _ in range(stores)]
+        self.staff: Dict[str, List[str]] = {
+            store_id: [make_id(rng) for _ in range(employees)] for store_id in self.store_ids
+        }
+        # A tenth of each store's staff also works in the next store
+        self.home_store = {e: store_id for store_id, ids in self.staff.items() for e in ids}
+        for current, following in zip(self.store_ids, self.store_ids[1:]):
+            self.staff[following] = self.staff[following] + self.staff[current][:employees // 10]
+        self.names = {e: f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}" for e in self.home_store}
+        self.builder = ScheduleBuilder(day_headcount, night_headcount, custom_ratio, employee_set_ratio,
+                                       manager_set_ratio, as_of, self.manager_id, self.names)
+
+    def stores(self) -> Iterator[dict]:
+        for s, store_id in enumerate(self.store_ids):
+            yield {"id": store_id, "name": f"Точка продаж {s + 1}", "address": f"ул. Примерная, {s + 1}",
+                   "created_at": self.created_at, "is_active": True, "version": 1}
+
+    def users(self) -> Iterator[dict]:
+        yield {"id": self.manager_id, "email": "manager@company.com", "name": "Default Manager",
+               "password": self.manager_password_hash, "role": "manager", "store_ids": [],
+               "created_at": self.created_at}
+        store_ids = {e: [] for e in self.home_store}
+        for store_id, employee_ids in self.staff.items():
+            for employee_id in employee_ids:
+                store_ids[employee_id].append(store_id)
+        for i, (employee_id, ids) in enumerate(store_ids.items()):
+            yield {"id": employee_id, "email": f"employee{i + 1}@company.com", "name": self.names[employee_id],
+                   "password": self.password_hash, "role": "employee", "store_ids": ids,
+                   "created_at": self.created_at}
+
+    def schedules(self) -> Iterator[dict]:
+        for s, store_id in enumerate(self.store_ids):
+            # One stream per store, so adding stores leaves the existing ones unchanged
+            rng = random.Random(f"{self.seed}:store:{s}")
+            for year, month in self.months:
+                yield self.builder.schedule(store_id, year, month, self.staff[store_id], rng)
+
+
+class MongoSink:
+    """insert_many in batches, up to `writers` batches in flight while generation goes on"""
+
+    def __init__(self, batch_size: int, writers: int):
+        self.batch_size = batch_size
+        self.slots = asyncio.Semaphore(writers)
+        self.pending = set()
+        self.batches: Dict[str, List[dict]] = {}
+
+    async def add(self, collection: str, document: dict):
+        batch = self.batches.setdefault(collection, [])
+        batch.append(document)
+        if len(batch) >= self.batch_size:
+            await self._flush(collection)
+
+    async def _flush(self, collection: str):
+        batch = self.batches.pop(collection, [])
+        if not batch:
+            return
+        await self.slots.acquire()
+        task = asyncio.create_task(db[collection].insert_many(batch, ordered=False))
+        self.pending.add(task)
+        task.add_done_callback(lambda done: (self.pending.discard(done), self.slots.release()))
+
+    async def close(self):
+        for collection in list(self.batches):
+            await self._flush(collection)
+        await asyncio.gather(*self.pending)
+
+
+class FileSink:
+    """One <collection>.bson (mongorestore layout) or .jsonl (extended JSON) file per collection"""
+
+    def __init__(self, directory: Path, output_format: OutputFormat):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.format = output_format
+        self.files = {}
+        for collection in COLLECTIONS:
+            path = directory / f"{collection}.{output_format.value}"
+            self.files[collection] = (open(path, "wb") if output_format == OutputFormat.BSON
+                                      else open(path, "w", encoding="utf-8"))
+
+    async def add(self, collection: str, document: dict):
+        if self.format == OutputFormat.BSON:
+            self.files[collection].write(bson.encode(document))
+        else:
+            self.files[collection].write(json_util.dumps(document, json_options=json_util.RELAXED_JSON_OPTIONS))
+            self.files[collection].write("\n")
+
+    async def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+async def drop_collections():
+    for collection in COLLECTIONS:
+        await db[collection].drop()
+
+
+async def _generate(generator: DatasetGenerator, sink) -> dict:
+    counts = dict.fromkeys(COLLECTIONS, 0)
+    assignments = 0
+    for collection, documents in (("stores", generator.stores()), ("users", generator.users())):
+        for document in documents:
+            await sink.add(collection, document)
+            counts[collection] += 1
+    for schedule in generator.schedules():
+        await sink.add("schedules", schedule)
+        counts["schedules"] += 1
+        assignments += len(schedule["employee_shifts"])
+        for rollup in schedule_rollups(schedule).values():
+            await sink.add("earnings_rollups", rollup)
+            counts["earnings_rollups"] += 1
+    await sink.close()
+    return {**counts, "assignments": assignments}
+
+
+def read_documents(path: Path) -> Iterator[dict]:
+    if path.suffix == ".bson":
+        with open(path, "rb") as f:
+            yield from bson.decode_file_iter(f)
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json_util.loads(line)
+
+
+async def _load(directory: Path, sink: MongoSink) -> dict:
+    counts = {}
+    for collection in COLLECTIONS:
+        paths = [directory / f"{collection}.{fmt.value}" for fmt in OutputFormat]
+        path = next((p for p in paths if p.exists()), None)
+        if path is None:
+            continue
+        counts[collection] = 0
+        for document in read_documents(path):
+            await sink.add(collection, document)
+            counts[collection] += 1
+    await sink.close()
+    return counts
+
+
+def report(counts: dict, elapsed: float, target: str):
+    assignments = counts.get("assignments")
+    typer.echo(json.dumps({
+        "target": target,
+        **counts,
+        "elapsed_seconds": round(elapsed, 2),
+        **({"assignments_per_second": round(assignments / elapsed)} if assignments and elapsed else {}),
+    }, ensure_ascii=False, indent=2))
+
+
+@cli.command()
+def generate(
+    stores: int = typer.Option(100, help="Number of stores"),
+    employees: int = typer.Option(30, help="Employees per store"),
+    months: int = typer.Option(24, help="Consecutive months of schedules per store"),
+    start: str = typer.Option("2023-01", help="First month, YYYY-MM"),
+    day_headcount: int = typer.Option(4, help="Employees per day shift"),
+    night_headcount: int = typer.Option(4, help="Employees per night shift"),
+    custom_ratio: float = typer.Option(0.2, help="Share of days with a custom shift"),
+    employee_set_ratio: float = typer.Option(0.5, help="Share of past shifts with earnings entered by the employee"),
+    manager_set_ratio: float = typer.Option(0.1, help="Share of past shifts with earnings set by the manager"),
+    as_of: Optional[str] = typer.Option(None, help="Shifts after this date (YYYY-MM-DD) have no earnings yet"),
+    password: str = typer.Option("password123", help="Password of every generated employee"),
+    seed: int = typer.Option(42, help="Random seed; the same seed gives the same dataset"),
+    out: Optional[Path] = typer.Option(None, help="Write files to this directory instead of MongoDB"),
+    output_format: OutputFormat = typer.Option(OutputFormat.BSON, "--format", help="File format with --out"),
+    batch_size: int = typer.Option(500, help="Documents per insert_many"),
+    writers: int = typer.Option(4, help="insert_many batches in flight"),
+    drop: bool = typer.Option(False, help="Drop the collections first"),
+    create_indexes: bool = typer.Option(True, "--indexes/--no-indexes", help="Create indexes after loading"),
+):
+    """Generate a dataset into MongoDB or into BSON/JSONL files."""
+    generator = DatasetGenerator(seed, stores, employees, start, months, day_headcount, night_headcount,
+                                 custom_ratio, employee_set_ratio, manager_set_ratio, as_of, password)
+
+    async def run():
+        if out is not None:
+            return await _generate(generator, FileSink(out, output_format))
+        if drop:
+            await drop_collections()
+        counts = await _generate(generator, MongoSink(batch_size, writers))
+        if create_indexes:
+            await ensure_indexes(db)
+        return counts
+
+    started = time.perf_counter()
+    counts = asyncio.run(run())
+    report(counts, time.perf_counter() - started, str(out) if out is not None else db.name)
+
+
+@cli.command()
+def load(
+    directory: Path = typer.Argument(..., exists=True, file_okay=False, help="Directory written by generate --out"),
+    batch_size: int = typer.Option(500, help="Documents per insert_many"),
+    writers: int = typer.Option(4, help="insert_many batches in flight"),
+    drop: bool = typer.Option(False, help="Drop the collections first"),
+    create_indexes: bool = typer.Option(True, "--indexes/--no-indexes", help="Create indexes after loading"),
+):
+    """Load files written by generate --out into MongoDB."""
+    async def run():
+        if drop:
+            await drop_collections()
+        counts = await _load(directory, MongoSink(batch_size, writers))
+        if create_indexes:
+            await ensure_indexes(db)
+        return counts
+
+    started = time.perf_counter()
+    counts = asyncio.run(run())
+    report(counts, time.perf_counter() - started, db.name)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,148 @@
+"""Index declarations and query-plan self-check for the MongoDB collections.
+
+``ensure_indexes`` is idempotent and runs on every startup. ``verify_query_plans``
+explains the query shape of each route and reports any that would fall back to
+a collection scan. Run the check by hand with::
+
+    python indexes.py --check
+"""
+import asyncio
+import os
+import sys
+from typing import Any, Dict, List, Tuple
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="users_id", unique=True),
+        IndexModel([("email", ASCENDING)], name="users_email", unique=True),
+        IndexModel([("role", ASCENDING)], name="users_role"),
+    ],
+    "stores": [
+        IndexModel([("id", ASCENDING)], name="stores_id", unique=True),
+        IndexModel(
+            [("is_active", ASCENDING), ("id", ASCENDING)],
+            name="stores_active",
+            partialFilterExpression={"is_active": True},
+        ),
+    ],
+    "schedules": [
+        IndexModel(
+            [("store_id", ASCENDING), ("year", ASCENDING), ("month", ASCENDING)],
+            name="schedules_store_month",
+            unique=True,
+        ),
+        IndexModel([("days.date", ASCENDING)], name="schedules_days_date"),
+        IndexModel(
+            [("store_id", ASCENDING), ("employee_shifts.employee_id", ASCENDING)],
+            name="schedules_employee_shifts",
+        ),
+        IndexModel([("year", ASCENDING), ("month", ASCENDING)], name="schedules_month"),
+    ],
+    "earnings_rollups": [
+        IndexModel(
+            [("store_id", ASCENDING), ("employee_id", ASCENDING), ("year", ASCENDING), ("month", ASCENDING)],
+            name="earnings_rollups_key",
+            unique=True,
+        ),
+        IndexModel([("store_id", ASCENDING), ("year", ASCENDING), ("month", ASCENDING)],
+                   name="earnings_rollups_store_month"),
+    ],
+    "jobs": [
+        IndexModel([("id", ASCENDING)], name="jobs_id", unique=True),
+    ],
+}
+
+# (description, collection, filter) for every query a route issues with a predicate.
+# Manager-wide listings such as users.find({}) scan by design and are not listed.
+QUERY_SHAPES: List[Tuple[str, str, Dict[str, Any]]] = [
+    ("get_current_user", "users", {"id": "x"}),
+    ("login / register_user", "users", {"email": "x"}),
+    ("create_default_manager", "users", {"role": "manager"}),
+    ("get_stores (manager)", "stores", {"is_active": True}),
+    ("get_stores (employee)", "stores", {"id": {"$in": ["x"]}, "is_active": True}),
+    ("get_store / update_store", "stores", {"id": "x"}),
+    ("create_schedule", "stores", {"id": "x", "is_active": True}),
+    ("get_schedule / get_my_shifts / update_shift_earnings", "schedules",
+     {"store_id": "x", "year": 2024, "month": 1}),
+    ("get_all_schedules (employee)", "schedules", {"store_id": {"$in": ["x"]}}),
+    ("get_all_schedules (store/year filter)", "schedules", {"store_id": "x", "year": 2024}),
+    ("get_all_schedules (next page)", "schedules", {"$or": [
+        {"store_id": {"$gt": "x"}},
+        {"store_id": "x", "year": {"$gt": 2024}},
+        {"store_id": "x", "year": 2024, "month": {"$gt": 1}},
+    ]}),
+    ("get_schedule_conflicts", "schedules", {"year": 2024, "month": 1}),
+    ("create_schedule conflicts", "schedules", {"year": 2024, "month": 1, "store_id": {"$ne": "x"}, "$or": [
+        {"employee_shifts.employee_id": {"$in": ["x"]}},
+        {"employee_shifts": {"$exists": False}},
+    ]}),
+    ("generate_schedules (staff)", "users", {"role": "employee", "store_ids": {"$in": ["x"]}}),
+    ("create_schedule / patch_schedule (employees)", "users", {"id": {"$in": ["x"]}}),
+    ("generate_schedules (other stores)", "schedules", {
+        "year": 2024, "month": 1, "store_id": {"$nin": ["x"]}, "employee_shifts.employee_id": {"$in": ["x"]},
+    }),
+    ("get_coverage", "schedules", {"store_id": {"$in": ["x"]}, "$or": [{"year": 2024, "month": 1}]}),
+    ("export_payroll", "schedules", {"store_id": "x", "$or": [{"year": 2024, "month": 1}, {"year": 2024, "month": 2}]}),
+    ("get_earnings_history", "earnings_rollups", {"store_id": "x", "employee_id": "x", "paid_shifts": {"$gt": 0}}),
+    ("earnings rollup refresh", "earnings_rollups", {"store_id": "x", "year": 2024, "month": 1}),
+    ("earnings backfill", "schedules",
+     {"days": {"$elemMatch": {"date": {"$gt": "2024-01-01", "$lte": "2024-01-02"}}}}),
+    ("earnings backfill state", "jobs", {"id": "x"}),
+]
+
+
+async def ensure_indexes(db) -> None:
+    """Create every declared index. Safe to call repeatedly."""
+    for collection, models in INDEXES.items():
+        try:
+            await db[collection].create_indexes(models)
+        except OperationFailure as e:
+            # e.g. duplicate data preventing a unique index; the app still works, only slower
+            print(f"Error creating indexes on {collection}: {e}")
+
+
+def _plan_stages(plan: Any) -> List[str]:
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+
+async def verify_query_plans(db) -> List[str]:
+    """Explain each route's query shape and return the ones that use a COLLSCAN."""
+    failures = []
+    for description, collection, query in QUERY_SHAPES:
+        explanation = await db[collection].find(query).explain()
+        winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+        if "COLLSCAN" in _plan_stages(winning_plan):
+            failures.append(f"{description}: {collection}.find({query}) uses COLLSCAN")
+    return failures
+
+
+async def _main(check: bool) -> int:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    db = client[os.environ.get("DB_NAME", "test_database")]
+    await ensure_indexes(db)
+    print("Indexes ensured")
+    if not check:
+        return 0
+    failures = await verify_query_plans(db)
+    for failure in failures:
+        print(failure)
+    print("Query plan check failed" if failures else "All query shapes use an index")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main("--check" in sys.argv[1:])))
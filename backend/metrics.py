@@ -0,0 +1,269 @@
+"""In-process metrics rendered in the Prometheus text format.
+
+``MetricsMiddleware`` counts and times every HTTP request under its route
+template (``/api/my-shifts/{store_id}/{year}/{month}``, not the raw path), and
+``MongoCommandListener`` counts and times MongoDB commands and charges them to
+the request being served. Nothing leaves the process: GET /api/metrics renders
+``REGISTRY`` for a manager or a scraper holding the METRICS_TOKEN bearer token.
+
+Motor runs pymongo on executor threads with a copy of the caller's context,
+so the listener sees the ``current_request`` set by the middleware.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Mongo listeners update metrics from Motor's executor threads
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return lines + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{self._format_labels(key)} {value:g}" for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> (per-bucket counts, sum, count)
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, [list(entry[0]), entry[1], entry[2]]) for key, entry in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{self._format_labels(key, (('le', f'{bound:g}'),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{self._format_labels(key, (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total:g}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def on_collect(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Register a callback that refreshes gauges right before rendering."""
+        self._collectors.append(callback)
+        return callback
+
+    def render(self) -> str:
+        for callback in self._collectors:
+            callback()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+REGISTRY = Registry()
+
+http_requests_total = REGISTRY.counter(
+    "http_requests_total", "HTTP requests by method, route template and status code.",
+    ("method", "route", "status"))
+http_request_duration_seconds = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency by method and route template.",
+    ("method", "route"))
+http_requests_in_flight = REGISTRY.gauge(
+    "http_requests_in_flight", "HTTP requests currently being served.")
+http_request_db_commands = REGISTRY.histogram(
+    "http_request_db_commands", "MongoDB commands issued per HTTP request.",
+    ("route",), buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+http_request_db_seconds = REGISTRY.histogram(
+    "http_request_db_seconds", "Time spent in MongoDB commands per HTTP request.", ("route",))
+mongo_commands_total = REGISTRY.counter(
+    "mongo_commands_total", "MongoDB commands by command name, collection and outcome.",
+    ("command", "collection", "outcome"))
+mongo_command_duration_seconds = REGISTRY.histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency by command name and collection.",
+    ("command", "collection"))
+
+
+class RequestStats:
+    """MongoDB work charged to one HTTP request"""
+
+    __slots__ = ("method", "route", "db_commands", "db_seconds")
+
+    def __init__(self, method: str = "", route: str = ""):
+        self.method = method
+        self.route = route
+        self.db_commands = 0
+        self.db_seconds = 0.0
+
+
+current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "current_request", default=None)
+
+
+def route_template(scope: dict) -> str:
+    route = scope.get("route")
+    # Unmatched paths share one label so that random URLs cannot grow the registry
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(method=scope["method"])
+        token = current_request.set(stats)
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_requests_in_flight.dec()
+            current_request.reset(token)
+            stats.route = route_template(scope)
+            http_requests_total.inc(method=stats.method, route=stats.route, status=status["code"])
+            http_request_duration_seconds.observe(elapsed, method=stats.method, route=stats.route)
+            http_request_db_commands.observe(stats.db_commands, route=stats.route)
+            http_request_db_seconds.observe(stats.db_seconds, route=stats.route)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Counts and times every command; pass it to the client as an event listener"""
+
+    def __init__(self):
+        self._started: Dict[Tuple[object, int], str] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = (
+                collection if isinstance(collection, str) else "")
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+    def _finish(self, event, outcome: str):
+        with self._lock:
+            collection = self._started.pop((event.connection_id, event.request_id), "")
+        seconds = event.duration_micros / 1_000_000
+        mongo_commands_total.inc(command=event.command_name, collection=collection, outcome=outcome)
+        mongo_command_duration_seconds.observe(seconds, command=event.command_name, collection=collection)
+        stats = current_request.get()
+        if stats is not None:
+            stats.db_commands += 1
+            stats.db_seconds += seconds
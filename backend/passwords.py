@@ -0,0 +1,99 @@
+"""bcrypt hashing and verification in a bounded process pool.
+
+bcrypt is deliberately CPU-heavy (roughly 200 ms per call at the default
+cost), so running it inside an ``async def`` handler freezes the event loop.
+``PasswordHasher`` runs it in worker processes and refuses new work once
+``queue_limit`` passwords are already pending, so callers can answer 503
+instead of queueing without bound.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import bcrypt
+
+
+class PasswordPoolBusy(Exception):
+    """Raised when too many hashing calls are already queued."""
+
+
+def _hashpw(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _checkpw(password: str, hashed: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+class PasswordHasher:
+    def __init__(self, workers: Optional[int] = None, rounds: int = 12, queue_limit: Optional[int] = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.rounds = rounds
+        self.queue_limit = queue_limit or self.workers * 8
+        self.pending = 0
+        self.rejected = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Shared by every hash_many call
+        self._batch_slots: Optional[asyncio.Semaphore] = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: the server process runs threads (Motor), which fork does not handle safely
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def _admit(self, count: int) -> None:
+        # pending counts passwords in the pool, queued or hashing
+        if self.pending + count > self.queue_limit:
+            self.rejected += 1
+            raise PasswordPoolBusy()
+
+    async def _run(self, func, *args):
+        self._admit(1)
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool(), func, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hashpw, password, self.rounds)
+
+    async def hash_many(self, passwords: List[str]) -> List[str]:
+        """Hash a batch, in the order given.
+
+        All batches share one gate of one slot per worker, so together they
+        keep at most ``workers`` passwords in the pool and single hash and
+        verify calls get the next free worker instead of waiting behind
+        them. Each of those passwords counts in ``pending`` while it is in
+        the pool. A batch is refused, like a single call, when the pool is
+        already at queue_limit; once admitted it waits for the gate instead.
+        """
+        if not passwords:
+            return []
+        self._admit(1)
+        if self._batch_slots is None:
+            self._batch_slots = asyncio.Semaphore(self.workers)
+        loop = asyncio.get_running_loop()
+
+        async def hash_one(password: str) -> str:
+            async with self._batch_slots:
+                self.pending += 1
+                try:
+                    return await loop.run_in_executor(self._pool(), _hashpw, password, self.rounds)
+                finally:
+                    self.pending -= 1
+
+        return list(await asyncio.gather(*(hash_one(password) for password in passwords)))
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(_checkpw, password, hashed)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
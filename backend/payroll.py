@@ -0,0 +1,103 @@
+"""Payroll export: shifts, hours and earnings per store and employee.
+
+The handler feeds one store at a time as raw assignment rows; each store is
+reduced to one row per employee with pandas and written out before the next
+store is loaded, so memory stays bounded by the largest store. Hours default
+the same way as in get_my_shifts: 12 for day and night shifts, 8 for custom.
+"""
+import tempfile
+from typing import AsyncIterator, Iterable, Tuple
+
+import numpy as np
+import pandas as pd
+
+PAYROLL_COLUMNS = [
+    "store_id", "store_name", "employee_id", "employee_name", "shifts", "day_shifts", "night_shifts",
+    "custom_shifts", "hours", "earnings", "paid_shifts",
+]
+# (employee_id, employee_name, date, shift_type, hours or None, earnings or None)
+AssignmentRow = Tuple[str, str, str, str, object, object]
+XLSX_CHUNK_SIZE = 64 * 1024
+
+
+def store_payroll(store_id: str, store_name: str, rows: Iterable[AssignmentRow],
+                  date_from: str, date_to: str) -> pd.DataFrame:
+    """One payroll row per employee of the store for shifts in [date_from, date_to]"""
+    frame = pd.DataFrame.from_records(
+        list(rows), columns=["employee_id", "employee_name", "date", "type", "hours", "earnings"]
+    )
+    frame = frame[(frame["date"] >= date_from) & (frame["date"] <= date_to)]
+    if frame.empty:
+        return pd.DataFrame(columns=PAYROLL_COLUMNS)
+
+    shift_type = frame["type"].to_numpy()
+    hours = pd.to_numeric(frame["hours"], errors="coerce").to_numpy(dtype=np.float64)
+    default_hours = np.where(shift_type == "custom", 8.0, 12.0)
+    earnings = pd.to_numeric(frame["earnings"], errors="coerce").fillna(0).to_numpy(dtype=np.float64)
+    columns = pd.DataFrame({
+        "employee_id": frame["employee_id"].to_numpy(),
+        "employee_name": frame["employee_name"].to_numpy(),
+        "day_shifts": (shift_type == "day").astype(np.int64),
+        "night_shifts": (shift_type == "night").astype(np.int64),
+        "custom_shifts": (shift_type == "custom").astype(np.int64),
+        # Missing or zero hours fall back to the default, as shift_hours does
+        "hours": np.where(np.nan_to_num(hours) > 0, hours, default_hours),
+        "earnings": earnings,
+        "paid_shifts": (earnings > 0).astype(np.int64),
+    })
+
+    payroll = columns.groupby("employee_id", sort=False).agg(
+        employee_name=("employee_name", "last"),
+        day_shifts=("day_shifts", "sum"),
+        night_shifts=("night_shifts", "sum"),
+        custom_shifts=("custom_shifts", "sum"),
+        hours=("hours", "sum"),
+        earnings=("earnings", "sum"),
+        paid_shifts=("paid_shifts", "sum"),
+    ).reset_index()
+    payroll["shifts"] = payroll["day_shifts"] + payroll["night_shifts"] + payroll["custom_shifts"]
+    payroll["store_id"] = store_id
+    payroll["store_name"] = store_name
+    payroll["earnings"] = payroll["earnings"].round(2)
+    return payroll.sort_values("employee_name", kind="stable")[PAYROLL_COLUMNS]
+
+
+async def stream_csv(frames: AsyncIterator[pd.DataFrame]) -> AsyncIterator[bytes]:
+    """CSV with a header, one chunk per store"""
+    yield (",".join(PAYROLL_COLUMNS) + "\n").encode("utf-8")
+    async for frame in frames:
+        if not frame.empty:
+            yield frame.to_csv(index=False, header=False).encode("utf-8")
+
+
+async def stream_xlsx(frames: AsyncIterator[pd.DataFrame]) -> AsyncIterator[bytes]:
+    """XLSX written row by row to a spooled temporary file, then sent in chunks.
+
+    The workbook cannot be sent before it is complete, so it is kept on disk
+    once it outgrows memory.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Payroll")
+    sheet.append(PAYROLL_COLUMNS)
+    async for frame in frames:
+        for row in frame.itertuples(index=False):
+            sheet.append([value.item() if isinstance(value, np.generic) else value for value in row])
+
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as output:
+        workbook.save(output)
+        output.seek(0)
+        while True:
+            chunk = output.read(XLSX_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def xlsx_available() -> bool:
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        return False
+    return True
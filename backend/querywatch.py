@@ -0,0 +1,201 @@
+"""Slow-query and N+1 detection from pymongo command monitoring.
+
+``QueryMonitor`` is a pymongo ``CommandListener``. It records each data
+command (find, aggregate, update, ...) with its filter shape into the
+``QueryReport`` of the current request or trace. The shape keeps the field
+names and operators and replaces values with ``?``. Commands slower than
+``slow_ms`` are logged as they finish. When a trace ends, every shape issued
+more than ``repeat_limit`` times is logged as a likely N+1 loop.
+
+Reports double as test assertions::
+
+    with query_monitor.trace("earnings backfill") as report:
+        await set_default_earnings_if_needed(date_to)
+    report.assert_max_commands(5)
+    report.assert_no_repeats(1)
+"""
+import contextvars
+import json
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger("querywatch")
+
+# Commands that carry a query; cursor and session housekeeping is not reported
+DATA_COMMANDS = {"find", "aggregate", "count", "distinct", "insert", "update", "delete", "findAndModify"}
+# Where each command keeps its filter
+FILTER_FIELDS = {"find": "filter", "count": "query", "distinct": "query", "findAndModify": "query",
+                 "aggregate": "pipeline"}
+
+
+def value_shape(value):
+    """The value with every scalar replaced by '?'; lists of scalars collapse to one '?'"""
+    if isinstance(value, dict):
+        return {key: value_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if all(not isinstance(item, (dict, list, tuple)) for item in value):
+            return "?"
+        return [value_shape(item) for item in value]
+    return "?"
+
+
+def command_shape(command_name: str, command: dict) -> str:
+    if command_name == "update":
+        shape = [value_shape(update.get("q", {})) for update in command.get("updates", [])]
+    elif command_name == "delete":
+        shape = [value_shape(delete.get("q", {})) for delete in command.get("deletes", [])]
+    elif command_name in FILTER_FIELDS:
+        shape = value_shape(command.get(FILTER_FIELDS[command_name], {}))
+    else:
+        shape = None
+    return json.dumps(shape, sort_keys=True, default=str) if shape is not None else ""
+
+
+class QueryReport:
+    """Data commands issued within one request or trace"""
+
+    def __init__(self, label: str = ""):
+        self.label = label
+        # (command, collection, shape, seconds)
+        self.commands: List[Tuple[str, str, str, float]] = []
+        self._lock = threading.Lock()
+
+    def add(self, command: str, collection: str, shape: str, seconds: float):
+        with self._lock:
+            self.commands.append((command, collection, shape, seconds))
+
+    @property
+    def count(self) -> int:
+        return len(self.commands)
+
+    @property
+    def seconds(self) -> float:
+        return sum(command[3] for command in self.commands)
+
+    def repeated(self, limit: int) -> List[Tuple[str, str, str, int]]:
+        """Shapes issued more than limit times: (command, collection, shape, times)"""
+        counts = Counter(command[:3] for command in self.commands)
+        return [key + (times,) for key, times in counts.most_common() if times > limit]
+
+    def max_repeats(self) -> int:
+        counts = Counter(command[:3] for command in self.commands)
+        return max(counts.values(), default=0)
+
+    def slow(self, threshold_ms: float) -> List[Tuple[str, str, str, float]]:
+        return [command for command in self.commands if command[3] * 1000 >= threshold_ms]
+
+    def summary(self) -> Dict:
+        return {
+            "label": self.label,
+            "commands": self.count,
+            "seconds": round(self.seconds, 6),
+            "shapes": [
+                {"command": command, "collection": collection, "shape": shape, "times": times}
+                for (command, collection, shape, times) in self.repeated(0)
+            ],
+        }
+
+    def assert_max_commands(self, limit: int):
+        if self.count > limit:
+            raise AssertionError(f"{self.label or 'trace'} issued {self.count} commands, at most {limit} expected: "
+                                 f"{json.dumps(self.summary()['shapes'])}")
+
+    def assert_no_repeats(self, limit: int = 1):
+        repeated = self.repeated(limit)
+        if repeated:
+            details = "; ".join(f"{times}x {command} {collection} {shape}"
+                                for command, collection, shape, times in repeated)
+            raise AssertionError(f"{self.label or 'trace'} repeated a query shape more than {limit} times: {details}")
+
+
+current_report: contextvars.ContextVar[Optional[QueryReport]] = contextvars.ContextVar(
+    "current_query_report", default=None)
+
+
+class QueryMonitor(monitoring.CommandListener):
+    def __init__(self, slow_ms: float = 100, repeat_limit: int = 10):
+        self.slow_ms = slow_ms
+        self.repeat_limit = repeat_limit
+        self._started: Dict[Tuple[object, int], Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name not in DATA_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = (
+                collection if isinstance(collection, str) else "",
+                command_shape(event.command_name, event.command),
+            )
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        with self._lock:
+            started = self._started.pop((event.connection_id, event.request_id), None)
+        if started is None:
+            return
+        collection, shape = started
+        seconds = event.duration_micros / 1_000_000
+        report = current_report.get()
+        if report is not None:
+            report.add(event.command_name, collection, shape, seconds)
+        if seconds * 1000 >= self.slow_ms:
+            logger.warning("Slow query %.1f ms in %s: %s %s %s", seconds * 1000,
+                           report.label if report is not None else "background", event.command_name, collection, shape)
+
+    @contextmanager
+    def trace(self, label: str = "") -> Iterator[QueryReport]:
+        """Collect the commands issued inside the block, including awaited Motor calls"""
+        report = QueryReport(label)
+        token = current_report.set(report)
+        try:
+            yield report
+        finally:
+            current_report.reset(token)
+            self.check(report)
+
+    def check(self, report: QueryReport):
+        for command, collection, shape, times in report.repeated(self.repeat_limit):
+            logger.warning("Possible N+1 in %s: %s on %s issued %d times with shape %s",
+                           report.label, command, collection, times, shape)
+
+
+class QueryMonitorMiddleware:
+    """Traces every HTTP request; with expose_headers the totals go out as response headers"""
+
+    def __init__(self, app, monitor: QueryMonitor, expose_headers: bool = False):
+        self.app = app
+        self.monitor = monitor
+        self.expose_headers = expose_headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with self.monitor.trace(f"{scope['method']} {scope['path']}") as report:
+            async def send_with_report(message):
+                if message["type"] == "http.response.start" and self.expose_headers:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-db-commands", str(report.count).encode()))
+                    headers.append((b"x-db-max-repeats", str(report.max_repeats()).encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_report)
+            finally:
+                route = scope.get("route")
+                if getattr(route, "path", None):
+                    report.label = f"{scope['method']} {route.path}"
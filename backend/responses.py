@@ -0,0 +1,51 @@
+"""JSON responses rendered with orjson.
+
+FastAPI passes every returned dict through ``jsonable_encoder``, which walks
+each nested dict, list and datetime in Python before ``json.dumps`` walks them
+again. orjson encodes dicts, datetimes, enums and numpy values natively in one
+pass. Handlers with large bodies return ``FastJSONResponse`` directly, which
+skips ``jsonable_encoder`` altogether; as the app's default response class it
+also renders everything else.
+
+The output matches ``jsonable_encoder`` + ``json.dumps`` for the documents the
+API returns: naive datetimes as ``2024-01-31T08:00:00``, enums by value.
+Without orjson installed, or after ``use_orjson(False)``, the standard
+library path is used.
+"""
+import json
+from typing import Any
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY if orjson else 0
+_use_orjson = orjson is not None
+
+
+def use_orjson(enabled: bool) -> bool:
+    """Switch the encoder; returns whether orjson is actually used"""
+    global _use_orjson
+    _use_orjson = enabled and orjson is not None
+    return _use_orjson
+
+
+def _default(value: Any):
+    # Pydantic models, sets, Decimals and anything else orjson does not know
+    return jsonable_encoder(value)
+
+
+def dumps(content: Any) -> bytes:
+    if _use_orjson:
+        return orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
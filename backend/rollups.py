@@ -0,0 +1,28 @@
+"""Maintenance commands for the earnings_rollups collection.
+
+    python rollups.py check     # report rollups that disagree with the schedules
+    python rollups.py rebuild   # recompute every rollup from the schedules
+"""
+import asyncio
+import sys
+
+from server import check_earnings_rollups, rebuild_earnings_rollups
+
+
+async def _main(command: str) -> int:
+    if command == "rebuild":
+        count = await rebuild_earnings_rollups()
+        print(f"Earnings rollups rebuilt for {count} schedules")
+        return 0
+    if command == "check":
+        problems = await check_earnings_rollups()
+        for problem in problems:
+            print(problem)
+        print(f"{len(problems)} inconsistencies found" if problems else "Earnings rollups are consistent")
+        return 1 if problems else 0
+    print(__doc__)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else "")))
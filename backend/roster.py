@@ -0,0 +1,175 @@
+"""Automatic monthly roster generation.
+
+A greedy pass walks the days in order, day shift before night shift. Each shift
+takes the required number of the store's employees who can still work it under
+the rules, fewest hours first. A local search then moves shifts from the busiest
+employee of a store to the least busy while the rules allow, to even out hours.
+
+Rules are the ones ``conflicts.find_conflicts`` checks (``RosterRules``), with
+the same shift times: day shift at 08:00 and night shift at 20:00. Shifts an
+employee already has this month, e.g. in a store that is not being generated,
+are passed as ``busy`` and respected; busy custom shifts, which have no start
+time, only count towards hours and working days. Several stores are generated together so
+that shared employees are never double-booked.
+"""
+import calendar
+import random
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from conflicts import SLOT_ORDER, SLOT_START_HOURS, TIMED_SLOTS, RosterRules
+
+GENERATED_SHIFTS = ("day", "night")
+# Shifts within this many slots can be too close for the rest rule (two days)
+NEIGHBOUR_SLOTS = 2 * len(SLOT_ORDER)
+
+
+class RosterState:
+    """Booked shifts of every employee as employee × (day, slot) arrays"""
+
+    def __init__(self, days: int, employees: List[str], rules: RosterRules):
+        self.days = days
+        self.rules = rules
+        self.index = {employee_id: i for i, employee_id in enumerate(employees)}
+        slots = days * len(SLOT_ORDER)
+        self.starts = (np.arange(days)[:, None] * 24 + SLOT_START_HOURS[None, :]).reshape(slots)
+        self.ends = np.full((len(employees), slots), -np.inf)
+        self.day_hours = np.zeros((len(employees), days))
+
+    def slot(self, day: int, shift_type: str) -> int:
+        return day * len(SLOT_ORDER) + SLOT_ORDER[shift_type]
+
+    def book(self, employee: int, day: int, shift_type: str, hours: float):
+        t = self.slot(day, shift_type)
+        if TIMED_SLOTS[SLOT_ORDER[shift_type]]:
+            self.ends[employee, t] = max(self.ends[employee, t], self.starts[t] + hours)
+        self.day_hours[employee, day] += hours
+
+    def release(self, employee: int, day: int, shift_type: str, hours: float):
+        if TIMED_SLOTS[SLOT_ORDER[shift_type]]:
+            self.ends[employee, self.slot(day, shift_type)] = -np.inf
+        self.day_hours[employee, day] -= hours
+
+    def can_work(self, employees: np.ndarray, day: int, shift_type: str, hours: float) -> np.ndarray:
+        """Which of the given employees may take this shift"""
+        rules = self.rules
+        t = self.slot(day, shift_type)
+        start, end = self.starts[t], self.starts[t] + hours
+        ends = self.ends[employees]
+        ok = ~np.isfinite(ends[:, t])
+
+        # Rest before: latest end of the earlier neighbouring slots
+        before = ends[:, max(0, t - NEIGHBOUR_SLOTS):t]
+        if before.shape[1]:
+            ok &= start - before.max(axis=1) >= rules.min_rest_hours
+        # Rest after: earliest start of a booked later neighbouring slot
+        after = ends[:, t + 1:t + 1 + NEIGHBOUR_SLOTS]
+        if after.shape[1]:
+            later_starts = np.where(np.isfinite(after), self.starts[t + 1:t + 1 + after.shape[1]], np.inf)
+            ok &= later_starts.min(axis=1) - end >= rules.min_rest_hours
+
+        day_hours = self.day_hours[employees]
+        ok &= day_hours.sum(axis=1) + hours <= rules.max_monthly_hours
+
+        # Every 7-day window containing the day stays under the weekly cap
+        window = min(7, self.days)
+        cumulative = np.concatenate([np.zeros((len(employees), 1)), np.cumsum(day_hours, axis=1)], axis=1)
+        first, last = max(0, day - window + 1), min(day, self.days - window)
+        for w in range(first, last + 1):
+            ok &= cumulative[:, w + window] - cumulative[:, w] + hours <= rules.max_weekly_hours
+
+        # Working streak through this day, counting booked days on both sides
+        limit = rules.max_consecutive_days
+        worked = day_hours > 0
+        left = np.cumprod(worked[:, max(0, day - limit):day][:, ::-1], axis=1).sum(axis=1)
+        right = np.cumprod(worked[:, day + 1:day + 1 + limit], axis=1).sum(axis=1)
+        ok &= worked[:, day] | (left + 1 + right <= limit)
+        return ok
+
+
+def generate_rosters(year: int, month: int, staff: Dict[str, List[str]], headcount: Dict[str, int],
+                     hours: Dict[str, float], rules: RosterRules,
+                     busy: Iterable[Tuple[str, str, str, float]] = (),
+                     seed: Optional[int] = None, search_rounds: int = 200):
+    """Assign shifts for each store in staff (store_id -> employee ids).
+
+    headcount and hours are per shift type ("day", "night"); busy holds
+    (employee_id, date, shift_type, hours) already booked elsewhere.
+    Returns ({store_id: {date: {shift_type: [employee_id]}}}, unfilled shifts).
+    """
+    days = calendar.monthrange(year, month)[1]
+    employees = sorted({employee_id for ids in staff.values() for employee_id in ids})
+    state = RosterState(days, employees, rules)
+    rng = random.Random(seed)
+    prefix = f"{year:04d}-{month:02d}-"
+
+    for employee_id, date, shift_type, shift_hours in busy:
+        if employee_id in state.index and date.startswith(prefix) and shift_type in SLOT_ORDER:
+            state.book(state.index[employee_id], int(date[8:10]) - 1, shift_type, shift_hours)
+
+    rosters = {store_id: {} for store_id in staff}
+    unfilled = []
+    for day in range(days):
+        date = f"{prefix}{day + 1:02d}"
+        for store_id, employee_ids in staff.items():
+            candidates = np.array([state.index[e] for e in employee_ids], dtype=np.int64)
+            for shift_type in GENERATED_SHIFTS:
+                needed = headcount.get(shift_type, 0)
+                if not needed:
+                    continue
+                chosen = []
+                if len(candidates):
+                    feasible = candidates[state.can_work(candidates, day, shift_type, hours[shift_type])]
+                    # Fewest hours first, ties broken at random
+                    totals = state.day_hours[feasible].sum(axis=1)
+                    ties = np.array([rng.random() for _ in range(len(feasible))])
+                    chosen = feasible[np.lexsort((ties, totals))][:needed].tolist()
+                for employee in chosen:
+                    state.book(employee, day, shift_type, hours[shift_type])
+                rosters[store_id].setdefault(date, {})[shift_type] = chosen
+                if len(chosen) < needed:
+                    unfilled.append({"store_id": store_id, "date": date, "shift_type": shift_type,
+                                     "missing": needed - len(chosen)})
+
+    for store_id, employee_ids in staff.items():
+        _balance(state, rosters[store_id], [state.index[e] for e in employee_ids], hours, search_rounds)
+
+    result = {
+        store_id: {
+            date: {shift_type: [employees[e] for e in chosen] for shift_type, chosen in shifts.items()}
+            for date, shifts in roster.items()
+        }
+        for store_id, roster in rosters.items()
+    }
+    return result, unfilled
+
+
+def _balance(state: RosterState, roster: Dict[str, Dict[str, List[int]]], members: List[int],
+             hours: Dict[str, float], rounds: int):
+    """Move shifts from the busiest to the least busy employee while it narrows the gap"""
+    if len(members) < 2:
+        return
+    members = np.array(members, dtype=np.int64)
+    for _ in range(rounds):
+        totals = state.day_hours[members].sum(axis=1)
+        busiest, idlest = members[totals.argmax()], members[totals.argmin()]
+        if not _move_one_shift(state, roster, busiest, idlest, totals.max() - totals.min(), hours):
+            return
+
+
+def _move_one_shift(state: RosterState, roster, source: int, target: int, gap: float,
+                    hours: Dict[str, float]) -> bool:
+    for date, shifts in roster.items():
+        day = int(date[8:10]) - 1
+        for shift_type, chosen in shifts.items():
+            shift_hours = hours[shift_type]
+            if source not in chosen or target in chosen or shift_hours >= gap:
+                continue
+            state.release(source, day, shift_type, shift_hours)
+            if state.can_work(np.array([target]), day, shift_type, shift_hours)[0]:
+                state.book(target, day, shift_type, shift_hours)
+                chosen[chosen.index(source)] = target
+                return True
+            state.book(source, day, shift_type, shift_hours)
+    return False
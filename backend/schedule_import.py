@@ -0,0 +1,182 @@
+"""Bulk schedule import from CSV/XLSX rosters.
+
+One row per assignment; a file may cover many stores and months:
+
+    store_id,date,shift_type,employee_email,hours,notes,shift_index
+    <store id>,2024-03-01,day,anna@company.com,12,,
+    <store id>,2024-03-01,custom,ivan@company.com,6,Inventory,0
+
+employee_id may be given instead of employee_email. shift_index separates
+several custom shifts of one day. Every (store_id, year, month) in the file
+replaces that month, the same as POST /api/schedules.
+
+    python schedule_import.py roster.xlsx [--created-by manager@company.com]
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+IMPORT_COLUMNS = ["store_id", "date", "shift_type", "employee_id", "employee_email", "hours", "notes", "shift_index"]
+SHIFT_TYPES = {"day", "night", "custom"}
+MAX_REPORTED_ERRORS = 100
+
+
+def read_schedule_table(data: bytes, filename: str) -> pd.DataFrame:
+    """Read a roster file into a frame of strings with the known columns"""
+    extension = os.path.splitext(filename or "")[1].lower()
+    try:
+        if extension in (".xlsx", ".xls"):
+            frame = pd.read_excel(io.BytesIO(data), dtype=str)
+        elif extension in (".csv", ""):
+            frame = pd.read_csv(io.BytesIO(data), dtype=str, skipinitialspace=True)
+        else:
+            raise ValueError(f"Unsupported file type {extension}, expected .csv or .xlsx")
+    except ImportError as e:
+        raise ValueError(f"Reading {extension} files requires an optional package: {e}")
+    except (pd.errors.ParserError, pd.errors.EmptyDataError) as e:
+        raise ValueError(f"Cannot parse {filename}: {e}")
+
+    frame.columns = [str(column).strip().lower() for column in frame.columns]
+    missing = {"store_id", "date", "shift_type"} - set(frame.columns)
+    if "employee_id" not in frame.columns and "employee_email" not in frame.columns:
+        missing.add("employee_id or employee_email")
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(sorted(missing))}")
+
+    for column in IMPORT_COLUMNS:
+        if column not in frame.columns:
+            frame[column] = None
+    frame = frame[IMPORT_COLUMNS].copy()
+    for column in ("store_id", "date", "shift_type", "employee_id", "employee_email"):
+        frame[column] = frame[column].str.strip()
+    frame["shift_type"] = frame["shift_type"].str.lower()
+    return frame
+
+
+def validate_rows(frame: pd.DataFrame, store_ids: set, users: List[dict]) -> Tuple[pd.DataFrame, List[dict]]:
+    """Resolve employees and check every row; returns the resolved frame and row errors.
+
+    Row numbers in errors are spreadsheet rows (the header is row 1).
+    """
+    frame = frame.copy()
+    by_id = {user["id"]: user for user in users}
+    id_by_email = {user["email"]: user["id"] for user in users}
+
+    resolved = frame["employee_id"].where(frame["employee_id"].isin(by_id.keys()))
+    resolved = resolved.fillna(frame["employee_email"].map(id_by_email))
+    frame["employee_id"] = resolved
+    frame["employee_name"] = resolved.map(lambda employee_id: by_id[employee_id]["name"] if employee_id in by_id else None)
+
+    parsed = pd.to_datetime(frame["date"], format="%Y-%m-%d", errors="coerce")
+    frame["date"] = parsed.dt.strftime("%Y-%m-%d")
+    frame["year"] = parsed.dt.year
+    frame["month"] = parsed.dt.month
+
+    hours = pd.to_numeric(frame["hours"], errors="coerce")
+    bad_hours = frame["hours"].notna() & hours.isna()
+    frame["hours"] = hours
+    shift_index = pd.to_numeric(frame["shift_index"], errors="coerce")
+    bad_shift_index = frame["shift_index"].notna() & shift_index.isna()
+    frame["shift_index"] = shift_index.fillna(0).astype(int)
+
+    checks = [
+        (~frame["store_id"].isin(store_ids), "Store not found"),
+        (parsed.isna(), "Invalid date, expected YYYY-MM-DD"),
+        (~frame["shift_type"].isin(SHIFT_TYPES), "Invalid shift_type, expected day, night or custom"),
+        (frame["employee_id"].isna(), "Employee not found"),
+        (bad_hours, "Invalid hours"),
+        (bad_shift_index, "Invalid shift_index"),
+    ]
+    errors = []
+    for mask, message in checks:
+        for row in frame.index[mask.to_numpy()]:
+            errors.append({"row": int(row) + 2, "error": message})
+    errors.sort(key=lambda error: error["row"])
+    return frame, errors
+
+
+def group_schedules(frame: pd.DataFrame) -> List[dict]:
+    """Build the days of every (store_id, year, month) found in a validated frame"""
+    frame = frame.drop_duplicates(["store_id", "date", "shift_type", "shift_index", "employee_id"])
+    frame = frame.sort_values(["store_id", "date", "shift_type", "shift_index"], kind="stable")
+
+    months: Dict[tuple, Dict[str, dict]] = {}
+    custom_positions: Dict[tuple, int] = {}
+    for row in frame.itertuples(index=False):
+        days = months.setdefault((row.store_id, int(row.year), int(row.month)), {})
+        day = days.get(row.date)
+        if day is None:
+            day = days[row.date] = {"date": row.date, "day_shift": None, "night_shift": None, "custom_shifts": []}
+
+        if row.shift_type == "custom":
+            key = (row.store_id, row.date, row.shift_index)
+            if key not in custom_positions:
+                custom_positions[key] = len(day["custom_shifts"])
+                day["custom_shifts"].append(_new_shift("custom"))
+            shift = day["custom_shifts"][custom_positions[key]]
+        else:
+            shift = day[f"{row.shift_type}_shift"]
+            if shift is None:
+                shift = day[f"{row.shift_type}_shift"] = _new_shift(row.shift_type)
+
+        if shift["hours"] is None and not pd.isna(row.hours):
+            shift["hours"] = int(row.hours)
+        if shift["notes"] is None and isinstance(row.notes, str) and row.notes:
+            shift["notes"] = row.notes
+        shift["assignments"].append({
+            "employee_id": row.employee_id,
+            "employee_name": row.employee_name,
+            "earnings": None,
+            "earnings_set_at": None,
+            "earnings_set_by": None,
+            "can_edit_earnings": True,
+        })
+
+    return [
+        {"store_id": store_id, "year": year, "month": month, "days": list(days.values())}
+        for (store_id, year, month), days in months.items()
+    ]
+
+
+def _new_shift(shift_type: str) -> dict:
+    return {"type": shift_type, "assignments": [], "hours": None, "notes": None}
+
+
+async def _main(argv: List[str]) -> int:
+    from server import import_schedule_table, users_collection
+
+    parser = argparse.ArgumentParser(description="Import schedules from a CSV/XLSX roster")
+    parser.add_argument("path")
+    parser.add_argument("--created-by", default="manager@company.com", help="email of the importing manager")
+    args = parser.parse_args(argv)
+
+    manager = await users_collection.find_one({"email": args.created_by}, {"_id": 0, "id": 1})
+    if not manager:
+        print(f"User {args.created_by} not found")
+        return 2
+    with open(args.path, "rb") as f:
+        data = f.read()
+    try:
+        report = await import_schedule_table(read_schedule_table(data, args.path), manager["id"])
+    except ValueError as e:
+        print(e)
+        return 1
+
+    for error in report.get("errors", []):
+        print(f"row {error['row']}: {error['error']}")
+    if report.get("errors"):
+        print(f"{report['error_count']} invalid rows, nothing imported")
+        return 1
+    print(f"Imported {report['rows']} rows into {report['schedules']} schedules "
+          f"({report['created']} created, {report['updated']} updated) "
+          f"in {report['elapsed_seconds']}s, {report['rows_per_second']} rows/sec")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
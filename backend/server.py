@@ -1,30 +1,92 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, File, Header, Query, Response, UploadFile, status
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from pydantic import BaseModel
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Set, Tuple
+from typing_extensions import NotRequired, TypedDict
 import jwt
-import bcrypt
 import os
 import uuid
 from enum import Enum
+import asyncio
+import base64
+import calendar
+import hashlib
+import hmac
+import json
+import time
+
+from analytics import coverage_report
+from cache import TTLCache
+from compact import COMPACT_JSON, COMPACT_MSGPACK, compact_schedule, encode_msgpack, msgpack_available, negotiate
+from conflicts import RosterRules, find_conflicts
+from payroll import store_payroll, stream_csv, stream_xlsx, xlsx_available
+from roster import generate_rosters
+from indexes import ensure_indexes, verify_query_plans
+import metrics
+from passwords import PasswordHasher, PasswordPoolBusy
+from querywatch import QueryMonitor, QueryMonitorMiddleware
+from responses import FastJSONResponse, dumps, use_orjson
+from schedule_import import MAX_REPORTED_ERRORS, group_schedules, read_schedule_table, validate_rows
 
 # Environment configuration
 MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
 DB_NAME = os.environ.get("DB_NAME", "test_database")
 SECRET_KEY = "your-secret-key-change-in-production"
 ALGORITHM = "HS256"
+DEFAULT_EARNINGS = 2000.0
+# Интервал фонового задания установки ставок по умолчанию, в секундах
+EARNINGS_BACKFILL_INTERVAL = int(os.environ.get("EARNINGS_BACKFILL_INTERVAL", "300"))
+EARNINGS_BACKFILL_JOB = "earnings_backfill"
+# Fail startup if any route's query shape falls back to a collection scan
+INDEX_SELF_CHECK = os.environ.get("INDEX_SELF_CHECK", "").lower() in ("1", "true", "yes")
+# Authenticated-user caches (per process); entries also expire after the TTL, in seconds
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "10000"))
+# bcrypt runs in a process pool; beyond PASSWORD_QUEUE_LIMIT pending passwords requests get 503
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", "0")) or None
+PASSWORD_QUEUE_LIMIT = int(os.environ.get("PASSWORD_QUEUE_LIMIT", "0")) or None
+# Roster rules checked by the conflict detector
+ROSTER_MIN_REST_HOURS = float(os.environ.get("ROSTER_MIN_REST_HOURS", "12"))
+ROSTER_MAX_CONSECUTIVE_DAYS = int(os.environ.get("ROSTER_MAX_CONSECUTIVE_DAYS", "6"))
+ROSTER_MAX_WEEKLY_HOURS = float(os.environ.get("ROSTER_MAX_WEEKLY_HOURS", "60"))
+ROSTER_MAX_MONTHLY_HOURS = float(os.environ.get("ROSTER_MAX_MONTHLY_HOURS", "200"))
+# Largest batch accepted by POST /api/auth/register/batch
+USER_BATCH_LIMIT = int(os.environ.get("USER_BATCH_LIMIT", "500"))
+# Coverage heatmaps per (months, stores), dropped when one of their schedules is written
+COVERAGE_CACHE_TTL = float(os.environ.get("COVERAGE_CACHE_TTL", "300"))
+COVERAGE_CACHE_SIZE = int(os.environ.get("COVERAGE_CACHE_SIZE", "256"))
+# Commands slower than this are logged with their filter shape; a request repeating one
+# shape more than QUERY_REPEAT_LIMIT times is logged as a likely N+1 loop
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+QUERY_REPEAT_LIMIT = int(os.environ.get("QUERY_REPEAT_LIMIT", "10"))
+# Adds X-DB-Commands / X-DB-Max-Repeats to every response, for backend_test.py; off in production
+QUERY_REPORT_HEADERS = os.environ.get("QUERY_REPORT_HEADERS", "").lower() in ("1", "true", "yes")
+# Responses are rendered with orjson; set to false to fall back to the standard json module
+ORJSON_RESPONSES = os.environ.get("ORJSON_RESPONSES", "true").lower() in ("1", "true", "yes")
+# Bearer token for the Prometheus scraper on GET /api/metrics; without it only managers can read metrics
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
 
 # MongoDB setup
-client = MongoClient(MONGO_URL)
+# Every MongoDB command is counted, timed and charged to the current request
+query_monitor = QueryMonitor(slow_ms=SLOW_QUERY_MS, repeat_limit=QUERY_REPEAT_LIMIT)
+client = AsyncIOMotorClient(MONGO_URL, event_listeners=[metrics.MongoCommandListener(), query_monitor])
 db = client[DB_NAME]
 users_collection = db.users
 schedules_collection = db.schedules
 stores_collection = db.stores
+jobs_collection = db.jobs  # Persisted state of background jobs
+earnings_rollups_collection = db.earnings_rollups  # Monthly totals per (store, employee)
 
-app = FastAPI(title="Shift Schedule Manager")
+use_orjson(ORJSON_RESPONSES)
+app = FastAPI(title="Shift Schedule Manager", default_response_class=FastJSONResponse)
 
 # CORS middleware
 app.add_middleware(
@@ -34,9 +96,41 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Request counts and latency per route template, see GET /api/metrics
+app.add_middleware(metrics.MetricsMiddleware)
+# Slow commands and repeated query shapes per request
+app.add_middleware(QueryMonitorMiddleware, monitor=query_monitor, expose_headers=QUERY_REPORT_HEADERS)
 
 security = HTTPBearer()
 
+# Users by id and decoded JWT payloads by token hash
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=USER_CACHE_TTL)
+coverage_cache = TTLCache(maxsize=COVERAGE_CACHE_SIZE, ttl=COVERAGE_CACHE_TTL)
+roster_rules = RosterRules(
+    min_rest_hours=ROSTER_MIN_REST_HOURS,
+    max_consecutive_days=ROSTER_MAX_CONSECUTIVE_DAYS,
+    max_weekly_hours=ROSTER_MAX_WEEKLY_HOURS,
+    max_monthly_hours=ROSTER_MAX_MONTHLY_HOURS
+)
+password_hasher = PasswordHasher(workers=PASSWORD_WORKERS, rounds=BCRYPT_ROUNDS, queue_limit=PASSWORD_QUEUE_LIMIT)
+
+password_seconds = metrics.REGISTRY.histogram(
+    "password_hash_seconds", "bcrypt time including the wait for a pool worker, by operation.",
+    ("operation",), buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+cache_hit_ratio = metrics.REGISTRY.gauge("cache_hit_ratio", "Hit ratio of the in-process caches.", ("cache",))
+cache_entries = metrics.REGISTRY.gauge("cache_entries", "Entries held by the in-process caches.", ("cache",))
+password_pool_pending = metrics.REGISTRY.gauge("password_pool_pending", "Passwords queued or hashing in the bcrypt pool.")
+password_pool_rejected = metrics.REGISTRY.counter("password_pool_rejected_total", "bcrypt calls refused with 503.")
+
+@metrics.REGISTRY.on_collect
+def collect_process_metrics():
+    for name, cache in (("users", user_cache), ("tokens", token_cache), ("coverage", coverage_cache)):
+        stats = cache.stats()
+        cache_hit_ratio.set(stats["hit_ratio"], cache=name)
+        cache_entries.set(stats["size"], cache=name)
+    password_pool_pending.set(password_hasher.pending)
+
 # Enums and Models
 class UserRole(str, Enum):
     MANAGER = "manager"
@@ -78,6 +172,9 @@ class UserCreate(BaseModel):
     role: UserRole = UserRole.EMPLOYEE
     store_ids: List[str] = []  # For employees, specify which stores they work at
 
+class UserBatchCreate(BaseModel):
+    users: List[UserCreate]
+
 class UserLogin(BaseModel):
     email: str
     password: str
@@ -117,6 +214,72 @@ class ScheduleCreate(BaseModel):
     year: int
     days: List[DaySchedule]
 
+# Тело POST /api/schedules: те же поля, что у ScheduleCreate, но pydantic проверяет JSON
+# сразу в словари, без моделей на каждый день и назначение и без копии через .dict()
+class ShiftAssignmentPayload(TypedDict):
+    employee_id: str
+    employee_name: str
+    earnings: NotRequired[Optional[float]]
+    earnings_set_at: NotRequired[Optional[datetime]]
+    earnings_set_by: NotRequired[Optional[str]]
+    can_edit_earnings: NotRequired[Optional[bool]]
+
+class ShiftPayload(TypedDict):
+    type: ShiftType
+    assignments: List[ShiftAssignmentPayload]
+    hours: NotRequired[Optional[int]]
+    notes: NotRequired[Optional[str]]
+
+class DaySchedulePayload(TypedDict):
+    date: str  # YYYY-MM-DD, within the schedule month
+    day_shift: NotRequired[Optional[ShiftPayload]]
+    night_shift: NotRequired[Optional[ShiftPayload]]
+    custom_shifts: NotRequired[List[ShiftPayload]]
+
+class ScheduleCreatePayload(TypedDict):
+    store_id: str
+    month: int
+    year: int
+    days: List[DaySchedulePayload]
+
+class ScheduleOperationType(str, Enum):
+    ASSIGN = "assign"
+    UNASSIGN = "unassign"
+    SET_HOURS = "set_hours"
+    SET_NOTES = "set_notes"
+    ADD_CUSTOM_SHIFT = "add_custom_shift"
+    REMOVE_CUSTOM_SHIFT = "remove_custom_shift"
+
+class ScheduleOperation(BaseModel):
+    op: ScheduleOperationType
+    date: str  # YYYY-MM-DD format
+    shift_type: Optional[ShiftType] = None  # Not used by add/remove_custom_shift
+    shift_index: Optional[int] = None  # Position in custom_shifts for custom shifts
+    employee_id: Optional[str] = None
+    employee_name: Optional[str] = None  # Defaults to the user's name for assign
+    hours: Optional[int] = None
+    notes: Optional[str] = None
+
+class SchedulePatch(BaseModel):
+    operations: List[ScheduleOperation]
+    expected_version: Optional[int] = None  # Reject the batch if the month changed since this version
+
+class RosterGenerate(BaseModel):
+    store_ids: List[str]
+    year: int
+    month: int
+    day_headcount: int = 2  # Employees per day shift
+    night_headcount: int = 2  # Employees per night shift
+    day_hours: int = 12
+    night_hours: int = 12
+    # Rule overrides; the ROSTER_* settings apply otherwise
+    min_rest_hours: Optional[float] = None
+    max_consecutive_days: Optional[int] = None
+    max_weekly_hours: Optional[float] = None
+    max_monthly_hours: Optional[float] = None
+    save: bool = True  # False returns the generated schedules without saving them
+    seed: Optional[int] = None  # Fixed seed makes the result repeatable
+
 class EarningsUpdate(BaseModel):
     earnings: float
     
@@ -126,11 +289,34 @@ class EarningsResponse(BaseModel):
     can_edit: bool
 
 # Utility functions
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+def password_pool_busy() -> HTTPException:
+    password_pool_rejected.inc()
+    return HTTPException(
+        status_code=503,
+        detail="Server is busy, please try again",
+        headers={"Retry-After": "1"}
+    )
+
+async def hash_passwords(passwords: List[str]) -> List[str]:
+    try:
+        with password_seconds.time(operation="hash_batch"):
+            return await password_hasher.hash_many(passwords)
+    except PasswordPoolBusy:
+        raise password_pool_busy()
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+async def hash_password(password: str) -> str:
+    try:
+        with password_seconds.time(operation="hash"):
+            return await password_hasher.hash(password)
+    except PasswordPoolBusy:
+        raise password_pool_busy()
+
+async def verify_password(password: str, hashed: str) -> bool:
+    try:
+        with password_seconds.time(operation="verify"):
+            return await password_hasher.verify(password, hashed)
+    except PasswordPoolBusy:
+        raise password_pool_busy()
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -139,28 +325,75 @@ def create_access_token(data: dict):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    token_key = hashlib.sha256(credentials.credentials.encode("utf-8")).hexdigest()
+    payload = token_cache.get(token_key)
+    if payload is not None and payload.get("exp", 0) > time.time():
+        return payload
+    
     try:
         payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
+        token_cache.set(token_key, payload)
         return payload
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-def get_current_user(token_data: dict = Depends(verify_token)):
-    user = users_collection.find_one({"id": token_data.get("sub")})
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
-    user.pop("password", None)
-    user.pop("_id", None)  # Remove MongoDB ObjectId
-    return user
+async def get_current_user(token_data: dict = Depends(verify_token)):
+    user_id = token_data.get("sub")
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await users_collection.find_one({"id": user_id}, {"_id": 0, "password": 0})
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+        user_cache.set(user_id, user)
+    # Copy so handlers cannot modify the cached entry
+    return dict(user)
 
 def require_manager(current_user: dict = Depends(get_current_user)):
     if current_user["role"] != UserRole.MANAGER:
         raise HTTPException(status_code=403, detail="Manager access required")
     return current_user
 
+async def require_metrics_access(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """The scrape token from METRICS_TOKEN, otherwise a manager's access token"""
+    if METRICS_TOKEN and hmac.compare_digest(credentials.credentials.encode("utf-8"), METRICS_TOKEN.encode("utf-8")):
+        return
+    require_manager(await get_current_user(verify_token(credentials)))
+
+def make_etag(*parts) -> str:
+    """Strong ETag from document ids and versions"""
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    return f'"{digest}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison (RFC 7232): W/ is dropped, e.g. from the ETag nginx weakens when it gzips"""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    candidates = [candidate[2:] if candidate.startswith("W/") else candidate for candidate in candidates]
+    return "*" in candidates or etag in candidates
+
+def stores_etag(stores: List[dict]) -> str:
+    return make_etag(*sorted(f"{store['id']}:{store.get('version', 0)}" for store in stores))
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+def earnings_deadline(shift_date: str) -> datetime:
+    """Момент, после которого сотрудник больше не может редактировать ставку за смену"""
+    shift_datetime = datetime.strptime(shift_date, "%Y-%m-%d")
+    # Предполагаем, что смена заканчивается в 23:59 того же дня
+    shift_end = shift_datetime.replace(hour=23, minute=59, second=59)
+    return shift_end + timedelta(hours=12)
+
+def last_locked_shift_date(now: datetime) -> str:
+    """Последняя дата смены (YYYY-MM-DD), срок редактирования ставки которой истёк к моменту now"""
+    # earnings_deadline(date) == date + 35:59:59, смена закрыта если now > deadline
+    latest = now - timedelta(hours=35, minutes=59, seconds=59, microseconds=1)
+    return latest.strftime("%Y-%m-%d")
+
 def can_edit_earnings(shift_date: str, current_user: dict) -> bool:
     """Проверяет, может ли пользователь редактировать ставку за смену"""
     # Менеджеры всегда могут редактировать
@@ -169,73 +402,364 @@ def can_edit_earnings(shift_date: str, current_user: dict) -> bool:
     
     # Сотрудники могут редактировать только в течение 12 часов после смены
     try:
-        shift_datetime = datetime.strptime(shift_date, "%Y-%m-%d")
-        # Предполагаем, что смена заканчивается в 23:59 того же дня
-        shift_end = shift_datetime.replace(hour=23, minute=59, second=59)
-        twelve_hours_later = shift_end + timedelta(hours=12)
-        
-        return datetime.now() <= twelve_hours_later
+        return datetime.now() <= earnings_deadline(shift_date)
     except:
         return False
 
-def set_default_earnings_if_needed():
-    """Устанавливает ставки по умолчанию (2000₽) для смен старше 12 часов без ставки"""
-    try:
-        # Найти все расписания
-        schedules = schedules_collection.find({})
+def fill_default_earnings(days: List[dict], date_to: str) -> bool:
+    """Проставляет ставку по умолчанию в уже загруженном расписании для смен до date_to включительно"""
+    updated = False
+    now = datetime.now()
+    for day in days:
+        shift_date = day.get("date")
+        if not shift_date or shift_date > date_to:
+            continue
         
-        for schedule in schedules:
-            updated = False
-            
-            for day in schedule.get("days", []):
-                shift_date = day.get("date")
-                if not shift_date:
+        shifts = [day.get("day_shift"), day.get("night_shift")] + day.get("custom_shifts", [])
+        for shift in shifts:
+            if not shift:
+                continue
+            for assignment in shift.get("assignments", []):
+                if assignment.get("earnings") is None:
+                    set_default_assignment_earnings(assignment, now)
+                    updated = True
+    return updated
+
+def set_default_assignment_earnings(assignment: dict, now: datetime):
+    assignment["earnings"] = DEFAULT_EARNINGS
+    assignment["earnings_set_at"] = now
+    assignment["earnings_set_by"] = "auto"
+    assignment["can_edit_earnings"] = False
+
+def build_employee_shift_index(days: List[dict]) -> List[dict]:
+    """Индекс смен по сотрудникам: где в days лежат назначения каждого сотрудника.
+    
+    Хранится в документе расписания (employee_shifts) и перестраивается при каждой
+    записи структуры месяца, чтобы обработчики не обходили все дни и смены.
+    """
+    index = []
+    for day_index, day in enumerate(days):
+        shifts = [("day", None, day.get("day_shift")), ("night", None, day.get("night_shift"))]
+        shifts += [("custom", i, shift) for i, shift in enumerate(day.get("custom_shifts") or [])]
+        for shift_type, shift_index, shift in shifts:
+            if not shift:
+                continue
+            seen = set()
+            for assignment_index, assignment in enumerate(shift.get("assignments", [])):
+                # Как и раньше, учитывается только первое назначение сотрудника в смене
+                if assignment["employee_id"] in seen:
                     continue
-                
-                # Проверить все типы смен в дне
-                for shift_type in ["day_shift", "night_shift"]:
-                    shift = day.get(shift_type)
-                    if not shift:
-                        continue
-                    
-                    for assignment in shift.get("assignments", []):
-                        # Если ставка не установлена и прошло более 12 часов
-                        if (assignment.get("earnings") is None and 
-                            not can_edit_earnings(shift_date, {"role": "employee"})):
-                            
-                            assignment["earnings"] = 2000.0
-                            assignment["earnings_set_at"] = datetime.now()
-                            assignment["earnings_set_by"] = "auto"
-                            assignment["can_edit_earnings"] = False
-                            updated = True
-                
-                # Проверить custom_shifts
-                for shift in day.get("custom_shifts", []):
-                    for assignment in shift.get("assignments", []):
-                        if (assignment.get("earnings") is None and 
-                            not can_edit_earnings(shift_date, {"role": "employee"})):
-                            
-                            assignment["earnings"] = 2000.0
-                            assignment["earnings_set_at"] = datetime.now()
-                            assignment["earnings_set_by"] = "auto"
-                            assignment["can_edit_earnings"] = False
-                            updated = True
-            
-            # Обновить расписание если были изменения
-            if updated:
-                schedules_collection.update_one(
-                    {"id": schedule["id"]},
-                    {"$set": {"days": schedule["days"], "updated_at": datetime.now()}}
-                )
+                seen.add(assignment["employee_id"])
+                index.append({
+                    "employee_id": assignment["employee_id"],
+                    "date": day.get("date"),
+                    "day_index": day_index,
+                    "type": shift_type,
+                    "shift_index": shift_index,
+                    "assignment_index": assignment_index,
+                })
+    return index
+
+def employee_assignments(schedule: dict, employee_id: Optional[str] = None):
+    """Назначения сотрудника в расписании: (date, type, shift, assignment_index, assignment).
+    
+    Без employee_id возвращаются назначения всех сотрудников.
+    """
+    entries = schedule.get("employee_shifts")
+    if entries is None:
+        # Расписания, сохранённые до появления индекса
+        entries = build_employee_shift_index(schedule.get("days", []))
+    
+    days = schedule.get("days", [])
+    for entry in entries:
+        if employee_id is not None and entry["employee_id"] != employee_id:
+            continue
+        day = days[entry["day_index"]]
+        if entry["type"] == "custom":
+            shift = day["custom_shifts"][entry["shift_index"]]
+        else:
+            shift = day[f"{entry['type']}_shift"]
+        assignment = shift["assignments"][entry["assignment_index"]]
+        yield entry["date"], entry["type"], shift, entry["assignment_index"], assignment
+
+def shift_hours(shift: dict, shift_type: str) -> int:
+    """Часы смены; по умолчанию 12 для дневной/ночной и 8 для дополнительной"""
+    return shift.get("hours") or (8 if shift_type == "custom" else 12)
+
+def schedule_rollups(schedule: dict) -> Dict[str, dict]:
+    """Итоги месяца по каждому сотруднику расписания (документы earnings_rollups)"""
+    rollups = {}
+    for _, shift_type, shift, _, assignment in employee_assignments(schedule):
+        employee_id = assignment["employee_id"]
+        rollup = rollups.setdefault(employee_id, {
+            "store_id": schedule["store_id"],
+            "employee_id": employee_id,
+            "year": schedule["year"],
+            "month": schedule["month"],
+            "total_shifts": 0,
+            "day_shifts": 0,
+            "night_shifts": 0,
+            "total_hours": 0,
+            "total_earnings": 0,
+            "paid_shifts": 0,
+        })
+        rollup["total_shifts"] += 1
+        if shift_type in ("day", "night"):
+            rollup[f"{shift_type}_shifts"] += 1
+        rollup["total_hours"] += shift_hours(shift, shift_type)
+        if assignment.get("earnings"):
+            rollup["total_earnings"] += assignment["earnings"]
+            rollup["paid_shifts"] += 1
+    return rollups
+
+async def month_conflicts(year: int, month: int, schedule: Optional[dict] = None) -> List[dict]:
+    """Конфликты графика за месяц по всем магазинам.
+    
+    С schedule проверяется ещё не сохранённый месяц магазина: он заменяет сохранённый,
+    из остальных магазинов читаются только расписания с его сотрудниками, а в ответе
+    остаются конфликты с участием этого магазина.
+    """
+    query = {"year": year, "month": month}
+    if schedule is not None:
+        employee_ids = list({entry["employee_id"] for entry in schedule["employee_shifts"]})
+        if not employee_ids:
+            return []
+        query["store_id"] = {"$ne": schedule["store_id"]}
+        query["$or"] = [
+            {"employee_shifts.employee_id": {"$in": employee_ids}},
+            {"employee_shifts": {"$exists": False}},
+        ]
+    schedules = await schedules_collection.find(
+        query, {"_id": 0, "store_id": 1, "days": 1, "employee_shifts": 1}
+    ).to_list(None)
+    if schedule is not None:
+        schedules.append(schedule)
+    
+    assignments = [
+        (s["store_id"], assignment["employee_id"], date, shift_type, shift_hours(shift, shift_type))
+        for s in schedules
+        for date, shift_type, shift, _, assignment in employee_assignments(s)
+    ]
+    conflicts = find_conflicts(year, month, assignments, roster_rules)
+    if schedule is not None:
+        conflicts = [c for c in conflicts if schedule["store_id"] in c["store_ids"]]
+    return conflicts
+
+def rollup_writes(schedule: dict) -> Tuple[List[ReplaceOne], dict]:
+    """Замены итогов месяца по сотрудникам (upsert) и фильтр итогов тех, кого в месяце больше нет"""
+    month_filter = {"store_id": schedule["store_id"], "year": schedule["year"], "month": schedule["month"]}
+    rollups = schedule_rollups(schedule)
+    operations = [ReplaceOne({**month_filter, "employee_id": employee_id}, rollup, upsert=True)
+                  for employee_id, rollup in rollups.items()]
+    return operations, {**month_filter, "employee_id": {"$nin": list(rollups)}}
+
+async def write_schedule_rollups(schedule: dict):
+    """Пересчитать итоги одного месяца магазина целиком.
+    
+    Итоги заменяются на месте, без окна с пустой историей и без гонки delete/insert
+    по уникальному ключу при параллельных сохранениях одного месяца.
+    """
+    operations, stale_filter = rollup_writes(schedule)
+    if operations:
+        await earnings_rollups_collection.bulk_write(operations, ordered=False)
+    await earnings_rollups_collection.delete_many(stale_filter)
+
+def invalidate_coverage(store_id: str, year: int, month: int):
+    """Сбросить закэшированные тепловые карты, в которые входит этот месяц магазина"""
+    coverage_cache.invalidate_where(lambda key: (year, month) in key[0] and store_id in key[1])
+
+# Расписаний в одной пакетной записи итогов
+ROLLUP_BATCH_SIZE = 200
+
+async def write_many_schedule_rollups(schedules: List[dict]):
+    """Пересчитать итоги нескольких месяцев: одна пакетная замена и одно удаление"""
+    if not schedules:
+        return
+    operations, stale_filters = [], []
+    for schedule in schedules:
+        schedule_operations, stale_filter = rollup_writes(schedule)
+        operations += schedule_operations
+        stale_filters.append(stale_filter)
+    if operations:
+        await earnings_rollups_collection.bulk_write(operations, ordered=False)
+    await earnings_rollups_collection.delete_many({"$or": stale_filters})
+
+async def rebuild_earnings_rollups() -> int:
+    """Пересобрать earnings_rollups из всех расписаний (восстановление после сбоев).
+    
+    Итоги заменяются пачками на месте, история не пустеет на время пересборки;
+    в конце удаляются итоги месяцев, для которых расписаний больше нет.
+    """
+    count = 0
+    months = set()
+    batch = []
+    async for schedule in schedules_collection.find({}, {"_id": 0}):
+        batch.append(schedule)
+        months.add((schedule["store_id"], schedule["year"], schedule["month"]))
+        count += 1
+        if len(batch) >= ROLLUP_BATCH_SIZE:
+            await write_many_schedule_rollups(batch)
+            batch = []
+    await write_many_schedule_rollups(batch)
+    
+    orphaned = [
+        month["_id"] async for month in earnings_rollups_collection.aggregate([
+            {"$group": {"_id": {"store_id": "$store_id", "year": "$year", "month": "$month"}}}
+        ])
+        if (month["_id"]["store_id"], month["_id"]["year"], month["_id"]["month"]) not in months
+    ]
+    if orphaned:
+        await earnings_rollups_collection.delete_many({"$or": orphaned})
+    return count
+
+async def check_earnings_rollups() -> List[str]:
+    """Сравнить earnings_rollups с расписаниями; возвращает список расхождений"""
+    problems = []
+    stored = {}
+    async for rollup in earnings_rollups_collection.find({}, {"_id": 0}):
+        stored[(rollup["store_id"], rollup["employee_id"], rollup["year"], rollup["month"])] = rollup
+    
+    async for schedule in schedules_collection.find({}, {"_id": 0}):
+        for employee_id, expected in schedule_rollups(schedule).items():
+            key = (schedule["store_id"], employee_id, schedule["year"], schedule["month"])
+            actual = stored.pop(key, None)
+            if actual is None:
+                problems.append(f"{key}: rollup missing")
+                continue
+            for field, value in expected.items():
+                if isinstance(value, float) or isinstance(actual.get(field), float):
+                    mismatch = abs((actual.get(field) or 0) - value) > 0.01
+                else:
+                    mismatch = actual.get(field) != value
+                if mismatch:
+                    problems.append(f"{key}: {field} is {actual.get(field)}, expected {value}")
     
-    except Exception as e:
-        print(f"Error setting default earnings: {e}")
+    for key in stored:
+        problems.append(f"{key}: rollup without matching schedule assignments")
+    return problems
+
+async def apply_rollup_earnings_change(before: dict, shift_type: str, employee_id: str, earnings: float,
+                                       custom_shift_index: Optional[int] = None):
+    """Обновить итоги месяца на разницу между старой и новой ставкой ($inc, без пересчёта)"""
+    day = before["days"][0]
+    if shift_type == "custom":
+        shifts = (day.get("custom_shifts") or [])[custom_shift_index:custom_shift_index + 1]
+    else:
+        shifts = [day.get(f"{shift_type}_shift")]
+    
+    earnings_delta = 0
+    paid_delta = 0
+    for shift in shifts:
+        for assignment in (shift or {}).get("assignments", []):
+            if assignment["employee_id"] == employee_id:
+                old_earnings = assignment.get("earnings") or 0
+                earnings_delta += (earnings or 0) - old_earnings
+                paid_delta += bool(earnings) - bool(old_earnings)
+                break
+    
+    result = await earnings_rollups_collection.update_one(
+        {"store_id": before["store_id"], "employee_id": employee_id,
+         "year": before["year"], "month": before["month"]},
+        {"$inc": {"total_earnings": earnings_delta, "paid_shifts": paid_delta}}
+    )
+    if result.matched_count == 0:
+        # Месяц ещё не попадал в итоги: посчитать его целиком
+        schedule = await schedules_collection.find_one(
+            {"store_id": before["store_id"], "year": before["year"], "month": before["month"]}, {"_id": 0}
+        )
+        if schedule:
+            await write_schedule_rollups(schedule)
+
+async def set_default_earnings_if_needed(date_to: str, date_from: Optional[str] = None) -> int:
+    """Устанавливает ставки по умолчанию (2000₽) для смен с date_from < date <= date_to без ставки.
+    
+    Обновление точечное: одна update_many с arrayFilters затрагивает только
+    назначения без ставки, массивы days целиком не перезаписываются.
+    """
+    date_range = {"$lte": date_to}
+    if date_from:
+        date_range["$gt"] = date_from
+    missing = {"$elemMatch": {"earnings": None}}
+    
+    schedule_filter = {"days": {"$elemMatch": {
+        "date": date_range,
+        "$or": [
+            {"day_shift.assignments": missing},
+            {"night_shift.assignments": missing},
+            {"custom_shifts.assignments": missing},
+        ],
+    }}}
+    
+    now = datetime.now()
+    update = {"updated_at": now}
+    for path in [
+        "days.$[d].day_shift.assignments.$[a]",
+        "days.$[n].night_shift.assignments.$[a]",
+        "days.$[c].custom_shifts.$[].assignments.$[a]",
+    ]:
+        update[f"{path}.earnings"] = DEFAULT_EARNINGS
+        update[f"{path}.earnings_set_at"] = now
+        update[f"{path}.earnings_set_by"] = "auto"
+        update[f"{path}.can_edit_earnings"] = False
+    
+    # Месяцы, итоги которых изменятся после обновления
+    affected = await schedules_collection.find(
+        schedule_filter, {"_id": 0, "store_id": 1, "year": 1, "month": 1}
+    ).to_list(None)
+    
+    result = await schedules_collection.update_many(
+        schedule_filter,
+        {"$set": update, "$inc": {"version": 1}},
+        array_filters=[
+            {"d.date": date_range, "d.day_shift.assignments": {"$type": "array"}},
+            {"n.date": date_range, "n.night_shift.assignments": {"$type": "array"}},
+            {"c.date": date_range, "c.custom_shifts": {"$type": "array"}},
+            {"a.earnings": None},
+        ],
+    )
+    
+    # Пересчитать затронутые месяцы пачками: один find и одна запись итогов на пачку
+    for i in range(0, len(affected), ROLLUP_BATCH_SIZE):
+        schedules = await schedules_collection.find(
+            {"$or": affected[i:i + ROLLUP_BATCH_SIZE]}, {"_id": 0}
+        ).to_list(None)
+        await write_many_schedule_rollups(schedules)
+    return result.modified_count
+
+async def run_earnings_backfill() -> int:
+    """Один проход фонового задания: обрабатывает смены, закрывшиеся с прошлого запуска"""
+    state = await jobs_collection.find_one({"id": EARNINGS_BACKFILL_JOB}) or {}
+    watermark = state.get("watermark")
+    date_to = last_locked_shift_date(datetime.now())
+    if watermark and watermark >= date_to:
+        return 0
+    
+    modified = await set_default_earnings_if_needed(date_to, watermark)
+    await jobs_collection.update_one(
+        {"id": EARNINGS_BACKFILL_JOB},
+        {"$set": {"watermark": date_to, "last_run_at": datetime.now(), "last_modified": modified}},
+        upsert=True
+    )
+    return modified
+
+async def earnings_backfill_loop():
+    while True:
+        try:
+            await run_earnings_backfill()
+        except Exception as e:
+            print(f"Error setting default earnings: {e}")
+        await asyncio.sleep(EARNINGS_BACKFILL_INTERVAL)
 
 # Routes
 @app.get("/api/health")
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now()}
 
+@app.get("/api/metrics", dependencies=[Depends(require_metrics_access)])
+async def get_metrics():
+    """Process metrics in the Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
 # Store Management Routes
 @app.post("/api/stores")
 async def create_store(store_data: StoreCreate, current_user: dict = Depends(require_manager)):
@@ -247,34 +771,49 @@ async def create_store(store_data: StoreCreate, current_user: dict = Depends(req
         "name": store_data.name,
         "address": store_data.address,
         "created_at": datetime.now(),
-        "is_active": True
+        "is_active": True,
+        "version": 1
     }
     
-    stores_collection.insert_one(new_store)
+    await stores_collection.insert_one(new_store)
     new_store.pop("_id", None)
     return {"message": "Store created successfully", "store": new_store}
 
 @app.get("/api/stores")
-async def get_stores(current_user: dict = Depends(get_current_user)):
+async def get_stores(
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
     """Get all stores or user's assigned stores"""
     if current_user["role"] == UserRole.MANAGER:
         # Managers can see all stores
-        stores = list(stores_collection.find({"is_active": True}, {"_id": 0}))
+        query = {"is_active": True}
     else:
         # Employees see only their assigned stores
         user_store_ids = current_user.get("store_ids", [])
-        if user_store_ids:
-            stores = list(stores_collection.find({
-                "id": {"$in": user_store_ids}, 
-                "is_active": True
-            }, {"_id": 0}))
-        else:
-            stores = []
+        if not user_store_ids:
+            return []
+        query = {"id": {"$in": user_store_ids}, "is_active": True}
+    
+    if if_none_match:
+        # Cheap check first: only ids and versions of the listed stores
+        versions = await stores_collection.find(query, {"_id": 0, "id": 1, "version": 1}).to_list(None)
+        etag = stores_etag(versions)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
     
+    stores = await stores_collection.find(query, {"_id": 0}).to_list(None)
+    response.headers["ETag"] = stores_etag(stores)
     return stores
 
 @app.get("/api/stores/{store_id}")
-async def get_store(store_id: str, current_user: dict = Depends(get_current_user)):
+async def get_store(
+    store_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
     """Get specific store details"""
     # Check access permissions
     if current_user["role"] != UserRole.MANAGER:
@@ -282,10 +821,18 @@ async def get_store(store_id: str, current_user: dict = Depends(get_current_user
         if store_id not in user_store_ids:
             raise HTTPException(status_code=403, detail="Access denied to this store")
     
-    store = stores_collection.find_one({"id": store_id}, {"_id": 0})
+    if if_none_match:
+        current = await stores_collection.find_one({"id": store_id}, {"_id": 0, "version": 1})
+        if current is not None:
+            etag = make_etag(f"{store_id}:{current.get('version', 0)}")
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
+    
+    store = await stores_collection.find_one({"id": store_id}, {"_id": 0})
     if not store:
         raise HTTPException(status_code=404, detail="Store not found")
     
+    response.headers["ETag"] = make_etag(f"{store_id}:{store.get('version', 0)}")
     return store
 
 @app.put("/api/stores/{store_id}")
@@ -297,7 +844,7 @@ async def update_store(store_id: str, store_data: StoreUpdate, current_user: dic
     
     update_data["updated_at"] = datetime.now()
     
-    result = stores_collection.update_one({"id": store_id}, {"$set": update_data})
+    result = await stores_collection.update_one({"id": store_id}, {"$set": update_data, "$inc": {"version": 1}})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Store not found")
     
@@ -306,9 +853,9 @@ async def update_store(store_id: str, store_data: StoreUpdate, current_user: dic
 @app.delete("/api/stores/{store_id}")
 async def delete_store(store_id: str, current_user: dict = Depends(require_manager)):
     """Soft delete store (set is_active to False)"""
-    result = stores_collection.update_one(
+    result = await stores_collection.update_one(
         {"id": store_id}, 
-        {"$set": {"is_active": False, "updated_at": datetime.now()}}
+        {"$set": {"is_active": False, "updated_at": datetime.now()}, "$inc": {"version": 1}}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Store not found")
@@ -318,11 +865,11 @@ async def delete_store(store_id: str, current_user: dict = Depends(require_manag
 @app.post("/api/auth/register")
 async def register_user(user_data: UserCreate, current_user: dict = Depends(require_manager)):
     # Check if user already exists
-    if users_collection.find_one({"email": user_data.email}):
+    if await users_collection.find_one({"email": user_data.email}):
         raise HTTPException(status_code=400, detail="User already exists")
     
     # Create new user
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await hash_password(user_data.password)
     user_id = str(uuid.uuid4())
     
     new_user = {
@@ -335,17 +882,83 @@ async def register_user(user_data: UserCreate, current_user: dict = Depends(requ
         "created_at": datetime.now()
     }
     
-    users_collection.insert_one(new_user)
+    try:
+        await users_collection.insert_one(new_user)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="User already exists")
+    user_cache.invalidate(user_id)
     
     # Return user without password and _id
     new_user.pop("password", None)
     new_user.pop("_id", None)
     return {"message": "User created successfully", "user": new_user}
 
+@app.post("/api/auth/register/batch")
+async def register_users(batch: UserBatchCreate, current_user: dict = Depends(require_manager)):
+    """Create many users at once; the report has one result per submitted row"""
+    if len(batch.users) > USER_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {USER_BATCH_LIMIT} users per batch")
+    
+    results = [{"row": row, "email": user_data.email} for row, user_data in enumerate(batch.users)]
+    emails = [user_data.email for user_data in batch.users]
+    # One query for every email in the batch
+    existing = {
+        user["email"] async for user in users_collection.find({"email": {"$in": emails}}, {"_id": 0, "email": 1})
+    }
+    
+    pending = []
+    seen = set()
+    for row, user_data in enumerate(batch.users):
+        if user_data.email in existing:
+            results[row].update(status="failed", detail="User already exists")
+        elif user_data.email in seen:
+            results[row].update(status="failed", detail="Duplicate email in batch")
+        else:
+            seen.add(user_data.email)
+            pending.append(row)
+    
+    hashed_passwords = await hash_passwords([batch.users[row].password for row in pending])
+    now = datetime.now()
+    new_users = []
+    for row, hashed_password in zip(pending, hashed_passwords):
+        user_data = batch.users[row]
+        new_users.append({
+            "id": str(uuid.uuid4()),
+            "email": user_data.email,
+            "name": user_data.name,
+            "password": hashed_password,
+            "role": user_data.role,
+            "store_ids": user_data.store_ids,
+            "created_at": now
+        })
+    
+    failed_rows = {}
+    if new_users:
+        try:
+            await users_collection.insert_many(new_users, ordered=False)
+        except BulkWriteError as e:
+            # Unordered insert keeps going; only the reported documents were not written
+            for error in e.details.get("writeErrors", []):
+                failed_rows[pending[error["index"]]] = (
+                    "User already exists" if error.get("code") == 11000 else error.get("errmsg", "Insert failed")
+                )
+    
+    for row, new_user in zip(pending, new_users):
+        if row in failed_rows:
+            results[row].update(status="failed", detail=failed_rows[row])
+            continue
+        user_cache.invalidate(new_user["id"])
+        new_user.pop("password", None)
+        new_user.pop("_id", None)
+        results[row].update(status="created", user=new_user)
+    
+    created = sum(1 for result in results if result["status"] == "created")
+    return {"created": created, "failed": len(results) - created, "results": results}
+
 @app.post("/api/auth/login")
 async def login(credentials: UserLogin):
-    user = users_collection.find_one({"email": credentials.email})
-    if not user or not verify_password(credentials.password, user["password"]):
+    user = await users_collection.find_one({"email": credentials.email})
+    if not user or not await verify_password(credentials.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     access_token = create_access_token({"sub": user["id"], "role": user["role"]})
@@ -364,7 +977,7 @@ async def get_current_user_info(current_user: dict = Depends(get_current_user)):
 
 @app.get("/api/users")
 async def get_users(current_user: dict = Depends(require_manager)):
-    users = list(users_collection.find({}, {"password": 0, "_id": 0}))
+    users = await users_collection.find({}, {"password": 0, "_id": 0}).to_list(None)
     return users
 
 @app.delete("/api/users/{user_id}")
@@ -372,99 +985,636 @@ async def delete_user(user_id: str, current_user: dict = Depends(require_manager
     if user_id == current_user["id"]:
         raise HTTPException(status_code=400, detail="Cannot delete yourself")
     
-    result = users_collection.delete_one({"id": user_id})
+    result = await users_collection.delete_one({"id": user_id})
+    user_cache.invalidate(user_id)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
     return {"message": "User deleted successfully"}
 
+def new_schedule(store_id: str, year: int, month: int, days: List[dict], created_by: str) -> dict:
+    """Документ месяца магазина в том виде, в каком он сохраняется"""
+    # Фоновое задание уже прошло эти даты, поэтому ставки для прошедших смен проставляются сразу
+    fill_default_earnings(days, last_locked_shift_date(datetime.now()))
+    return {
+        "id": str(uuid.uuid4()),
+        "store_id": store_id,
+        "month": month,
+        "year": year,
+        "days": days,
+        "employee_shifts": build_employee_shift_index(days),
+        "created_by": created_by,
+        "updated_at": datetime.now()
+    }
+
+async def save_schedule(schedule: dict) -> bool:
+    """Записать месяц магазина целиком; True, если он уже существовал"""
+    # Replace the month for this store or create it; (store_id, year, month) is unique.
+    # Every field is overwritten, only the version keeps counting up.
+    previous = await schedules_collection.find_one_and_update({
+        "store_id": schedule["store_id"],
+        "month": schedule["month"],
+        "year": schedule["year"]
+    }, {"$set": schedule, "$inc": {"version": 1}}, upsert=True,
+       projection={"_id": 0, "version": 1}, return_document=ReturnDocument.BEFORE)
+    schedule["version"] = (previous or {}).get("version", 0) + 1
+    await write_schedule_rollups(schedule)
+    invalidate_coverage(schedule["store_id"], schedule["year"], schedule["month"])
+    return previous is not None
+
+def clean_schedule(schedule: dict) -> dict:
+    """Copy for responses, without MongoDB _id and the internal index"""
+    clean = schedule.copy()
+    clean.pop("_id", None)
+    clean.pop("employee_shifts", None)
+    return clean
+
+def storage_shift(shift: Optional[dict], employee_ids: Set[str]) -> Optional[dict]:
+    if shift is None:
+        return None
+    assignments = []
+    for assignment in shift["assignments"]:
+        employee_ids.add(assignment["employee_id"])
+        assignments.append({
+            "employee_id": assignment["employee_id"],
+            "employee_name": assignment["employee_name"],
+            "earnings": assignment.get("earnings"),
+            "earnings_set_at": assignment.get("earnings_set_at"),
+            "earnings_set_by": assignment.get("earnings_set_by"),
+            "can_edit_earnings": assignment.get("can_edit_earnings", True),
+        })
+    return {"type": shift["type"], "assignments": assignments, "hours": shift.get("hours"), "notes": shift.get("notes")}
+
+def storage_days(payload: dict) -> Tuple[List[dict], Set[str]]:
+    """Дни проверенного тела POST /api/schedules в виде для хранения, за один проход.
+    
+    Даты должны быть днями месяца расписания, без повторов. Возвращает дни
+    (как DaySchedule.dict()) и id всех назначенных сотрудников.
+    """
+    year, month = payload["year"], payload["month"]
+    if not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail=f"Invalid month {month}")
+    month_prefix = f"{year:04d}-{month:02d}-"
+    last_day = calendar.monthrange(year, month)[1]
+    
+    days, dates, employee_ids = [], set(), set()
+    for day in payload["days"]:
+        date = day["date"]
+        day_number = date[len(month_prefix):]
+        if (len(date) != 10 or not date.startswith(month_prefix) or not day_number.isdigit()
+                or not 1 <= int(day_number) <= last_day):
+            raise HTTPException(status_code=400, detail=f"Date {date} is outside the schedule month")
+        if date in dates:
+            raise HTTPException(status_code=400, detail=f"Date {date} is given more than once")
+        dates.add(date)
+        days.append({
+            "date": date,
+            "day_shift": storage_shift(day.get("day_shift"), employee_ids),
+            "night_shift": storage_shift(day.get("night_shift"), employee_ids),
+            "custom_shifts": [storage_shift(shift, employee_ids) for shift in day.get("custom_shifts", [])],
+        })
+    return days, employee_ids
+
 @app.post("/api/schedules")
-async def create_schedule(schedule_data: ScheduleCreate, current_user: dict = Depends(require_manager)):
+async def create_schedule(
+    schedule_data: ScheduleCreatePayload,
+    strict: bool = False,
+    current_user: dict = Depends(require_manager)
+):
+    days, employee_ids = storage_days(schedule_data)
+    
     # Validate that store exists
-    store = stores_collection.find_one({"id": schedule_data.store_id, "is_active": True})
+    store = await stores_collection.find_one({"id": schedule_data["store_id"], "is_active": True})
     if not store:
         raise HTTPException(status_code=404, detail="Store not found")
     
-    # Check if schedule already exists for this month/year/store
-    existing = schedules_collection.find_one({
-        "store_id": schedule_data.store_id,
-        "month": schedule_data.month,
-        "year": schedule_data.year
-    })
+    # Every assignment must reference an existing user; one query for the whole month
+    if employee_ids:
+        users = users_collection.find({"id": {"$in": list(employee_ids)}}, {"_id": 0, "id": 1})
+        found = {user["id"] async for user in users}
+        missing = employee_ids - found
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Employee not found: {', '.join(sorted(missing))}")
+    
+    schedule = new_schedule(
+        schedule_data["store_id"], schedule_data["year"], schedule_data["month"], days, current_user["id"]
+    )
     
-    schedule_id = str(uuid.uuid4())
+    # Conflicts with this store's other shifts and other stores are reported;
+    # with strict=true the schedule is not saved while there are any
+    conflicts = await month_conflicts(schedule_data["year"], schedule_data["month"], schedule)
+    if strict and conflicts:
+        raise HTTPException(status_code=409, detail={"message": "Schedule has conflicts", "conflicts": conflicts})
     
-    schedule = {
-        "id": schedule_id,
-        "store_id": schedule_data.store_id,
-        "month": schedule_data.month,
-        "year": schedule_data.year,
-        "days": [day.dict() for day in schedule_data.days],
-        "created_by": current_user["id"],
-        "updated_at": datetime.now()
+    existed = await save_schedule(schedule)
+    if existed:
+        return {"message": "Schedule updated successfully", "schedule": clean_schedule(schedule), "conflicts": conflicts}
+    return {"message": "Schedule created successfully", "schedule": clean_schedule(schedule), "conflicts": conflicts}
+
+def roster_days(roster: Dict[str, Dict[str, List[str]]], names: Dict[str, str], hours: Dict[str, int]) -> List[dict]:
+    """DaySchedule-дни из сгенерированного графика {date: {shift_type: [employee_id]}}"""
+    days = []
+    for date, shifts in sorted(roster.items()):
+        day = DaySchedule(date=date).dict()
+        for shift_type, employee_ids in shifts.items():
+            if not employee_ids:
+                continue
+            day[f"{shift_type}_shift"] = Shift(
+                type=shift_type,
+                assignments=[ShiftAssignment(employee_id=e, employee_name=names[e]) for e in employee_ids],
+                hours=hours[shift_type]
+            ).dict()
+        days.append(day)
+    return days
+
+@app.post("/api/schedules/generate")
+async def generate_schedules(request: RosterGenerate, current_user: dict = Depends(require_manager)):
+    """Составить графики месяца для магазинов по их сотрудникам и правилам"""
+    store_ids = list(dict.fromkeys(request.store_ids))
+    if not store_ids:
+        raise HTTPException(status_code=400, detail="No stores given")
+    found = {
+        store["id"] async for store in stores_collection.find(
+            {"id": {"$in": store_ids}, "is_active": True}, {"_id": 0, "id": 1}
+        )
     }
+    missing = [store_id for store_id in store_ids if store_id not in found]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Store not found: {', '.join(missing)}")
     
-    if existing:
-        schedules_collection.replace_one({"_id": existing["_id"]}, schedule)
-        # Return a clean copy without MongoDB _id
-        clean_schedule = schedule.copy()
-        clean_schedule.pop("_id", None)
-        return {"message": "Schedule updated successfully", "schedule": clean_schedule}
-    else:
-        schedules_collection.insert_one(schedule)
-        # Return a clean copy without MongoDB _id
-        clean_schedule = schedule.copy()
-        clean_schedule.pop("_id", None)
-        return {"message": "Schedule created successfully", "schedule": clean_schedule}
+    employees = await users_collection.find(
+        {"role": UserRole.EMPLOYEE, "store_ids": {"$in": store_ids}},
+        {"_id": 0, "id": 1, "name": 1, "store_ids": 1}
+    ).to_list(None)
+    staff = {store_id: [e["id"] for e in employees if store_id in e["store_ids"]] for store_id in store_ids}
+    names = {e["id"]: e["name"] for e in employees}
+    
+    # Shifts the same employees already have this month in other stores
+    busy = []
+    if employees:
+        async for schedule in schedules_collection.find({
+            "year": request.year,
+            "month": request.month,
+            "store_id": {"$nin": store_ids},
+            "employee_shifts.employee_id": {"$in": list(names)}
+        }, {"_id": 0, "days": 1, "employee_shifts": 1}):
+            for date, shift_type, shift, _, assignment in employee_assignments(schedule):
+                busy.append((assignment["employee_id"], date, shift_type, shift_hours(shift, shift_type)))
+    
+    overrides = request.dict(
+        include={"min_rest_hours", "max_consecutive_days", "max_weekly_hours", "max_monthly_hours"},
+        exclude_none=True
+    )
+    rules = RosterRules(**{**vars(roster_rules), **overrides})
+    hours = {"day": request.day_hours, "night": request.night_hours}
+    rosters, unfilled = await asyncio.to_thread(
+        generate_rosters, request.year, request.month, staff,
+        {"day": request.day_headcount, "night": request.night_headcount}, hours, rules, busy, request.seed
+    )
+    
+    schedules = []
+    for store_id in store_ids:
+        schedule = new_schedule(store_id, request.year, request.month,
+                                roster_days(rosters[store_id], names, hours), current_user["id"])
+        if request.save:
+            await save_schedule(schedule)
+        schedules.append(clean_schedule(schedule))
+    
+    message = "Schedules generated and saved" if request.save else "Schedules generated"
+    return {"message": message, "schedules": schedules, "unfilled": unfilled}
+
+def operation_shift(day: dict, day_index: int, op: ScheduleOperation):
+    """Смена, которую затрагивает операция: (путь в документе, смена или None)"""
+    if op.shift_type is None:
+        raise HTTPException(status_code=400, detail=f"shift_type is required for {op.op.value}")
+    if op.shift_type == ShiftType.CUSTOM:
+        custom_shifts = day.get("custom_shifts") or []
+        if op.shift_index is None or not 0 <= op.shift_index < len(custom_shifts):
+            raise HTTPException(status_code=400, detail=f"Custom shift not found on {op.date}")
+        return f"days.{day_index}.custom_shifts.{op.shift_index}", custom_shifts[op.shift_index]
+    key = f"{op.shift_type.value}_shift"
+    return f"days.{day_index}.{key}", day.get(key)
+
+def plan_schedule_patch(days: List[dict], operations: List[ScheduleOperation],
+                        employee_names: Dict[str, str], date_to: str) -> dict:
+    """Применяет операции к загруженным дням и возвращает точечное обновление документа.
+    
+    Позиции дней и смен в путях верны только для прочитанной версии расписания.
+    Смена, которую затронула одна операция, пишется через $push/$pull или $set поля;
+    новая смена или смена с несколькими операциями записывается целиком.
+    """
+    day_positions = {day.get("date"): i for i, day in enumerate(days)}
+    new_days = set()
+    touched = {}  # путь -> {"target": смена или список, "created": bool, "ops": [(op, значение)]}
+    now = datetime.now()
+    
+    for op in operations:
+        day_index = day_positions.get(op.date)
+        if day_index is None:
+            days.append(DaySchedule(date=op.date).dict())
+            day_index = day_positions[op.date] = len(days) - 1
+            new_days.add(day_index)
+        day = days[day_index]
+        
+        if op.op in (ScheduleOperationType.ADD_CUSTOM_SHIFT, ScheduleOperationType.REMOVE_CUSTOM_SHIFT):
+            path = f"days.{day_index}.custom_shifts"
+            if day.get("custom_shifts") is None:
+                day["custom_shifts"] = []
+                touched.setdefault(path, {"target": day["custom_shifts"], "created": True, "ops": []})
+            custom_shifts = day["custom_shifts"]
+            if op.op == ScheduleOperationType.ADD_CUSTOM_SHIFT:
+                value = Shift(type=ShiftType.CUSTOM, assignments=[], hours=op.hours, notes=op.notes).dict()
+                custom_shifts.append(value)
+            else:
+                if op.shift_index is None or not 0 <= op.shift_index < len(custom_shifts):
+                    raise HTTPException(status_code=400, detail=f"Custom shift not found on {op.date}")
+                value = custom_shifts.pop(op.shift_index)
+            entry = touched.setdefault(path, {"target": custom_shifts, "created": False, "ops": []})
+            entry["ops"].append((op, value))
+            continue
+        
+        path, shift = operation_shift(day, day_index, op)
+        created = False
+        if shift is None:
+            if op.op == ScheduleOperationType.UNASSIGN:
+                raise HTTPException(status_code=400, detail=f"Employee is not assigned to this shift on {op.date}")
+            shift = day[f"{op.shift_type.value}_shift"] = Shift(type=op.shift_type, assignments=[]).dict()
+            created = True
+        
+        value = None
+        if op.op in (ScheduleOperationType.ASSIGN, ScheduleOperationType.UNASSIGN):
+            if not op.employee_id:
+                raise HTTPException(status_code=400, detail=f"employee_id is required for {op.op.value}")
+            assigned = any(a["employee_id"] == op.employee_id for a in shift["assignments"])
+            if op.op == ScheduleOperationType.ASSIGN:
+                if op.employee_id not in employee_names:
+                    raise HTTPException(status_code=400, detail=f"Employee {op.employee_id} not found")
+                if assigned:
+                    raise HTTPException(status_code=400, detail=f"Employee is already assigned to this shift on {op.date}")
+                value = ShiftAssignment(
+                    employee_id=op.employee_id,
+                    employee_name=op.employee_name or employee_names[op.employee_id]
+                ).dict()
+                # Прошедшие смены сразу получают ставку по умолчанию, как при сохранении месяца
+                if op.date <= date_to:
+                    set_default_assignment_earnings(value, now)
+                shift["assignments"].append(value)
+            else:
+                if not assigned:
+                    raise HTTPException(status_code=400, detail=f"Employee is not assigned to this shift on {op.date}")
+                shift["assignments"] = [a for a in shift["assignments"] if a["employee_id"] != op.employee_id]
+        elif op.op == ScheduleOperationType.SET_HOURS:
+            shift["hours"] = op.hours
+        else:
+            shift["notes"] = op.notes
+        
+        entry = touched.setdefault(path, {"target": shift, "created": created, "ops": []})
+        entry["target"] = shift
+        entry["ops"].append((op, value))
+    
+    set_fields, push_fields, pull_fields = {}, {}, {}
+    for day_index in new_days:
+        set_fields[f"days.{day_index}"] = days[day_index]
+    
+    for path, entry in touched.items():
+        day_index = int(path.split(".")[1])
+        if day_index in new_days:
+            continue
+        list_path = f"days.{day_index}.custom_shifts"
+        if path.startswith(list_path + ".") and list_path in touched:
+            # Список дополнительных смен дня записывается целиком ниже
+            continue
+        ops = entry["ops"]
+        
+        if path == list_path:
+            nested = any(other.startswith(list_path + ".") for other in touched)
+            removed = any(op.op == ScheduleOperationType.REMOVE_CUSTOM_SHIFT for op, _ in ops)
+            if entry["created"] or nested or removed:
+                set_fields[path] = entry["target"]
+            else:
+                push_fields[path] = {"$each": [value for _, value in ops]}
+            continue
+        
+        if entry["created"] or len(ops) > 1:
+            set_fields[path] = entry["target"]
+            continue
+        op, value = ops[0]
+        if op.op == ScheduleOperationType.ASSIGN:
+            push_fields[f"{path}.assignments"] = value
+        elif op.op == ScheduleOperationType.UNASSIGN:
+            pull_fields[f"{path}.assignments"] = {"employee_id": op.employee_id}
+        elif op.op == ScheduleOperationType.SET_HOURS:
+            set_fields[f"{path}.hours"] = op.hours
+        else:
+            set_fields[f"{path}.notes"] = op.notes
+    
+    update = {"$set": set_fields}
+    if push_fields:
+        update["$push"] = push_fields
+    if pull_fields:
+        update["$pull"] = pull_fields
+    return update
+
+@app.patch("/api/schedules/{store_id}/{year}/{month}")
+async def patch_schedule(
+    store_id: str,
+    year: int,
+    month: int,
+    patch: SchedulePatch,
+    current_user: dict = Depends(require_manager)
+):
+    """Изменить расписание месяца пакетом операций без пересылки всех дней"""
+    if not patch.operations:
+        raise HTTPException(status_code=400, detail="No operations given")
+    
+    month_prefix = f"{year:04d}-{month:02d}-"
+    for op in patch.operations:
+        try:
+            datetime.strptime(op.date, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid date {op.date}")
+        if not op.date.startswith(month_prefix):
+            raise HTTPException(status_code=400, detail=f"Date {op.date} is outside the schedule month")
+    
+    schedule_filter = {"store_id": store_id, "year": year, "month": month}
+    schedule = await schedules_collection.find_one(schedule_filter, {"_id": 0})
+    if not schedule:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    
+    version = schedule.get("version", 0)
+    if patch.expected_version is not None and patch.expected_version != version:
+        raise HTTPException(status_code=409, detail="Schedule was modified, reload it and retry")
+    
+    # Имена всех назначаемых сотрудников одним запросом
+    employee_ids = list({op.employee_id for op in patch.operations
+                         if op.op == ScheduleOperationType.ASSIGN and op.employee_id})
+    employee_names = {}
+    if employee_ids:
+        async for user in users_collection.find({"id": {"$in": employee_ids}}, {"_id": 0, "id": 1, "name": 1}):
+            employee_names[user["id"]] = user["name"]
+    
+    days = schedule.setdefault("days", [])
+    update = plan_schedule_patch(days, patch.operations, employee_names, last_locked_shift_date(datetime.now()))
+    now = datetime.now()
+    schedule["employee_shifts"] = build_employee_shift_index(days)
+    update["$set"].update({"employee_shifts": schedule["employee_shifts"], "updated_at": now})
+    update["$inc"] = {"version": 1}
+    
+    # Пути построены по прочитанной версии: запись проходит, только если её никто не опередил
+    version_filter = {"version": version} if "version" in schedule else {"version": {"$exists": False}}
+    result = await schedules_collection.update_one({**schedule_filter, **version_filter}, update)
+    if result.matched_count == 0:
+        raise HTTPException(status_code=409, detail="Schedule was modified, reload it and retry")
+    
+    schedule["version"] = version + 1
+    schedule["updated_at"] = now
+    await write_schedule_rollups(schedule)
+    invalidate_coverage(store_id, year, month)
+    
+    return {"message": "Schedule updated successfully", "version": schedule["version"]}
+
+async def import_schedule_table(frame, created_by: str) -> dict:
+    """Записать расписания из таблицы импорта; при ошибках в строках ничего не пишется"""
+    started = time.perf_counter()
+    store_ids = frame["store_id"].dropna().unique().tolist()
+    employee_ids = frame["employee_id"].dropna().unique().tolist()
+    emails = frame["employee_email"].dropna().unique().tolist()
+    
+    # Один запрос на магазины и один на сотрудников для всего файла
+    known_stores = {
+        store["id"] async for store in stores_collection.find(
+            {"id": {"$in": store_ids}, "is_active": True}, {"_id": 0, "id": 1}
+        )
+    }
+    users = await users_collection.find(
+        {"$or": [{"id": {"$in": employee_ids}}, {"email": {"$in": emails}}]},
+        {"_id": 0, "id": 1, "email": 1, "name": 1}
+    ).to_list(None)
+    
+    frame, errors = validate_rows(frame, known_stores, users)
+    if errors:
+        return {"rows": len(frame), "error_count": len(errors), "errors": errors[:MAX_REPORTED_ERRORS]}
+    
+    schedules = group_schedules(frame)
+    now = datetime.now()
+    date_to = last_locked_shift_date(now)
+    operations = []
+    for schedule in schedules:
+        fill_default_earnings(schedule["days"], date_to)
+        schedule.update({
+            "id": str(uuid.uuid4()),
+            "employee_shifts": build_employee_shift_index(schedule["days"]),
+            "created_by": created_by,
+            "updated_at": now,
+        })
+        operations.append(UpdateOne(
+            {"store_id": schedule["store_id"], "year": schedule["year"], "month": schedule["month"]},
+            {"$set": schedule, "$inc": {"version": 1}},
+            upsert=True
+        ))
+    
+    created = updated = 0
+    if operations:
+        result = await schedules_collection.bulk_write(operations, ordered=False)
+        created, updated = result.upserted_count, result.matched_count
+        await write_many_schedule_rollups(schedules)
+        for schedule in schedules:
+            invalidate_coverage(schedule["store_id"], schedule["year"], schedule["month"])
+    
+    elapsed = time.perf_counter() - started
+    return {
+        "rows": len(frame),
+        "schedules": len(schedules),
+        "created": created,
+        "updated": updated,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(len(frame) / elapsed, 1) if elapsed else None,
+    }
+
+@app.post("/api/schedules/import")
+async def import_schedules(file: UploadFile = File(...), current_user: dict = Depends(require_manager)):
+    """Импорт расписаний нескольких магазинов и месяцев из CSV/XLSX"""
+    data = await file.read()
+    try:
+        frame = await asyncio.to_thread(read_schedule_table, data, file.filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    report = await import_schedule_table(frame, current_user["id"])
+    if report.get("errors"):
+        raise HTTPException(status_code=400, detail=report)
+    return report
+
+def schedule_etag(schedule: dict, representation: Optional[str] = None) -> str:
+    parts = [schedule["store_id"], schedule["year"], schedule["month"], schedule.get("version", 0)]
+    # Each representation of the same version is a different entity
+    return make_etag(*parts, representation) if representation else make_etag(*parts)
+
+def schedule_representation(format: Optional[str], accept: Optional[str]) -> Optional[str]:
+    """"compact", "msgpack" or None (regular JSON), from ?format= or the Accept header; see compact.py"""
+    try:
+        representation = negotiate(format, accept)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if representation == "msgpack" and not msgpack_available():
+        raise HTTPException(status_code=406, detail="MessagePack is not available on this server")
+    return representation
+
+def schedules_response(content: dict, representation: Optional[str], headers: Optional[dict] = None) -> Response:
+    """Response in the negotiated representation; schedules in content must already be compact for it"""
+    headers = {**(headers or {}), "Vary": "Accept"}
+    if representation == "compact":
+        return Response(dumps(content), media_type=COMPACT_JSON, headers=headers)
+    if representation == "msgpack":
+        return Response(encode_msgpack(content), media_type=COMPACT_MSGPACK, headers=headers)
+    # Returned as a response so the month skips jsonable_encoder
+    return FastJSONResponse(content, headers=headers)
 
 @app.get("/api/schedules/{store_id}/{year}/{month}")
-async def get_schedule(store_id: str, year: int, month: int, current_user: dict = Depends(get_current_user)):
+async def get_schedule(
+    store_id: str,
+    year: int,
+    month: int,
+    format: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
     # Check access permissions
     if current_user["role"] != UserRole.MANAGER:
         user_store_ids = current_user.get("store_ids", [])
         if store_id not in user_store_ids:
             raise HTTPException(status_code=403, detail="Access denied to this store")
     
-    schedule = schedules_collection.find_one({
-        "store_id": store_id,
-        "year": year, 
-        "month": month
-    })
+    representation = schedule_representation(format, accept)
+    schedule_filter = {"store_id": store_id, "year": year, "month": month}
+    if if_none_match:
+        # Only the version is read to answer a conditional request
+        current = await schedules_collection.find_one(
+            schedule_filter, {"_id": 0, "store_id": 1, "year": 1, "month": 1, "version": 1}
+        )
+        if current is not None and etag_matches(if_none_match, schedule_etag(current, representation)):
+            return not_modified(schedule_etag(current, representation))
+    
+    schedule = await schedules_collection.find_one(schedule_filter, {"_id": 0, "employee_shifts": 0})
     if not schedule:
-        return {"schedule": None}
+        return schedules_response({"schedule": None}, representation)
     
-    schedule.pop("_id", None)
-    return {"schedule": schedule}
+    etag = schedule_etag(schedule, representation)
+    if representation:
+        schedule = compact_schedule(schedule)
+    return schedules_response({"schedule": schedule}, representation, headers={"ETag": etag})
+
+# Fields a client may request from GET /api/schedules; the keyset fields are always returned
+SCHEDULE_LIST_FIELDS = {"id", "store_id", "year", "month", "days", "created_by", "updated_at"}
+SCHEDULE_KEYSET = [("store_id", 1), ("year", 1), ("month", 1)]
+SCHEDULE_PAGE_SIZE = 100
+SCHEDULE_MAX_PAGE_SIZE = 500
+
+def encode_schedule_cursor(schedule: dict) -> str:
+    key = [schedule["store_id"], schedule["year"], schedule["month"]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+def schedule_cursor_filter(cursor: str) -> dict:
+    """Filter for schedules strictly after the cursor in (store_id, year, month) order"""
+    try:
+        store_id, year, month = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"$or": [
+        {"store_id": {"$gt": store_id}},
+        {"store_id": store_id, "year": {"$gt": year}},
+        {"store_id": store_id, "year": year, "month": {"$gt": month}},
+    ]}
 
 @app.get("/api/schedules")
-async def get_all_schedules(current_user: dict = Depends(get_current_user)):
-    if current_user["role"] == UserRole.MANAGER:
-        # Managers can see all schedules
-        schedules = list(schedules_collection.find({}, {"_id": 0}))
-    else:
+async def get_all_schedules(
+    store_id: Optional[str] = None,
+    year: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=SCHEDULE_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    format: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """List schedules page by page, or stream them as NDJSON with format=ndjson.
+    
+    format=compact / format=msgpack (or the matching Accept) return the pages in
+    the columnar form of compact.py.
+    """
+    conditions = []
+    if current_user["role"] != UserRole.MANAGER:
         # Employees see only schedules from their assigned stores
         user_store_ids = current_user.get("store_ids", [])
-        if user_store_ids:
-            schedules = list(schedules_collection.find({
-                "store_id": {"$in": user_store_ids}
-            }, {"_id": 0}))
-        else:
-            schedules = []
+        if store_id is not None and store_id not in user_store_ids:
+            raise HTTPException(status_code=403, detail="Access denied to this store")
+        conditions.append({"store_id": {"$in": user_store_ids}})
+    if store_id is not None:
+        conditions.append({"store_id": store_id})
+    if year is not None:
+        conditions.append({"year": year})
+    if cursor:
+        conditions.append(schedule_cursor_filter(cursor))
+    query = {"$and": conditions} if conditions else {}
+    
+    if fields:
+        requested = {field.strip() for field in fields.split(",") if field.strip()}
+        unknown = requested - SCHEDULE_LIST_FIELDS
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+        projection = {field: 1 for field in requested | {"store_id", "year", "month"}}
+        projection["_id"] = 0
+    else:
+        projection = {"_id": 0, "employee_shifts": 0}
     
-    return {"schedules": schedules}
+    if format == "ndjson":
+        schedules = schedules_collection.find(query, projection).sort(SCHEDULE_KEYSET)
+        if limit:
+            schedules = schedules.limit(limit)
+        
+        async def stream():
+            # One document at a time, so memory does not grow with the result size
+            async for schedule in schedules:
+                yield dumps(schedule) + b"\n"
+        
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+    
+    representation = schedule_representation(format, accept)
+    page_size = limit or SCHEDULE_PAGE_SIZE
+    schedules = await schedules_collection.find(query, projection).sort(SCHEDULE_KEYSET).limit(page_size).to_list(None)
+    next_cursor = encode_schedule_cursor(schedules[-1]) if len(schedules) == page_size else None
+    if representation:
+        schedules = [compact_schedule(schedule) for schedule in schedules]
+    
+    return schedules_response({"schedules": schedules, "next_cursor": next_cursor}, representation)
+
+@app.get("/api/schedule-conflicts/{year}/{month}")
+async def get_schedule_conflicts(
+    year: int,
+    month: int,
+    store_id: Optional[str] = None,
+    current_user: dict = Depends(require_manager)
+):
+    """Отчёт о конфликтах графика за месяц по всем магазинам или с участием одного"""
+    conflicts = await month_conflicts(year, month)
+    if store_id is not None:
+        conflicts = [c for c in conflicts if store_id in c["store_ids"]]
+    
+    counts = {}
+    for conflict in conflicts:
+        counts[conflict["type"]] = counts.get(conflict["type"], 0) + 1
+    return {"year": year, "month": month, "counts": counts, "conflicts": conflicts}
 
 @app.get("/api/my-shifts/{store_id}/{year}/{month}")
 async def get_my_shifts(store_id: str, year: int, month: int, current_user: dict = Depends(get_current_user)):
-    # Установить ставки по умолчанию для просроченных смен
-    set_default_earnings_if_needed()
-    
     # Check access permissions
     if current_user["role"] != UserRole.MANAGER:
         user_store_ids = current_user.get("store_ids", [])
         if store_id not in user_store_ids:
             raise HTTPException(status_code=403, detail="Access denied to this store")
     
-    schedule = schedules_collection.find_one({
+    schedule = await schedules_collection.find_one({
         "store_id": store_id,
         "year": year, 
         "month": month
@@ -475,86 +1625,48 @@ async def get_my_shifts(store_id: str, year: int, month: int, current_user: dict
     my_shifts = []
     stats = {"total_shifts": 0, "day_shifts": 0, "night_shifts": 0, "total_hours": 0, "total_earnings": 0}
     
-    for day_schedule in schedule.get("days", []):
-        date = day_schedule["date"]
+    for date, shift_type, shift, assignment_index, assignment in employee_assignments(schedule, current_user["id"]):
+        earnings = assignment.get("earnings", None)
+        can_edit = assignment.get("can_edit_earnings", True)
+        if can_edit and earnings is None:
+            can_edit = can_edit_earnings(date, current_user)
         
-        # Check day shift
-        if day_schedule.get("day_shift"):
-            day_shift = day_schedule["day_shift"]
-            for assignment in day_shift.get("assignments", []):
-                if assignment["employee_id"] == current_user["id"]:
-                    earnings = assignment.get("earnings", None)
-                    can_edit = assignment.get("can_edit_earnings", True)
-                    if can_edit and earnings is None:
-                        can_edit = can_edit_earnings(date, current_user)
-                    
-                    my_shifts.append({
-                        "date": date,
-                        "type": "day",
-                        "shift_data": day_shift,
-                        "earnings": earnings,
-                        "can_edit_earnings": can_edit,
-                        "assignment_index": day_shift["assignments"].index(assignment)
-                    })
-                    stats["total_shifts"] += 1
-                    stats["day_shifts"] += 1
-                    hours = day_shift.get("hours", 12)
-                    stats["total_hours"] += hours
-                    if earnings:
-                        stats["total_earnings"] += earnings
-                    break
-        
-        # Check night shift
-        if day_schedule.get("night_shift"):
-            night_shift = day_schedule["night_shift"]
-            for assignment in night_shift.get("assignments", []):
-                if assignment["employee_id"] == current_user["id"]:
-                    earnings = assignment.get("earnings", None)
-                    can_edit = assignment.get("can_edit_earnings", True)
-                    if can_edit and earnings is None:
-                        can_edit = can_edit_earnings(date, current_user)
-                    
-                    my_shifts.append({
-                        "date": date,
-                        "type": "night",
-                        "shift_data": night_shift,
-                        "earnings": earnings,
-                        "can_edit_earnings": can_edit,
-                        "assignment_index": night_shift["assignments"].index(assignment)
-                    })
-                    stats["total_shifts"] += 1
-                    stats["night_shifts"] += 1
-                    hours = night_shift.get("hours", 12)
-                    stats["total_hours"] += hours
-                    if earnings:
-                        stats["total_earnings"] += earnings
-                    break
-        
-        # Check custom shifts
-        for custom_shift in day_schedule.get("custom_shifts", []):
-            for assignment in custom_shift.get("assignments", []):
-                if assignment["employee_id"] == current_user["id"]:
-                    earnings = assignment.get("earnings", None)
-                    can_edit = assignment.get("can_edit_earnings", True)
-                    if can_edit and earnings is None:
-                        can_edit = can_edit_earnings(date, current_user)
-                    
-                    my_shifts.append({
-                        "date": date,
-                        "type": "custom",
-                        "shift_data": custom_shift,
-                        "earnings": earnings,
-                        "can_edit_earnings": can_edit,
-                        "assignment_index": custom_shift["assignments"].index(assignment)
-                    })
-                    stats["total_shifts"] += 1
-                    hours = custom_shift.get("hours", 8)
-                    stats["total_hours"] += hours
-                    if earnings:
-                        stats["total_earnings"] += earnings
-                    break
-    
-    return {"shifts": my_shifts, "stats": stats}
+        my_shifts.append({
+            "date": date,
+            "type": shift_type,
+            "shift_data": shift,
+            "earnings": earnings,
+            "can_edit_earnings": can_edit,
+            "assignment_index": assignment_index
+        })
+        stats["total_shifts"] += 1
+        if shift_type == "day":
+            stats["day_shifts"] += 1
+        elif shift_type == "night":
+            stats["night_shifts"] += 1
+        stats["total_hours"] += shift_hours(shift, shift_type)
+        if earnings:
+            stats["total_earnings"] += earnings
+    
+    return FastJSONResponse({"shifts": my_shifts, "stats": stats})
+
+# Путь к назначениям смены внутри дня
+SHIFT_ASSIGNMENT_PATHS = {
+    "day": "day_shift.assignments",
+    "night": "night_shift.assignments",
+    "custom": "custom_shifts.assignments",
+}
+
+def find_custom_shift_index(day: dict, employee_id: Optional[str], assignment_index: int) -> Optional[int]:
+    """Первая дополнительная смена дня с этим сотрудником (или с назначением под assignment_index)"""
+    for i, shift in enumerate(day.get("custom_shifts") or []):
+        assignments = (shift or {}).get("assignments", [])
+        if employee_id is None:
+            if len(assignments) > assignment_index:
+                return i
+        elif any(assignment["employee_id"] == employee_id for assignment in assignments):
+            return i
+    return None
 
 @app.put("/api/shift-earnings/{store_id}/{year}/{month}/{date}/{shift_type}")
 async def update_shift_earnings(
@@ -565,9 +1677,15 @@ async def update_shift_earnings(
     shift_type: str,
     earnings_data: EarningsUpdate,
     assignment_index: int = 0,
+    employee_id: Optional[str] = None,
+    custom_shift_index: Optional[int] = None,
     current_user: dict = Depends(get_current_user)
 ):
-    """Обновить ставку за смену"""
+    """Обновить ставку за смену.
+    
+    Для дополнительных смен обновляется одна смена: custom_shift_index, а без
+    него первая смена дня с этим сотрудником (как и раньше).
+    """
     # Проверить доступ
     if current_user["role"] != UserRole.MANAGER:
         user_store_ids = current_user.get("store_ids", [])
@@ -581,73 +1699,73 @@ async def update_shift_earnings(
                 message="Время редактирования ставки истекло. Обратитесь к менеджеру.",
                 can_edit=False
             )
+        # Сотрудник может менять только свою ставку
+        employee_id = current_user["id"]
     
-    # Найти расписание
-    schedule = schedules_collection.find_one({
-        "store_id": store_id,
-        "year": year,
-        "month": month
-    })
+    schedule_filter = {"store_id": store_id, "year": year, "month": month}
+    assignments_path = SHIFT_ASSIGNMENT_PATHS.get(shift_type)
     
-    if not schedule:
-        raise HTTPException(status_code=404, detail="Schedule not found")
+    # Менеджер может указать назначение по индексу, а для дополнительной смены нужен её номер:
+    # определить их по одному дню расписания
+    needs_custom_index = shift_type == "custom" and custom_shift_index is None
+    if assignments_path and (employee_id is None or needs_custom_index):
+        schedule = await schedules_collection.find_one(
+            schedule_filter, {"_id": 0, "days": {"$elemMatch": {"date": date}}}
+        )
+        for day_schedule in (schedule or {}).get("days", []):
+            if shift_type == "custom":
+                if custom_shift_index is None:
+                    custom_shift_index = find_custom_shift_index(day_schedule, employee_id, assignment_index)
+                custom_shifts = day_schedule.get("custom_shifts") or []
+                in_range = custom_shift_index is not None and 0 <= custom_shift_index < len(custom_shifts)
+                shift = custom_shifts[custom_shift_index] if in_range else None
+            else:
+                shift = day_schedule.get(f"{shift_type}_shift")
+            if employee_id is None and shift and len(shift.get("assignments", [])) > assignment_index:
+                employee_id = shift["assignments"][assignment_index]["employee_id"]
+    
+    if shift_type == "custom":
+        # Только одна дополнительная смена: её номер в пути, а не $[] по всем сменам дня
+        assignments_path = None if custom_shift_index is None or custom_shift_index < 0 \
+            else f"custom_shifts.{custom_shift_index}.assignments"
     
-    # Найти день и смену
-    day_found = False
-    shift_found = False
-    
-    for day_schedule in schedule.get("days", []):
-        if day_schedule["date"] == date:
-            day_found = True
-            
-            # Определить тип смены и обновить
-            if shift_type == "day" and day_schedule.get("day_shift"):
-                shift = day_schedule["day_shift"]
-                if len(shift["assignments"]) > assignment_index:
-                    assignment = shift["assignments"][assignment_index]
-                    if assignment["employee_id"] == current_user["id"] or current_user["role"] == UserRole.MANAGER:
-                        assignment["earnings"] = earnings_data.earnings
-                        assignment["earnings_set_at"] = datetime.now()
-                        assignment["earnings_set_by"] = current_user["id"]
-                        assignment["can_edit_earnings"] = can_edit_earnings(date, current_user)
-                        shift_found = True
-                        
-            elif shift_type == "night" and day_schedule.get("night_shift"):
-                shift = day_schedule["night_shift"]
-                if len(shift["assignments"]) > assignment_index:
-                    assignment = shift["assignments"][assignment_index]
-                    if assignment["employee_id"] == current_user["id"] or current_user["role"] == UserRole.MANAGER:
-                        assignment["earnings"] = earnings_data.earnings
-                        assignment["earnings_set_at"] = datetime.now()
-                        assignment["earnings_set_by"] = current_user["id"]
-                        assignment["can_edit_earnings"] = can_edit_earnings(date, current_user)
-                        shift_found = True
-                        
-            elif shift_type == "custom":
-                custom_shifts = day_schedule.get("custom_shifts", [])
-                for custom_shift in custom_shifts:
-                    if len(custom_shift["assignments"]) > assignment_index:
-                        assignment = custom_shift["assignments"][assignment_index]
-                        if assignment["employee_id"] == current_user["id"] or current_user["role"] == UserRole.MANAGER:
-                            assignment["earnings"] = earnings_data.earnings
-                            assignment["earnings_set_at"] = datetime.now()
-                            assignment["earnings_set_by"] = current_user["id"]
-                            assignment["can_edit_earnings"] = can_edit_earnings(date, current_user)
-                            shift_found = True
-                            break
-            break
-    
-    if not day_found:
-        raise HTTPException(status_code=404, detail="Date not found in schedule")
-    
-    if not shift_found:
+    before = None
+    if assignments_path and employee_id is not None:
+        # Одна точечная запись: затрагивается только назначение этого сотрудника в этот день
+        target = f"days.$[d].{assignments_path}.$[a]"
+        now = datetime.now()
+        # Возвращается день до изменения, чтобы обновить итоги месяца на разницу ставок
+        before = await schedules_collection.find_one_and_update(
+            {**schedule_filter, "days": {"$elemMatch": {
+                "date": date,
+                f"{assignments_path}.employee_id": employee_id,
+            }}},
+            {"$set": {
+                f"{target}.earnings": earnings_data.earnings,
+                f"{target}.earnings_set_at": now,
+                f"{target}.earnings_set_by": current_user["id"],
+                f"{target}.can_edit_earnings": can_edit_earnings(date, current_user),
+                "updated_at": now,
+            }, "$inc": {"version": 1}},
+            array_filters=[
+                {"d.date": date, f"d.{assignments_path}.employee_id": employee_id},
+                {"a.employee_id": employee_id},
+            ],
+            projection={"_id": 0, "store_id": 1, "year": 1, "month": 1, "days": {"$elemMatch": {"date": date}}},
+        )
+    
+    if before is None:
+        # Определить причину только на пути ошибки
+        schedule = await schedules_collection.find_one(
+            schedule_filter, {"_id": 1, "days": {"$elemMatch": {"date": date}}}
+        )
+        if not schedule:
+            raise HTTPException(status_code=404, detail="Schedule not found")
+        if not schedule.get("days"):
+            raise HTTPException(status_code=404, detail="Date not found in schedule")
         raise HTTPException(status_code=404, detail="Shift assignment not found")
     
-    # Обновить расписание в базе данных
-    schedules_collection.update_one(
-        {"id": schedule["id"]},
-        {"$set": {"days": schedule["days"], "updated_at": datetime.now()}}
-    )
+    await apply_rollup_earnings_change(before, shift_type, employee_id, earnings_data.earnings, custom_shift_index)
     
     can_edit = can_edit_earnings(date, current_user)
     return EarningsResponse(
@@ -665,70 +1783,159 @@ async def get_earnings_history(store_id: str, current_user: dict = Depends(get_c
         if store_id not in user_store_ids:
             raise HTTPException(status_code=403, detail="Access denied to this store")
     
-    # Получить все расписания для данного магазина
-    schedules = schedules_collection.find({"store_id": store_id})
+    # Итоги по месяцам поддерживаются в earnings_rollups; новые месяцы первыми
+    rollups = await earnings_rollups_collection.find(
+        {"store_id": store_id, "employee_id": current_user["id"], "paid_shifts": {"$gt": 0}},
+        {"_id": 0, "year": 1, "month": 1, "total_earnings": 1, "paid_shifts": 1}
+    ).sort([("year", -1), ("month", -1)]).to_list(None)
     
-    history = []
-    
-    for schedule in schedules:
-        month_earnings = 0
-        month_shifts = 0
-        
-        for day_schedule in schedule.get("days", []):
-            # Проверить все смены
-            for shift_type in ["day_shift", "night_shift"]:
-                shift = day_schedule.get(shift_type)
-                if shift:
-                    for assignment in shift.get("assignments", []):
-                        if assignment["employee_id"] == current_user["id"]:
-                            earnings = assignment.get("earnings", 0)
-                            if earnings:
-                                month_earnings += earnings
-                                month_shifts += 1
-            
-            # Проверить custom_shifts
-            for custom_shift in day_schedule.get("custom_shifts", []):
-                for assignment in custom_shift.get("assignments", []):
-                    if assignment["employee_id"] == current_user["id"]:
-                        earnings = assignment.get("earnings", 0)
-                        if earnings:
-                            month_earnings += earnings
-                            month_shifts += 1
-        
-        if month_shifts > 0:
-            history.append({
-                "year": schedule["year"],
-                "month": schedule["month"],
-                "total_earnings": month_earnings,
-                "total_shifts": month_shifts,
-                "average_per_shift": round(month_earnings / month_shifts, 2) if month_shifts > 0 else 0
-            })
-    
-    # Сортировать по дате (новые сначала)
-    history.sort(key=lambda x: (x["year"], x["month"]), reverse=True)
+    history = [{
+        "year": rollup["year"],
+        "month": rollup["month"],
+        "total_earnings": rollup["total_earnings"],
+        "total_shifts": rollup["paid_shifts"],
+        "average_per_shift": round(rollup["total_earnings"] / rollup["paid_shifts"], 2)
+    } for rollup in rollups]
     
     return {"history": history}
 
+def month_range(date_from: str, date_to: str) -> List[dict]:
+    """{year, month} for every month touched by the date range"""
+    start, end = datetime.strptime(date_from, "%Y-%m-%d"), datetime.strptime(date_to, "%Y-%m-%d")
+    months = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        months.append({"year": year, "month": month})
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+@app.get("/api/analytics/coverage")
+async def get_coverage(
+    year: int,
+    month: Optional[int] = Query(None, ge=1, le=12),
+    quarter: Optional[int] = Query(None, ge=1, le=4),
+    store_id: Optional[List[str]] = Query(None),
+    current_user: dict = Depends(require_manager)
+):
+    """Число назначенных сотрудников по магазинам, дням и типам смен за месяц или квартал"""
+    if (month is None) == (quarter is None):
+        raise HTTPException(status_code=400, detail="Give either month or quarter")
+    months = [(year, month)] if month else [(year, m) for m in range(quarter * 3 - 2, quarter * 3 + 1)]
+    
+    store_query = {"is_active": True}
+    if store_id:
+        store_query["id"] = {"$in": store_id}
+    stores = await stores_collection.find(store_query, {"_id": 0, "id": 1, "name": 1}).sort("name", 1).to_list(None)
+    
+    key = (tuple(months), tuple(store["id"] for store in stores))
+    report = coverage_cache.get(key)
+    if report is None:
+        # Only the index of each schedule is read: one entry per employee per shift
+        schedules = await schedules_collection.find(
+            {"store_id": {"$in": list(key[1])}, "$or": [{"year": y, "month": m} for y, m in months]},
+            {"_id": 0, "store_id": 1, "year": 1, "month": 1, "employee_shifts.date": 1, "employee_shifts.type": 1}
+        ).to_list(None)
+        # Расписания, сохранённые до появления индекса: их days читаются одним запросом
+        legacy = {(s["store_id"], s["year"], s["month"]): s for s in schedules if "employee_shifts" not in s}
+        if legacy:
+            async for schedule in schedules_collection.find(
+                {"$or": [{"store_id": store_id, "year": y, "month": m} for store_id, y, m in legacy]},
+                {"_id": 0, "store_id": 1, "year": 1, "month": 1, "days": 1}
+            ):
+                legacy[(schedule["store_id"], schedule["year"], schedule["month"])]["employee_shifts"] = \
+                    build_employee_shift_index(schedule.get("days", []))
+            for schedule in legacy.values():
+                schedule.setdefault("employee_shifts", [])
+        report = coverage_report(stores, months, schedules)
+        coverage_cache.set(key, report)
+    return report
+
+@app.get("/api/payroll")
+async def export_payroll(
+    date_from: str,
+    date_to: str,
+    store_id: Optional[List[str]] = Query(None),
+    format: str = "csv",
+    current_user: dict = Depends(require_manager)
+):
+    """Смены, часы и заработок каждого сотрудника по магазинам за период (CSV или XLSX)"""
+    try:
+        months = month_range(date_from, date_to)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be in YYYY-MM-DD format")
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from is after date_to")
+    if format not in ("csv", "xlsx"):
+        raise HTTPException(status_code=400, detail="format must be csv or xlsx")
+    if format == "xlsx" and not xlsx_available():
+        raise HTTPException(status_code=400, detail="XLSX export is not available on this server")
+    
+    store_query = {"is_active": True}
+    if store_id:
+        store_query["id"] = {"$in": store_id}
+    stores = await stores_collection.find(store_query, {"_id": 0, "id": 1, "name": 1}).sort("name", 1).to_list(None)
+    if store_id and len(stores) < len(set(store_id)):
+        missing = set(store_id) - {store["id"] for store in stores}
+        raise HTTPException(status_code=404, detail=f"Store not found: {', '.join(sorted(missing))}")
+    
+    async def store_frames():
+        # Один магазин за раз: его расписания за период сворачиваются в строки сотрудников
+        for store in stores:
+            rows = []
+            async for schedule in schedules_collection.find(
+                {"store_id": store["id"], "$or": months}, {"_id": 0, "days": 1, "employee_shifts": 1}
+            ):
+                for date, shift_type, shift, _, assignment in employee_assignments(schedule):
+                    rows.append((assignment["employee_id"], assignment.get("employee_name"), date,
+                                 shift_type, shift.get("hours"), assignment.get("earnings")))
+            yield store_payroll(store["id"], store["name"], rows, date_from, date_to)
+    
+    filename = f"payroll_{date_from}_{date_to}.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if format == "xlsx":
+        return StreamingResponse(
+            stream_xlsx(store_frames()),
+            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers=headers
+        )
+    return StreamingResponse(stream_csv(store_frames()), media_type="text/csv", headers=headers)
+
+@app.on_event("startup")
+async def apply_indexes():
+    await ensure_indexes(db)
+    if INDEX_SELF_CHECK:
+        failures = await verify_query_plans(db)
+        if failures:
+            raise RuntimeError("Query plan self-check failed:\n" + "\n".join(failures))
+        print("Query plan self-check passed")
+
+@app.on_event("startup")
+async def ensure_earnings_rollups():
+    # Первый запуск с итогами: заполнить коллекцию из существующих расписаний
+    if not await earnings_rollups_collection.find_one({}) and await schedules_collection.find_one({}):
+        count = await rebuild_earnings_rollups()
+        print(f"Earnings rollups built for {count} schedules")
+
 # Initialize default manager account
 @app.on_event("startup")
 async def create_default_manager():
-    existing_manager = users_collection.find_one({"role": "manager"})
+    existing_manager = await users_collection.find_one({"role": "manager"})
     if not existing_manager:
         manager_id = str(uuid.uuid4())
         default_manager = {
             "id": manager_id,
             "email": "manager@company.com",
             "name": "Default Manager",
-            "password": hash_password("manager123"),
+            "password": await hash_password("manager123"),
             "role": "manager",
             "store_ids": [],  # Empty means access to all stores
             "created_at": datetime.now()
         }
-        users_collection.insert_one(default_manager)
+        await users_collection.insert_one(default_manager)
         print("Default manager created: manager@company.com / manager123")
     
     # Create default store if none exists
-    existing_store = stores_collection.find_one({"is_active": True})
+    existing_store = await stores_collection.find_one({"is_active": True})
     if not existing_store:
         store_id = str(uuid.uuid4())
         default_store = {
@@ -736,11 +1943,26 @@ async def create_default_manager():
             "name": "Основная точка продаж",
             "address": "ул. Примерная, 1",
             "created_at": datetime.now(),
-            "is_active": True
+            "is_active": True,
+            "version": 1
         }
-        stores_collection.insert_one(default_store)
+        await stores_collection.insert_one(default_store)
         print(f"Default store created: {default_store['name']}")
 
+@app.on_event("startup")
+async def start_earnings_backfill():
+    app.state.earnings_backfill_task = asyncio.create_task(earnings_backfill_loop())
+
+@app.on_event("shutdown")
+async def stop_password_pool():
+    password_hasher.shutdown()
+
+@app.on_event("shutdown")
+async def stop_earnings_backfill():
+    task = getattr(app.state, "earnings_backfill_task", None)
+    if task:
+        task.cancel()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
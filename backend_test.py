@@ -7,6 +7,7 @@ Tests all API endpoints including extended stores functionality
 import requests
 import sys
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional
 
@@ -21,6 +22,7 @@ class ShiftScheduleAPITester:
         self.default_store_id = None
         self.tests_run = 0
         self.tests_passed = 0
+        self.tests_skipped = 0
         self.session = requests.Session()
         
     def log_test(self, name: str, success: bool, details: str = ""):
@@ -33,6 +35,12 @@ class ShiftScheduleAPITester:
             print(f"❌ {name}: FAILED {details}")
         return success
 
+    def log_skip(self, name: str, details: str = ""):
+        """Log a test that could not run against this server; counted neither as passed nor as failed"""
+        self.tests_skipped += 1
+        print(f"⏭️  {name}: SKIPPED {details}")
+        return True
+
     def api_call(self, method: str, endpoint: str, data: Optional[Dict] = None, 
                  token: Optional[str] = None, expected_status: int = 200) -> tuple[bool, Dict]:
         """Make API call and return success status and response data"""
@@ -49,6 +57,8 @@ class ShiftScheduleAPITester:
                 response = self.session.post(url, json=data, headers=headers)
             elif method == 'PUT':
                 response = self.session.put(url, json=data, headers=headers)
+            elif method == 'PATCH':
+                response = self.session.patch(url, json=data, headers=headers)
             elif method == 'DELETE':
                 response = self.session.delete(url, headers=headers)
             else:
@@ -72,6 +82,22 @@ class ShiftScheduleAPITester:
         return self.log_test("Health Check", success, 
                            f"- Status: {data.get('status', 'unknown')}")
 
+    def test_metrics_endpoint(self) -> bool:
+        """Test that request metrics are exposed per route template, to managers only"""
+        if not self.manager_token:
+            return self.log_test("Metrics Endpoint", False, "- No manager token available")
+        try:
+            anonymous = self.session.get(f"{self.base_url}/api/metrics")
+            response = self.session.get(f"{self.base_url}/api/metrics",
+                                        headers={"Authorization": f"Bearer {self.manager_token}"})
+            success = (anonymous.status_code in (401, 403) and response.status_code == 200 
+                       and 'http_requests_total{method="GET",route="/api/health",status="200"}' in response.text)
+            return self.log_test("Metrics Endpoint", success, 
+                               f"- Anonymous: {anonymous.status_code}, Status: {response.status_code}, "
+                               f"{len(response.text.splitlines())} lines")
+        except Exception as e:
+            return self.log_test("Metrics Endpoint", False, f"- Error: {str(e)}")
+
     def test_manager_login(self) -> bool:
         """Test manager login with default credentials"""
         login_data = {
@@ -141,6 +167,39 @@ class ShiftScheduleAPITester:
             return self.log_test("Create Employee", False, 
                                f"- Error: {data.get('detail', data)}")
 
+    def test_register_users_batch(self) -> bool:
+        """Test batch registration with a duplicate and an existing email in the batch"""
+        if not self.manager_token or not self.default_store_id or not self.created_employee_email:
+            return self.log_test("Register Users Batch", False, "- Missing manager token, store ID or employee email")
+            
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        users = [
+            {
+                "email": f"batch_employee_{stamp}_{i}@company.com",
+                "name": f"Batch Employee {i}",
+                "password": "employee123",
+                "store_ids": [self.default_store_id]
+            }
+            for i in range(3)
+        ]
+        users.append(dict(users[0]))
+        users.append({"email": self.created_employee_email, "name": "Existing", "password": "employee123"})
+        
+        success, data = self.api_call('POST', '/auth/register/batch', {"users": users}, 
+                                    token=self.manager_token, expected_status=200)
+        if not success:
+            return self.log_test("Register Users Batch", False, f"- Error: {data.get('detail', data)}")
+        
+        # Remove the users created by this test
+        for result in data['results']:
+            if result['status'] == 'created':
+                self.api_call('DELETE', f"/users/{result['user']['id']}", token=self.manager_token)
+        
+        statuses = [result['status'] for result in data['results']]
+        success = statuses == ['created', 'created', 'created', 'failed', 'failed']
+        return self.log_test("Register Users Batch", success, 
+                           f"- Created: {data['created']}, failed: {data['failed']}")
+
     def test_employee_login(self) -> bool:
         """Test login with created employee"""
         if not self.created_employee_email:
@@ -323,7 +382,11 @@ class ShiftScheduleAPITester:
         current_date = datetime.now()
         # Create schedule with today's date and tomorrow's date for testing
         today = current_date.strftime("%Y-%m-%d")
-        tomorrow = (current_date + timedelta(days=1)).strftime("%Y-%m-%d")
+        tomorrow = current_date + timedelta(days=1)
+        if tomorrow.month != current_date.month:
+            # Dates must stay inside the schedule month; use yesterday on the last day
+            tomorrow = current_date - timedelta(days=1)
+        tomorrow = tomorrow.strftime("%Y-%m-%d")
         
         schedule_data = {
             "store_id": self.default_store_id,
@@ -425,6 +488,167 @@ class ShiftScheduleAPITester:
             return self.log_test("Get Store Schedule", False, 
                                f"- Error: {data.get('detail', 'Unknown error')}")
 
+    def test_patch_schedule(self) -> bool:
+        """Test applying a batch of schedule operations and rejecting a stale version"""
+        if not self.manager_token or not self.default_store_id:
+            return self.log_test("Patch Store Schedule", False, "- Missing token or store ID")
+            
+        current_date = datetime.now()
+        endpoint = f'/schedules/{self.default_store_id}/{current_date.year}/{current_date.month}'
+        success, data = self.api_call('GET', endpoint, token=self.manager_token)
+        if not success or not data.get('schedule'):
+            return self.log_test("Patch Store Schedule", False, f"- Error: {data.get('detail', data)}")
+        version = data['schedule'].get('version', 0)
+        
+        patch_data = {
+            "expected_version": version,
+            "operations": [
+                {
+                    "op": "set_notes",
+                    "date": current_date.strftime("%Y-%m-%d"),
+                    "shift_type": "day",
+                    "notes": "Patched day shift"
+                }
+            ]
+        }
+        success, data = self.api_call('PATCH', endpoint, patch_data, token=self.manager_token)
+        if not success or data.get('version') != version + 1:
+            return self.log_test("Patch Store Schedule", False, f"- Error: {data.get('detail', data)}")
+        
+        # The same batch against the old version must be rejected
+        success, data = self.api_call('PATCH', endpoint, patch_data, 
+                                    token=self.manager_token, expected_status=409)
+        return self.log_test("Patch Store Schedule", success, 
+                           f"- Version {version} -> {version + 1}, stale batch rejected: {success}")
+
+    def test_import_schedules_csv(self) -> bool:
+        """Test bulk schedule import from a CSV roster"""
+        if not self.manager_token or not self.default_store_id or not self.created_employee_email:
+            return self.log_test("Import Schedules CSV", False, "- Missing token, store ID or employee email")
+            
+        rows = ["store_id,date,shift_type,employee_email,hours,notes,shift_index"]
+        for day in range(1, 29):
+            rows.append(f"{self.default_store_id},2099-02-{day:02d},day,{self.created_employee_email},12,,")
+            rows.append(f"{self.default_store_id},2099-02-{day:02d},custom,{self.created_employee_email},6,Import,0")
+        
+        try:
+            response = self.session.post(f"{self.base_url}/api/schedules/import",
+                                         files={"file": ("roster.csv", "\n".join(rows).encode(), "text/csv")},
+                                         headers={'Authorization': f'Bearer {self.manager_token}'})
+            data = response.json()
+            success = response.status_code == 200 and data.get('rows') == 56 and data.get('schedules') == 1
+            return self.log_test("Import Schedules CSV", success, 
+                               f"- Status: {response.status_code}, report: {data}")
+        except Exception as e:
+            return self.log_test("Import Schedules CSV", False, f"- Error: {str(e)}")
+
+    def test_schedule_conditional_get(self) -> bool:
+        """Test that an unchanged schedule is answered with 304 for its ETag"""
+        if not self.employee_token or not self.default_store_id:
+            return self.log_test("Schedule Conditional GET", False, "- Missing employee token or store ID")
+            
+        current_date = datetime.now()
+        url = f"{self.base_url}/api/schedules/{self.default_store_id}/{current_date.year}/{current_date.month}"
+        headers = {'Authorization': f'Bearer {self.employee_token}'}
+        
+        try:
+            first = self.session.get(url, headers=headers)
+            etag = first.headers.get('ETag')
+            if first.status_code != 200 or not etag:
+                return self.log_test("Schedule Conditional GET", False, 
+                                   f"- Status: {first.status_code}, ETag: {etag}")
+            
+            second = self.session.get(url, headers={**headers, 'If-None-Match': etag})
+            # Behind nginx with gzip the browser sends the weakened W/ form back
+            weak = self.session.get(url, headers={**headers, 'If-None-Match': f'W/{etag}'})
+            return self.log_test("Schedule Conditional GET", second.status_code == 304 and weak.status_code == 304, 
+                               f"- ETag: {etag}, revalidation status: {second.status_code}, "
+                               f"weak form: {weak.status_code}")
+        except Exception as e:
+            return self.log_test("Schedule Conditional GET", False, f"- Error: {str(e)}")
+
+    def test_schedule_compact_format(self) -> bool:
+        """Test the compact columnar representation of a schedule"""
+        if not self.employee_token or not self.default_store_id:
+            return self.log_test("Schedule Compact Format", False, "- Missing employee token or store ID")
+            
+        current_date = datetime.now()
+        url = f"{self.base_url}/api/schedules/{self.default_store_id}/{current_date.year}/{current_date.month}"
+        headers = {'Authorization': f'Bearer {self.employee_token}'}
+        
+        try:
+            regular = self.session.get(url, headers=headers)
+            compact = self.session.get(url, headers={**headers, 'Accept': 'application/vnd.schedule.compact+json'})
+            schedule = compact.json().get('schedule') or {}
+            regular_assignments = sum(
+                len(shift.get('assignments', []))
+                for day in regular.json()['schedule']['days']
+                for shift in [day.get('day_shift'), day.get('night_shift')] + day.get('custom_shifts', []) if shift
+            )
+            success = (compact.status_code == 200 
+                       and compact.headers.get('Content-Type', '').startswith('application/vnd.schedule.compact+json')
+                       and schedule.get('format') == 'compact/1'
+                       and len(schedule['assignments']['employee']) == regular_assignments
+                       and compact.headers.get('ETag') != regular.headers.get('ETag'))
+            return self.log_test("Schedule Compact Format", success, 
+                               f"- {len(regular.content)} bytes regular, {len(compact.content)} bytes compact")
+        except Exception as e:
+            return self.log_test("Schedule Compact Format", False, f"- Error: {str(e)}")
+
+    def test_schedule_conflicts_report(self) -> bool:
+        """Test the month conflict report for managers and its denial for employees"""
+        if not self.manager_token or not self.employee_token:
+            return self.log_test("Schedule Conflicts Report", False, "- Missing manager or employee token")
+            
+        current_date = datetime.now()
+        endpoint = f'/schedule-conflicts/{current_date.year}/{current_date.month}'
+        success, data = self.api_call('GET', endpoint, token=self.manager_token)
+        if not success or 'conflicts' not in data:
+            return self.log_test("Schedule Conflicts Report", False, f"- Error: {data.get('detail', data)}")
+        
+        denied, _ = self.api_call('GET', endpoint, token=self.employee_token, expected_status=403)
+        return self.log_test("Schedule Conflicts Report", denied, 
+                           f"- Conflicts: {data['counts']}, employee denied: {denied}")
+
+    def test_generate_schedule_preview(self) -> bool:
+        """Test generating a month for the default store without saving it"""
+        if not self.manager_token or not self.default_store_id:
+            return self.log_test("Generate Schedule Preview", False, "- Missing token or store ID")
+            
+        request_data = {
+            "store_ids": [self.default_store_id],
+            "year": 2099,
+            "month": 3,
+            "day_headcount": 1,
+            "night_headcount": 1,
+            "save": False,
+            "seed": 1
+        }
+        success, data = self.api_call('POST', '/schedules/generate', request_data, token=self.manager_token)
+        if success and len(data.get('schedules', [])) == 1:
+            days = data['schedules'][0]['days']
+            return self.log_test("Generate Schedule Preview", len(days) == 31, 
+                               f"- {len(days)} days, unfilled shifts: {len(data['unfilled'])}")
+        return self.log_test("Generate Schedule Preview", False, f"- Error: {data.get('detail', data)}")
+
+    def test_coverage_heatmap(self) -> bool:
+        """Test the store x day coverage matrix for the current month"""
+        if not self.manager_token or not self.default_store_id:
+            return self.log_test("Coverage Heatmap", False, "- Missing manager token or store ID")
+            
+        current_date = datetime.now()
+        success, data = self.api_call('GET', 
+                                    f'/analytics/coverage?year={current_date.year}&month={current_date.month}'
+                                    f'&store_id={self.default_store_id}', 
+                                    token=self.manager_token)
+        if not success or 'counts' not in data:
+            return self.log_test("Coverage Heatmap", False, f"- Error: {data.get('detail', data)}")
+        
+        today = data['dates'].index(current_date.strftime("%Y-%m-%d"))
+        day_count = data['counts']['day'][0][today]
+        return self.log_test("Coverage Heatmap", day_count >= 1, 
+                           f"- {len(data['stores'])} store(s) x {len(data['dates'])} days, day shift today: {day_count}")
+
     def test_get_my_shifts_for_store(self) -> bool:
         """Test getting employee's shifts for specific store"""
         if not self.employee_token or not self.default_store_id:
@@ -444,6 +668,28 @@ class ShiftScheduleAPITester:
             return self.log_test("Get My Store Shifts", False, 
                                f"- Error: {data.get('detail', 'Unknown error')}")
 
+    def test_my_shifts_query_budget(self) -> bool:
+        """Test that my-shifts issues a bounded number of MongoDB commands (QUERY_REPORT_HEADERS=1)"""
+        if not self.employee_token or not self.default_store_id:
+            return self.log_test("My Shifts Query Budget", False, "- Missing employee token or store ID")
+            
+        current_date = datetime.now()
+        try:
+            response = self.session.get(
+                f"{self.base_url}/api/my-shifts/{self.default_store_id}/{current_date.year}/{current_date.month}",
+                headers={'Authorization': f'Bearer {self.employee_token}'})
+            if response.status_code != 200:
+                return self.log_test("My Shifts Query Budget", False, f"- Status {response.status_code}")
+            if 'X-DB-Commands' not in response.headers:
+                return self.log_skip("My Shifts Query Budget", "- Server runs without QUERY_REPORT_HEADERS")
+            commands = int(response.headers['X-DB-Commands'])
+            repeats = int(response.headers['X-DB-Max-Repeats'])
+            success = commands <= 6 and repeats <= 2
+            return self.log_test("My Shifts Query Budget", success, 
+                               f"- {commands} commands, one shape at most {repeats} times")
+        except Exception as e:
+            return self.log_test("My Shifts Query Budget", False, f"- Error: {str(e)}")
+
     def test_employee_access_unassigned_store_shifts(self) -> bool:
         """Test employee accessing shifts for unassigned store (should fail)"""
         if not self.employee_token or not self.created_store_id:
@@ -658,6 +904,83 @@ class ShiftScheduleAPITester:
         return self.log_test("Update Earnings (Nonexistent)", success, 
                            f"- Correctly rejected: {data.get('detail', 'No error message')}")
 
+    def test_concurrent_earnings_updates(self, workers: int = 20) -> bool:
+        """Test that parallel earnings updates to the same month all survive"""
+        if not self.manager_token or not self.default_store_id:
+            return self.log_test("Concurrent Earnings Updates", False, "- Missing manager token or store ID")
+            
+        # Schedules only accept existing employees: register temporary ones
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        users = [
+            {
+                "email": f"concurrency_test_{stamp}_{i}@company.com",
+                "name": f"Concurrency Test {i}",
+                "password": "employee123",
+                "store_ids": [self.default_store_id]
+            }
+            for i in range(workers)
+        ]
+        success, data = self.api_call('POST', '/auth/register/batch', {"users": users}, token=self.manager_token)
+        if not success:
+            return self.log_test("Concurrent Earnings Updates", False, 
+                               f"- Error registering employees: {data.get('detail', data)}")
+        employee_ids = [result['user']['id'] for result in data['results'] if result['status'] == 'created']
+        
+        try:
+            if len(employee_ids) != workers:
+                return self.log_test("Concurrent Earnings Updates", False, 
+                                   f"- Only {len(employee_ids)}/{workers} employees registered")
+            return self._run_concurrent_earnings_updates(employee_ids)
+        finally:
+            # Remove the employees created by this test
+            for employee_id in employee_ids:
+                self.api_call('DELETE', f'/users/{employee_id}', token=self.manager_token)
+
+    def _run_concurrent_earnings_updates(self, employee_ids: list) -> bool:
+        workers = len(employee_ids)
+        # A dedicated far-future month so the other tests are not affected
+        year, month = 2099, 1
+        test_date = f"{year}-{month:02d}-10"
+        schedule_data = {
+            "store_id": self.default_store_id,
+            "month": month,
+            "year": year,
+            "days": [{
+                "date": test_date,
+                "day_shift": {
+                    "type": "day",
+                    "assignments": [{"employee_id": employee_id, "employee_name": f"Concurrency Test {i}"}
+                                    for i, employee_id in enumerate(employee_ids)],
+                    "hours": 12
+                }
+            }]
+        }
+        success, data = self.api_call('POST', '/schedules', schedule_data, token=self.manager_token)
+        if not success:
+            return self.log_test("Concurrent Earnings Updates", False, 
+                               f"- Error creating schedule: {data.get('detail', data)}")
+        
+        def update(index: int) -> bool:
+            ok, _ = self.api_call('PUT', 
+                                f'/shift-earnings/{self.default_store_id}/{year}/{month}/{test_date}/day'
+                                f'?employee_id={employee_ids[index]}',
+                                {"earnings": 1000.0 + index}, token=self.manager_token)
+            return ok
+        
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(update, range(workers)))
+        
+        success, data = self.api_call('GET', f'/schedules/{self.default_store_id}/{year}/{month}', 
+                                    token=self.manager_token)
+        if not success or not data.get('schedule'):
+            return self.log_test("Concurrent Earnings Updates", False, 
+                               f"- Error reading schedule: {data.get('detail', data)}")
+        
+        assignments = data['schedule']['days'][0]['day_shift']['assignments']
+        lost = [a['employee_id'] for i, a in enumerate(assignments) if a.get('earnings') != 1000.0 + i]
+        return self.log_test("Concurrent Earnings Updates", all(results) and not lost, 
+                           f"- {sum(results)}/{workers} updates accepted, lost updates: {len(lost)}")
+
     def test_employee_access_unassigned_store_earnings(self) -> bool:
         """Test employee trying to update earnings for unassigned store (should fail)"""
         if not self.employee_token or not self.created_store_id:
@@ -720,6 +1043,27 @@ class ShiftScheduleAPITester:
             return self.log_test("Manager Earnings History", False, 
                                f"- Error: {data.get('detail', 'Unknown error')}")
 
+    def test_payroll_export_csv(self) -> bool:
+        """Test the manager payroll export as CSV"""
+        if not self.manager_token or not self.default_store_id:
+            return self.log_test("Payroll Export CSV", False, "- Missing manager token or store ID")
+            
+        current_date = datetime.now()
+        date_from = current_date.replace(day=1).strftime("%Y-%m-%d")
+        date_to = (current_date + timedelta(days=1)).strftime("%Y-%m-%d")
+        url = (f"{self.base_url}/api/payroll?date_from={date_from}&date_to={date_to}"
+               f"&store_id={self.default_store_id}")
+        
+        try:
+            response = self.session.get(url, headers={'Authorization': f'Bearer {self.manager_token}'})
+            lines = response.text.strip().splitlines()
+            success = (response.status_code == 200 and lines and lines[0].startswith("store_id,store_name,employee_id")
+                       and any(self.created_employee_id in line for line in lines[1:]))
+            return self.log_test("Payroll Export CSV", success, 
+                               f"- Status: {response.status_code}, rows: {max(len(lines) - 1, 0)}")
+        except Exception as e:
+            return self.log_test("Payroll Export CSV", False, f"- Error: {str(e)}")
+
     def test_automatic_default_earnings_setting(self) -> bool:
         """Test that automatic default earnings (2000₽) are set for old shifts"""
         if not self.employee_token or not self.default_store_id:
@@ -766,6 +1110,7 @@ class ShiftScheduleAPITester:
         
         # Authentication tests
         self.test_manager_login()
+        self.test_metrics_endpoint()
         self.test_invalid_login()
         self.test_get_current_user()
         
@@ -782,6 +1127,7 @@ class ShiftScheduleAPITester:
         print("\n👥 USER MANAGEMENT TESTS")
         print("-" * 30)
         self.test_create_employee()
+        self.test_register_users_batch()
         self.test_employee_login()
         self.test_get_users_as_manager()
         self.test_get_users_as_employee()
@@ -799,7 +1145,15 @@ class ShiftScheduleAPITester:
         self.test_create_schedule_for_store()
         self.test_create_schedule_for_nonexistent_store()
         self.test_get_store_schedule()
+        self.test_schedule_conditional_get()
+        self.test_schedule_compact_format()
+        self.test_patch_schedule()
+        self.test_import_schedules_csv()
+        self.test_schedule_conflicts_report()
+        self.test_generate_schedule_preview()
+        self.test_coverage_heatmap()
         self.test_get_my_shifts_for_store()
+        self.test_my_shifts_query_budget()
         self.test_employee_access_unassigned_store_shifts()
         
         # Legacy format validation tests
@@ -817,10 +1171,12 @@ class ShiftScheduleAPITester:
         self.test_update_shift_earnings_as_employee_recent()
         self.test_update_shift_earnings_as_employee_old()
         self.test_update_earnings_nonexistent_shift()
+        self.test_concurrent_earnings_updates()
         self.test_employee_access_unassigned_store_earnings()
         self.test_get_earnings_history()
         self.test_get_earnings_history_unassigned_store()
         self.test_manager_get_earnings_history()
+        self.test_payroll_export_csv()
         self.test_automatic_default_earnings_setting()
         
         # Cleanup
@@ -832,6 +1188,8 @@ class ShiftScheduleAPITester:
         # Print summary
         print("=" * 70)
         print(f"📊 Test Results: {self.tests_passed}/{self.tests_run} tests passed")
+        if self.tests_skipped:
+            print(f"⏭️  {self.tests_skipped} tests skipped")
         
         if self.tests_passed == self.tests_run:
             print("🎉 All tests passed!")